@@ -2,10 +2,26 @@
 import asyncio
 import aiohttp
 import json
+import re
 from urllib.parse import urlparse
 from http.cookies import SimpleCookie
 from yarl import URL
 
+# 房间操作接口路径
+ROOM_ACTION_PATH = "/room/?ajax=1&api=json"
+
+# 房间操作响应分类
+ACTION_OK = "ok"  # 操作成功
+ACTION_REDIRECT = "redirect"  # 被重定向到休息室（已不在房间中）
+ACTION_THROTTLED = "throttled"  # 操作过于频繁
+ACTION_AUTH_LOST = "auth_lost"  # 登录状态失效
+ACTION_ERROR = "error"  # 其他错误
+
+# 加入房间过渡页面中的跳转地址（meta refresh 或 location 跳转）
+JOIN_REDIRECT_RE = re.compile(
+    r"""(?:http-equiv=["']?refresh["']?[^>]*?url=|location(?:\.href)?\s*=\s*|location\.replace\()["']?([^"'\s>)]+)""",
+    re.IGNORECASE)
+
 class DRRRAPI:
     """DRRR API通信类"""
     
@@ -17,6 +33,7 @@ class DRRRAPI:
         self.room_id = None
         self.room_info = None
         self.timeout = 30  # 请求超时时间（秒）
+        self.action_stats = {}  # 各类房间操作的耗时统计
         
     async def create_session(self):
         """创建HTTP会话"""
@@ -83,73 +100,108 @@ class DRRRAPI:
             print(f"获取休息室信息失败: {e}")
             return None
             
-    async def join_room(self, room_id):
-        """加入房间"""
+    @staticmethod
+    def is_in_room(data, room_id=None):
+        """根据房间JSON判断机器人是否已在房间中"""
+        if not isinstance(data, dict) or not isinstance(data.get("room"), dict):
+            return False
+        room = data["room"]
+        if room_id and room.get("roomId", room.get("id", room_id)) != room_id:
+            return False
+        profile = data.get("profile") or data.get("user") or {}
+        profile_id = profile.get("id") or profile.get("uid")
+        if not profile_id:
+            # 没有个人资料时，能拿到房间数据即视为已在房间中
+            return True
+        return any(user.get("id") == profile_id or user.get("uid") == profile_id
+                   for user in room.get("users", []))
+        
+    @staticmethod
+    def _extract_redirect(text):
+        """从加入房间的过渡页面中提取跳转地址"""
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict) and data.get("redirect"):
+                return data["redirect"]
+        except (json.JSONDecodeError, TypeError):
+            pass
+        match = JOIN_REDIRECT_RE.search(text or "")
+        return match.group(1) if match else None
+        
+    async def _fetch_room_json(self, url):
+        """获取房间JSON，返回 (状态码, 数据或响应文本)"""
+        session = await self.create_session()
+        async with session.get(url) as resp:
+            text = await resp.text()
+            try:
+                return resp.status, json.loads(text)
+            except json.JSONDecodeError:
+                return resp.status, text
+        
+    async def join_room(self, room_id, timeout=10.0):
+        """加入房间
+
+        按 检查 -> 授权 -> 跟随跳转 -> 轮询就绪 的顺序推进：授权后立即跟随服务器返回的
+        跳转地址，再以逐步增大的短间隔轮询房间JSON，一旦确认机器人已在房间中立即返回。
+        """
         session = await self.create_session()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        room_url = f"{self.base_url}/room/?id={room_id}&api=json"
         try:
-            # 首先尝试直接访问房间API
-            print(f"尝试直接访问房间API: {self.base_url}/room/?id={room_id}&api=json")
-            async with session.get(f"{self.base_url}/room/?id={room_id}&api=json") as resp:
-                print(f"房间API响应状态: {resp.status}")
-                if resp.status == 403:
-                    text = await resp.text()
-                    print(f"403响应内容: {text}")
-                    # 解析授权信息
-                    try:
-                        error_data = json.loads(text)
-                        if "authorization" in error_data and "id" in error_data:
-                            # 使用POST请求加入房间
-                            post_data = {
-                                'id': error_data['id'],
-                                'authorization': error_data['authorization']
-                            }
-                            print(f"发送加入房间POST请求，数据: {post_data}")
-                            async with session.post(f"{self.base_url}/room/", data=post_data) as post_resp:
-                                print(f"加入房间POST响应状态: {post_resp.status}")
-                                post_text = await post_resp.text()
-                                print(f"加入房间POST响应内容前200字符: {post_text[:200]}...")
-                                
-                                # 检查是否是重定向页面
-                                if "正在加入房间" in post_text or "You are joining room" in post_text:
-                                    print("检测到房间加入页面，可能需要等待重定向完成")
-                                    # 等待服务器处理并重定向
-                                    await asyncio.sleep(3)
-                        else:
-                            return {"success": False, "message": "缺少授权信息"}
-                    except json.JSONDecodeError:
-                        return {"success": False, "message": "解析授权信息失败: 无效的JSON格式"}
-                    except Exception as e:
-                        return {"success": False, "message": f"解析授权信息时出错: {e}"}
-                elif resp.status != 200:
-                    return {"success": False, "message": f"访问房间API失败: {resp.status}"}
-            
-            # 多次尝试获取房间信息
-            for attempt in range(3):
-                await asyncio.sleep(2)  # 等待服务器处理
-                print(f"第{attempt+1}次尝试获取房间信息...")
-                room_info = await self.get_room_info(room_id)
-                if room_info:
-                    self.room_id = room_id
-                    self.room_info = room_info
-                    return {"success": True, "message": "成功加入房间"}
-                else:
-                    print(f"第{attempt+1}次尝试获取房间信息失败")
-            
-            # 如果还是失败，尝试不带ID的API调用
+            # 检查: 已在房间中时直接返回
+            status, data = await self._fetch_room_json(room_url)
+            print(f"房间API响应状态: {status}")
+            if status == 200 and self.is_in_room(data, room_id):
+                return self._joined(room_id, data)
+                
+            if status == 403:
+                # 授权: 使用服务器下发的授权信息加入房间
+                if not isinstance(data, dict):
+                    return {"success": False, "message": "解析授权信息失败: 无效的JSON格式"}
+                if "authorization" not in data or "id" not in data:
+                    return {"success": False, "message": "缺少授权信息"}
+                post_data = {
+                    'id': data['id'],
+                    'authorization': data['authorization']
+                }
+                print(f"发送加入房间POST请求，数据: {post_data}")
+                async with session.post(f"{self.base_url}/room/", data=post_data) as post_resp:
+                    post_text = await post_resp.text()
+                    print(f"加入房间POST响应状态: {post_resp.status}")
+                    
+                # 跟随跳转: 过渡页面给出的地址即为完成加入所需的请求
+                redirect = self._extract_redirect(post_text)
+                if redirect:
+                    if redirect == "lounge" or "/lounge" in redirect:
+                        return {"success": False, "message": "加入房间失败: 被重定向到休息室"}
+                    redirect_url = redirect if redirect.startswith("http") else \
+                        f"{self.base_url}/{redirect.lstrip('/')}"
+                    print(f"跟随加入房间跳转: {redirect_url}")
+                    async with session.get(redirect_url) as redirect_resp:
+                        await redirect_resp.read()
+            elif status != 200:
+                return {"success": False, "message": f"访问房间API失败: {status}"}
+                
+            # 轮询就绪: 间隔从0.1秒开始逐步增大，最长1秒
+            interval = 0.1
+            attempt = 0
+            while loop.time() < deadline:
+                attempt += 1
+                status, data = await self._fetch_room_json(room_url)
+                if status == 200 and self.is_in_room(data, room_id):
+                    print(f"第{attempt}次轮询确认已加入房间")
+                    return self._joined(room_id, data)
+                if status in (401, 404):
+                    return {"success": False, "message": f"加入房间失败: {status}"}
+                await asyncio.sleep(min(interval, max(0.0, deadline - loop.time())))
+                interval = min(interval * 2, 1.0)
+                
+            # 最后尝试不带ID的API调用
             print("尝试不带ID的房间API调用...")
-            async with session.get(f"{self.base_url}/room/?api=json") as resp:
-                print(f"不带ID的房间API响应状态: {resp.status}")
-                if resp.status == 200:
-                    try:
-                        data = await resp.json()
-                        self.room_id = room_id
-                        self.room_info = data
-                        return {"success": True, "message": "成功加入房间"}
-                    except Exception as e:
-                        print(f"解析房间信息失败: {e}")
-                else:
-                    text = await resp.text()
-                    print(f"不带ID的房间API响应内容: {text[:100]}...")
+            status, data = await self._fetch_room_json(f"{self.base_url}/room/?api=json")
+            if status == 200 and self.is_in_room(data):
+                return self._joined(room_id, data)
             
             return {"success": False, "message": "加入房间失败: 无法获取房间信息"}
         except asyncio.TimeoutError:
@@ -157,66 +209,30 @@ class DRRRAPI:
         except Exception as e:
             return {"success": False, "message": f"加入房间时出错: {e}"}
             
+    def _joined(self, room_id, data):
+        """记录已加入的房间"""
+        self.room_id = room_id
+        self.room_info = data
+        return {"success": True, "message": "成功加入房间"}
+            
     async def send_message(self, message, url=None, to=None):
         """发送消息"""
-        session = await self.create_session()
-        try:
-            message_data = {'message': message}
-            if url:
-                message_data['url'] = url
-            if to:
-                message_data['to'] = to
-                
-            print(f"发送消息请求数据: {message_data}")
-                
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=message_data) as resp:
-                print(f"消息发送响应状态: {resp.status}")
-                if resp.status == 200:
-                    response_text = await resp.text()
-                    print(f"消息发送响应内容: {response_text}")
-                    # 检查是否被重定向到休息室
-                    try:
-                        response_data = json.loads(response_text)
-                        if response_data.get("redirect") == "lounge":
-                            print("警告: 消息发送被重定向到休息室，可能未真正发送到房间")
-                            return {"success": True, "message": "消息发送成功（但可能被重定向）"}
-                        else:
-                            return {"success": True, "message": "消息发送成功"}
-                    except json.JSONDecodeError:
-                        # 如果不是JSON，可能是HTML页面
-                        if "lounge" in response_text or "休息室" in response_text:
-                            print("警告: 消息发送返回了休息室页面，可能未真正发送到房间")
-                            return {"success": True, "message": "消息发送成功（但可能被重定向到休息室）"}
-                        else:
-                            return {"success": True, "message": "消息发送成功"}
-                else:
-                    response_text = await resp.text()
-                    print(f"消息发送响应内容: {response_text}")
-                    return {"success": False, "message": f"消息发送失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "消息发送超时"}
-        except Exception as e:
-            return {"success": False, "message": f"发送消息时出错: {e}"}
+        message_data = {'message': message}
+        if url:
+            message_data['url'] = url
+        if to:
+            message_data['to'] = to
+        print(f"发送消息请求数据: {message_data}")
+        return await self._post_action(message_data, "发送消息", "消息发送成功")
             
     async def send_music(self, title, url):
         """发送音乐"""
-        session = await self.create_session()
-        try:
-            music_data = {
-                'music': 'music',
-                'name': title,
-                'url': url
-            }
-                
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=music_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "音乐发送成功"}
-                else:
-                    return {"success": False, "message": f"音乐发送失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "音乐发送超时"}
-        except Exception as e:
-            return {"success": False, "message": f"发送音乐时出错: {e}"}
+        music_data = {
+            'music': 'music',
+            'name': title,
+            'url': url
+        }
+        return await self._post_action(music_data, "发送音乐", "音乐发送成功")
             
     async def get_room_info(self, room_id=None):
         """获取房间信息"""
@@ -254,99 +270,132 @@ class DRRRAPI:
             
     async def leave_room(self):
         """离开房间"""
-        session = await self.create_session()
-        try:
-            leave_data = {'leave': 'leave'}
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=leave_data) as resp:
-                if resp.status == 200:
-                    self.room_id = None
-                    self.room_info = None
-                    return {"success": True, "message": "成功离开房间"}
-                else:
-                    return {"success": False, "message": f"离开房间失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "离开房间超时"}
-        except Exception as e:
-            return {"success": False, "message": f"离开房间时出错: {e}"}
+        result = await self._post_action({'leave': 'leave'}, "离开房间", "成功离开房间")
+        if result["success"]:
+            self.room_id = None
+            self.room_info = None
+        return result
             
     async def kick_user(self, user_id):
         """踢出用户"""
-        session = await self.create_session()
-        try:
-            kick_data = {'kick': user_id}
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=kick_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "用户已踢出"}
-                else:
-                    return {"success": False, "message": f"踢出用户失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "踢出用户超时"}
-        except Exception as e:
-            return {"success": False, "message": f"踢出用户时出错: {e}"}
+        return await self._post_action({'kick': user_id}, "踢出用户", "用户已踢出")
             
     async def ban_user(self, user_id):
         """封禁用户"""
-        session = await self.create_session()
-        try:
-            ban_data = {'ban': user_id}
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=ban_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "用户已封禁"}
-                else:
-                    return {"success": False, "message": f"封禁用户失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "封禁用户超时"}
-        except Exception as e:
-            return {"success": False, "message": f"封禁用户时出错: {e}"}
+        return await self._post_action({'ban': user_id}, "封禁用户", "用户已封禁")
             
     async def unban_user(self, user_id, user_name):
         """解封用户"""
-        session = await self.create_session()
-        try:
-            unban_data = {
-                'unban': user_id,
-                'userName': user_name
-            }
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=unban_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "用户已解封"}
-                else:
-                    return {"success": False, "message": f"解封用户失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "解封用户超时"}
-        except Exception as e:
-            return {"success": False, "message": f"解封用户时出错: {e}"}
+        unban_data = {
+            'unban': user_id,
+            'userName': user_name
+        }
+        return await self._post_action(unban_data, "解封用户", "用户已解封")
             
     async def set_host(self, user_id):
         """转让房主"""
-        session = await self.create_session()
-        try:
-            host_data = {'new_host': user_id}
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=host_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "房主已转让"}
-                else:
-                    return {"success": False, "message": f"转让房主失败: {resp.status}"}
-        except asyncio.TimeoutError:
-            return {"success": False, "message": "转让房主超时"}
-        except Exception as e:
-            return {"success": False, "message": f"转让房主时出错: {e}"}
+        return await self._post_action({'new_host': user_id}, "转让房主", "房主已转让")
             
     async def set_dj_mode(self, is_dj_mode):
         """设置DJ模式"""
+        dj_data = {'dj_mode': str(is_dj_mode).lower()}
+        return await self._post_action(dj_data, "设置DJ模式", "DJ模式已设置")
+            
+    @staticmethod
+    def classify_action_response(status, text, action=""):
+        """对房间操作的响应进行分类，action 为操作名（请求数据的第一个键，如 leave、kick）"""
+        if status == 429:
+            return ACTION_THROTTLED
+        if status in (401, 403):
+            return ACTION_AUTH_LOST
+        if status != 200:
+            return ACTION_ERROR
+        try:
+            data = json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            data = None
+        if isinstance(data, dict):
+            redirect = data.get("redirect")
+            if redirect == "lounge":
+                # 离开房间后本来就会回到休息室
+                return ACTION_OK if action == "leave" else ACTION_REDIRECT
+            if redirect:
+                # 重定向到首页/登录页说明会话已失效
+                return ACTION_AUTH_LOST
+            error = str(data.get("error") or "")
+            if error:
+                lowered = error.lower()
+                if "too many" in lowered or "频繁" in error or "slow down" in lowered:
+                    return ACTION_THROTTLED
+                return ACTION_ERROR
+            return ACTION_OK
+        # 不是JSON的响应无法可靠判断，与接口返回200时一样视为成功
+        return ACTION_OK
+        
+    def _record_latency(self, action, elapsed, status):
+        """记录单类操作的耗时"""
+        stats = self.action_stats.setdefault(action, {
+            "count": 0, "failures": 0, "total_time": 0.0, "max_time": 0.0, "last_status": None
+        })
+        stats["count"] += 1
+        stats["total_time"] += elapsed
+        stats["max_time"] = max(stats["max_time"], elapsed)
+        stats["last_status"] = status
+        if status != ACTION_OK:
+            stats["failures"] += 1
+            
+    def get_action_stats(self):
+        """获取各类房间操作的耗时统计"""
+        return {
+            action: {**stats, "avg_time": stats["total_time"] / stats["count"] if stats["count"] else 0.0}
+            for action, stats in self.action_stats.items()
+        }
+        
+    async def _post_action(self, data, description, success_message):
+        """向房间发送操作请求，统一处理超时、错误和响应分类"""
         session = await self.create_session()
+        action = next(iter(data), "unknown")
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
         try:
-            dj_data = {'dj_mode': str(is_dj_mode).lower()}
-            async with session.post(f"{self.base_url}/room/?ajax=1&api=json", data=dj_data) as resp:
-                if resp.status == 200:
-                    return {"success": True, "message": "DJ模式已设置"}
-                else:
-                    return {"success": False, "message": f"设置DJ模式失败: {resp.status}"}
+            async with session.post(f"{self.base_url}{ROOM_ACTION_PATH}", data=data) as resp:
+                text = await resp.text()
+                status = self.classify_action_response(resp.status, text, action)
+                code = resp.status
         except asyncio.TimeoutError:
-            return {"success": False, "message": "设置DJ模式超时"}
+            self._record_latency(action, loop.time() - start_time, ACTION_ERROR)
+            return {"success": False, "message": f"{description}超时", "status": ACTION_ERROR}
         except Exception as e:
-            return {"success": False, "message": f"设置DJ模式时出错: {e}"}
+            self._record_latency(action, loop.time() - start_time, ACTION_ERROR)
+            return {"success": False, "message": f"{description}时出错: {e}", "status": ACTION_ERROR}
             
+        self._record_latency(action, loop.time() - start_time, status)
+        if status == ACTION_OK:
+            return {"success": True, "message": success_message, "status": status}
+        if status == ACTION_REDIRECT and action in ("message", "music"):
+            # 与原来一样视为已发送，只给出警告
+            print(f"警告: {description}被重定向到休息室，可能未真正发送到房间")
+            return {"success": True, "message": f"{success_message}（但可能被重定向）", "status": status}
+        if status == ACTION_REDIRECT:
+            print(f"警告: {description}被重定向到休息室，机器人可能已不在房间中")
+            message = f"{description}失败: 被重定向到休息室"
+        elif status == ACTION_THROTTLED:
+            message = f"{description}失败: 操作过于频繁"
+        elif status == ACTION_AUTH_LOST:
+            message = f"{description}失败: 登录状态已失效"
+        else:
+            print(f"{description}响应内容: {text[:200]}")
+            message = f"{description}失败: {code}"
+        return {"success": False, "message": message, "status": status}
+        
+    async def post_actions(self, actions):
+        """并发发送多个互不依赖的房间操作
+
+        actions 为 (data, description, success_message) 列表，请求通过保持连接的
+        连接池同时发出，结果按提交顺序返回。
+        """
+        return await asyncio.gather(*(self._post_action(*action) for action in actions))
+        
     async def close(self):
         """关闭会话"""
         if self.session:
@@ -1,173 +1,410 @@
 # WebSocket连接模块
+import abc
 import asyncio
 import json
+import queue
+import threading
 import time
-from typing import Callable, Dict, Any
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import aiohttp
 import websockets
-from urllib.parse import urlparse
 
-class DRRRWebSocketClient:
-    """DRRR WebSocket客户端"""
-    
-    def __init__(self, base_url: str = "https://drrr.com"):
+# 传输方式
+TRANSPORT_WEBSOCKET = "websocket"  # WebSocket推送
+TRANSPORT_LONGPOLL = "longpoll"  # 长轮询/流式推送
+TRANSPORT_POLLING = "polling"  # 定时轮询房间API
+
+
+def talk_key(talk: Dict[str, Any]) -> str:
+    """生成消息去重键"""
+    if talk.get('id'):
+        return str(talk['id'])
+    return f"{talk.get('message', '')}_{talk.get('from', {}).get('id', '')}_{talk.get('time', 0)}"
+
+
+def extract_talks(data: Any) -> List[Dict[str, Any]]:
+    """从推送数据中提取消息列表"""
+    if isinstance(data, list):
+        return [talk for talk in data if isinstance(talk, dict)]
+    if not isinstance(data, dict):
+        return []
+    if isinstance(data.get('talks'), list):
+        return extract_talks(data['talks'])
+    if isinstance(data.get('room'), dict):
+        return extract_talks(data['room'].get('talks', []))
+    if data.get('type'):
+        return [data]
+    return []
+
+
+class _SeenTalks:
+    """有界的已见消息集合"""
+
+    def __init__(self, limit: int = 1000):
+        self.limit = limit
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def add(self, talk: Dict[str, Any]) -> bool:
+        """记录消息，已见过时返回False"""
+        key = talk_key(talk)
+        if key in self._keys:
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.limit:
+            self._keys.popitem(last=False)
+        return True
+
+
+class TalkTransport(abc.ABC):
+    """消息传输方式基类
+
+    子类实现 talks()，以异步迭代的方式逐条产出新消息；连接断开时抛出异常，
+    由客户端决定重连或降级到其他传输方式。
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.seen = _SeenTalks()
+
+    async def open(self, session: aiohttp.ClientSession):
+        """建立连接"""
+        self.session = session
+
+    @abc.abstractmethod
+    def talks(self) -> AsyncIterator[Dict[str, Any]]:
+        """逐条产出新消息"""
+
+    async def close(self):
+        """关闭连接"""
+
+
+class PollingTransport(TalkTransport):
+    """定时轮询房间API"""
+
+    name = TRANSPORT_POLLING
+
+    def __init__(self, base_url: str, room_id: Optional[str] = None, interval: float = 3.0):
+        super().__init__()
+        self.base_url = base_url
+        self.room_id = room_id
+        self.interval = interval  # 轮询间隔（秒）
+
+    async def talks(self):
+        url = f"{self.base_url}/room/?api=json"
+        if self.room_id:
+            url = f"{self.base_url}/room/?id={self.room_id}&api=json"
+        while True:
+            started = time.monotonic()
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise ConnectionError(f"获取房间信息失败: {resp.status}")
+                data = json.loads(await resp.text())
+            for talk in extract_talks(data):
+                if self.seen.add(talk):
+                    yield talk
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+class LongPollTransport(TalkTransport):
+    """长轮询/流式推送
+
+    请求会一直挂起到有新消息为止；服务器以分块方式持续输出时，
+    每解析出一个完整的JSON文档就立即产出其中的消息。
+    两次请求的开始时间至少相隔 min_interval 秒；服务器立即返回且没有新消息时
+    （不支持挂起的接口），间隔逐次加倍直到 max_interval，收到新消息后恢复。
+    """
+
+    name = TRANSPORT_LONGPOLL
+
+    def __init__(self, base_url: str, path: str = "/json.php", timeout: float = 60.0,
+                 min_interval: float = 1.0, max_interval: float = 30.0):
+        super().__init__()
         self.base_url = base_url
+        self.path = path
+        self.timeout = timeout  # 单次挂起请求的最长时间（秒）
+        self.min_interval = min_interval  # 两次请求的最短间隔（秒）
+        self.max_interval = max_interval  # 空响应退避的最长间隔（秒）
+        self.last_update = 0  # 服务器返回的最新更新时间
+
+    def _handle_document(self, data: Any) -> List[Dict[str, Any]]:
+        if isinstance(data, dict) and data.get('update'):
+            self.last_update = data['update']
+        return [talk for talk in extract_talks(data) if self.seen.add(talk)]
+
+    async def talks(self):
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout)
+        interval = self.min_interval
+        while True:
+            started = time.monotonic()
+            received = False
+            url = f"{self.base_url}{self.path}?update={self.last_update}"
+            async with self.session.get(url, timeout=timeout) as resp:
+                if resp.status != 200:
+                    raise ConnectionError(f"长轮询请求失败: {resp.status}")
+                buffer = ""
+                async for line in resp.content:
+                    buffer += line.decode('utf-8', errors='ignore')
+                    if not buffer.strip():
+                        buffer = ""
+                        continue
+                    try:
+                        data = json.loads(buffer)
+                    except json.JSONDecodeError:
+                        continue  # 文档尚不完整，继续读取
+                    buffer = ""
+                    for talk in self._handle_document(data):
+                        received = True
+                        yield talk
+            if received:
+                interval = self.min_interval
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+            if not received:
+                interval = min(self.max_interval, interval * 2)
+
+
+class WebSocketTransport(TalkTransport):
+    """WebSocket推送"""
+
+    name = TRANSPORT_WEBSOCKET
+
+    def __init__(self, url: str, cookie_string: Optional[str] = None, heartbeat_interval: float = 30.0):
+        super().__init__()
+        self.url = url
+        self.cookie_string = cookie_string
+        self.heartbeat_interval = heartbeat_interval  # 无消息时发送心跳的间隔（秒）
         self.websocket = None
+
+    async def open(self, session: aiohttp.ClientSession):
+        await super().open(session)
+        headers = {"Cookie": self.cookie_string} if self.cookie_string else {}
+        try:
+            self.websocket = await websockets.connect(self.url, additional_headers=headers, open_timeout=10)
+        except TypeError:
+            # 旧版本websockets使用extra_headers参数
+            self.websocket = await websockets.connect(self.url, extra_headers=headers, open_timeout=10)
+
+    async def talks(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self.websocket.recv(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                await self.websocket.send(json.dumps({"type": "ping"}))
+                continue
+            try:
+                data = json.loads(message)
+            except json.JSONDecodeError:
+                print(f"无法解析JSON消息: {message}")
+                continue
+            for talk in extract_talks(data):
+                if talk.get('type') != 'pong' and self.seen.add(talk):
+                    yield talk
+
+    async def send(self, message: str) -> bool:
+        if self.websocket is None:
+            return False
+        await self.websocket.send(message)
+        return True
+
+    async def close(self):
+        if self.websocket is not None:
+            try:
+                await self.websocket.close()
+            except Exception as e:
+                print(f"关闭WebSocket时出错: {e}")
+            self.websocket = None
+
+
+class DRRRWebSocketClient:
+    """DRRR实时消息客户端
+
+    按优先级依次尝试 WebSocket -> 长轮询 -> 定时轮询，使用当前可用的传输方式接收消息，
+    并分发给已注册的处理器。连接断开时按指数退避重连，重新从优先级最高的方式开始尝试。
+    """
+
+    def __init__(self, base_url: str = "https://drrr.com", mode: str = "auto",
+                 ws_url: Optional[str] = None, fallback_polling: bool = True,
+                 poll_interval: float = 3.0):
+        self.base_url = base_url
+        self.mode = mode  # auto / websocket / longpoll / polling
+        self.ws_url = ws_url  # WebSocket地址，为空时跳过WebSocket
+        self.fallback_polling = fallback_polling  # 推送不可用时是否降级为定时轮询
+        self.poll_interval = poll_interval
+        self.transports: List[TalkTransport] = []
+        self.active_transport: Optional[TalkTransport] = None
+        self.session: Optional[aiohttp.ClientSession] = None
         self.message_handlers: Dict[str, Callable] = {}
+        self.talk_handlers: List[Callable] = []  # 接收所有消息的处理器
         self.is_connected = False
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
-        self.reconnect_delay = 5  # seconds
+        self.reconnect_delay = 1  # seconds，首次重连延迟
+        self.max_reconnect_delay = 30  # seconds
         self.should_reconnect = True
         self.cookie_string = None
         self.room_id = None
-        
+        self._loop = None
+        self._thread = None
+
     def register_message_handler(self, message_type: str, handler: Callable):
         """注册消息处理器"""
         self.message_handlers[message_type] = handler
-        
+
+    def register_talk_handler(self, handler: Callable):
+        """注册接收所有消息的处理器"""
+        self.talk_handlers.append(handler)
+
+    def build_transports(self) -> List[TalkTransport]:
+        """按模式构建传输方式列表（按优先级排序）"""
+        transports: List[TalkTransport] = []
+        if self.mode in ("auto", TRANSPORT_WEBSOCKET) and self.ws_url:
+            transports.append(WebSocketTransport(self.ws_url, self.cookie_string))
+        if self.mode in ("auto", TRANSPORT_LONGPOLL):
+            transports.append(LongPollTransport(self.base_url))
+        if self.mode == TRANSPORT_POLLING or self.fallback_polling:
+            transports.append(PollingTransport(self.base_url, self.room_id, self.poll_interval))
+        return transports
+
     async def connect(self, cookie_string: str = None, room_id: str = None):
-        """连接WebSocket"""
+        """连接并持续接收消息"""
         self.cookie_string = cookie_string
         self.room_id = room_id
         self.should_reconnect = True
-        
-        while self.should_reconnect and self.reconnect_attempts < self.max_reconnect_attempts:
-            try:
-                # 构建WebSocket URL
-                # DRRR使用长轮询而不是WebSocket，所以我们需要模拟浏览器的行为
-                # 这里我们暂时禁用WebSocket连接，改为使用API轮询
-                print("DRRR平台不支持标准WebSocket，使用API轮询替代")
-                return
-                
-                # 如果平台确实支持WebSocket，URL可能如下：
-                # ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
-                # if self.room_id:
-                #     ws_url += f"/ws/room/{self.room_id}"
-                # else:
-                #     ws_url += "/ws"
-                    
-                # print(f"尝试连接WebSocket: {ws_url}")
-                
-                # headers = {}
-                # if self.cookie_string:
-                #     headers["Cookie"] = self.cookie_string
-                    
-                # # 设置连接超时
-                # self.websocket = await websockets.connect(
-                #     ws_url,
-                #     extra_headers=headers,
-                #     timeout=10
-                # )
-                
-                self.is_connected = True
-                self.reconnect_attempts = 0
-                print("WebSocket连接成功")
-                
-                # 开始监听消息
-                await self._listen()
-                
-            except asyncio.TimeoutError:
-                print("WebSocket连接超时")
-                await self._reconnect()
-            except websockets.exceptions.InvalidStatusCode as e:
-                print(f"WebSocket连接状态码错误: {e}")
-                await self._reconnect()
-            except websockets.exceptions.InvalidHandshake as e:
-                print(f"WebSocket握手失败: {e}")
-                await self._reconnect()
-            except Exception as e:
-                print(f"WebSocket连接失败: {e}")
-                await self._reconnect()
-                
-    async def _listen(self):
-        """监听WebSocket消息"""
+        self.transports = self.build_transports()
+        if not self.transports:
+            print("没有可用的消息传输方式")
+            return
+        headers = {"Cookie": cookie_string} if cookie_string else {}
+        self.session = aiohttp.ClientSession(headers=headers)
+        try:
+            while self.should_reconnect and self.reconnect_attempts < self.max_reconnect_attempts:
+                for transport in self.transports:
+                    if not self.should_reconnect:
+                        break
+                    await self._run_transport(transport)
+                if self.should_reconnect:
+                    await self._reconnect()
+        finally:
+            self.is_connected = False
+            await self.session.close()
+            self.session = None
+
+    async def _run_transport(self, transport: TalkTransport):
+        """使用指定传输方式接收消息，直到连接断开"""
         try:
-            while self.is_connected and self.websocket and self.should_reconnect:
-                try:
-                    # 设置接收超时
-                    message = await asyncio.wait_for(self.websocket.recv(), timeout=30.0)
-                    await self._handle_message(message)
-                except asyncio.TimeoutError:
-                    # 心跳检测或保持连接
-                    print("WebSocket接收超时，发送心跳")
-                    await self._send_heartbeat()
+            await transport.open(self.session)
+            self.active_transport = transport
+            self.is_connected = True
+            print(f"消息传输已连接: {transport.name}")
+            async for talk in transport.talks():
+                # 收到消息说明连接可用，重置重连计数
+                self.reconnect_attempts = 0
+                await self._dispatch(talk)
+                if not self.should_reconnect:
+                    break
+        except asyncio.CancelledError:
+            raise
         except websockets.exceptions.ConnectionClosed:
-            print("WebSocket连接已关闭")
-            await self._reconnect()
+            print(f"{transport.name} 连接已关闭")
         except Exception as e:
-            print(f"WebSocket监听出错: {e}")
-            await self._reconnect()
-            
-    async def _send_heartbeat(self):
-        """发送心跳包"""
+            print(f"{transport.name} 连接失败: {e}")
+        finally:
+            self.is_connected = False
+            self.active_transport = None
+            await transport.close()
+
+    async def _dispatch(self, talk: Dict[str, Any]):
+        """分发单条消息"""
+        for handler in self.talk_handlers:
+            try:
+                result = handler(talk)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"处理消息时出错: {e}")
+        handler = self.message_handlers.get(talk.get("type", "unknown"))
         try:
-            if self.websocket and self.is_connected:
-                # 发送心跳消息（根据实际API调整）
-                heartbeat_msg = json.dumps({"type": "ping"})
-                await self.websocket.send(heartbeat_msg)
+            if handler:
+                await handler(talk)
+            elif not self.talk_handlers:
+                await self._default_message_handler(talk)
         except Exception as e:
-            print(f"发送心跳包失败: {e}")
-            
+            print(f"处理消息时出错: {e}")
+
     async def _handle_message(self, message: str):
-        """处理接收到的消息"""
+        """处理接收到的原始消息"""
         try:
-            data = json.loads(message)
-            message_type = data.get("type", "unknown")
-            
-            # 调用相应的消息处理器
-            if message_type in self.message_handlers:
-                await self.message_handlers[message_type](data)
-            else:
-                # 默认处理程序
-                await self._default_message_handler(data)
-                
+            for talk in extract_talks(json.loads(message)):
+                await self._dispatch(talk)
         except json.JSONDecodeError:
             print(f"无法解析JSON消息: {message}")
-        except Exception as e:
-            print(f"处理消息时出错: {e}")
-            
+
     async def _default_message_handler(self, data: Dict[str, Any]):
         """默认消息处理器"""
         print(f"收到消息: {data}")
-        
+
     async def _reconnect(self):
-        """重新连接"""
+        """所有传输方式都断开后，等待退避时间再重新连接"""
         if not self.should_reconnect:
             return
-            
+
         self.is_connected = False
         self.reconnect_attempts += 1
-        
+
         if self.reconnect_attempts >= self.max_reconnect_attempts:
             print("达到最大重连次数，停止重连")
             return
-            
-        print(f"尝试重新连接 ({self.reconnect_attempts}/{self.max_reconnect_attempts})")
-        await asyncio.sleep(self.reconnect_delay)
-        
-        # 重新连接
-        # 注意：这里会重新调用connect方法
-        
+
+        delay = min(self.max_reconnect_delay, self.reconnect_delay * (2 ** (self.reconnect_attempts - 1)))
+        print(f"尝试重新连接 ({self.reconnect_attempts}/{self.max_reconnect_attempts})，{delay}秒后重试")
+        await asyncio.sleep(delay)
+
     async def send_message(self, message: str):
         """发送消息"""
-        if self.websocket and self.is_connected:
+        transport = self.active_transport
+        if isinstance(transport, WebSocketTransport) and self.is_connected:
             try:
-                await self.websocket.send(message)
-                return True
+                return await transport.send(message)
             except Exception as e:
                 print(f"发送消息失败: {e}")
                 return False
         else:
             print("WebSocket未连接")
             return False
-            
+
     async def close(self):
         """关闭连接"""
         self.should_reconnect = False
         self.is_connected = False
-        if self.websocket:
+        if self.active_transport:
+            await self.active_transport.close()
+
+    def start_background(self, talk_queue: "queue.Queue", cookie_string: str = None, room_id: str = None):
+        """在后台线程的事件循环中运行，收到的消息放入队列供同步代码消费"""
+        self.register_talk_handler(talk_queue.put)
+
+        def run():
+            self._loop = asyncio.new_event_loop()
             try:
-                await self.websocket.close()
+                self._loop.run_until_complete(self.connect(cookie_string, room_id))
             except Exception as e:
-                print(f"关闭WebSocket时出错: {e}")
-            self.websocket = None
\ No newline at end of file
+                print(f"后台消息传输出错: {e}")
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop_background(self):
+        """停止后台运行"""
+        self.should_reconnect = False
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._cancel_tasks)
+
+    @staticmethod
+    def _cancel_tasks():
+        for task in asyncio.all_tasks():
+            task.cancel()
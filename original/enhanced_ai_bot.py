@@ -12,9 +12,37 @@ import re
 import random
 import threading
 import os
+import queue
+import signal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse
 import logging
 
+from modules.acl_store import ACLStore
+from modules.user_directory import UserDirectory
+from modules.command_router import CommandRouter
+from modules.joke_pool import JokePool, joke_fingerprint
+from modules.conversation_memory import ConversationMemory
+from modules.moderation_classifier import (ModerationClassifier, ViolationJournal,
+                                           VERDICT_CLEAN, VERDICT_VIOLATION)
+from modules.moderation_batcher import ModerationBatcher, build_batch_prompt
+from modules.music_search import MusicSearchClient
+from modules.tts_client import TTSClient, tts_key
+from modules.playlist import PLAY_MODES, Playlist
+from modules.link_validator import LinkValidator, format_duration
+from utils.worker_pool import WorkerPool
+from utils.ttl_cache import TTLCache
+from utils.helpers import normalize_prompt, link_expiry
+from utils.single_flight import SingleFlight
+from utils.latency import LatencyTracker
+from utils.streaming import StreamSegmenter, iter_response_text
+from utils.state_snapshot import StateSnapshot
+from modules.reconnect import ReconnectController, STATE_CONNECTED
+from smart_login_bot import SmartLoginBot
+from api.websocket_client import DRRRWebSocketClient, TRANSPORT_POLLING
+from api.drrr_api import DRRRAPI, ACTION_OK, ACTION_REDIRECT, ACTION_AUTH_LOST, ACTION_ERROR
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +55,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+class AIErrorMessage(str):
+    """AI接口调用失败时返回的提示信息（可直接作为消息发送，但不会被缓存或记入对话记忆）"""
+
 class DRRREnhancedAIBot:
     """DRRR增强版AI机器人"""
     
@@ -46,6 +77,14 @@ class DRRREnhancedAIBot:
         # AI模型设置
         self.ai_models = ["V3", "R1"]
         self.current_ai_model = "V3"  # 默认使用V3模型
+        self.ai_model_params = {model: {} for model in self.ai_models}  # 各模型额外的请求参数（接口支持时在此配置）
+        self.ai_latency = {model: LatencyTracker() for model in self.ai_models}  # 各模型的延迟统计
+        self.ai_deadline = 45  # 单个AI请求（含重试）的总时限（秒）
+        self.ai_hedge_enabled = True  # 请求超过当前模型的p90延迟仍未返回时再发送一次相同的请求
+        self.ai_hedge_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix="ai-hedge")
+        # 流式输出：支持SSE或分块传输的AI接口地址，设置后回复每凑满一段立即发送
+        self.ai_stream_url = None
+        self.ai_stream_backend = None  # 可替换的流式后端（如 utils.streaming.iter_fake_stream），参数为问题
         
         # 不当言论关键词列表（用于最小化发送到AI的文本量）
         self.inappropriate_keywords = [
@@ -53,8 +92,38 @@ class DRRREnhancedAIBot:
             "威胁", "恐吓", "歧视", "仇恨", "违法", "敏感", "政治", "宗教"
         ]
         
-        # 音乐点播列表
-        self.music_playlist = []
+        # 本地审核分类器：由违规日志训练。训练完成前只使用关键词审核，不调用远程AI；
+        # 本地判定违规的消息需经AI确认后才计入违规次数（可能触发禁言/踢出）
+        self.violation_journal = ViolationJournal("moderation_journal.jsonl")
+        self.moderation_classifier = ModerationClassifier(path="moderation_model.npz")
+        self.moderation_learning = False  # 分类器训练完成前是否把消息交给AI标注（积累训练样本）
+        self.moderation_retrain_every = 50  # 新增多少条样本后重新训练
+        self.moderation_trained_at = 0  # 上次训练时的日志记录数
+        self.moderation_stats = {'clean': 0, 'violation': 0, 'confirmed': 0, 'forwarded': 0, 'dropped': 0}
+        # 不确定的消息最多凑满10条或等待2秒后合并为一个请求发送给AI
+        self.moderation_batcher = ModerationBatcher(self.ai_moderation_batch, self.ai_moderation_verdict,
+                                                    self.apply_moderation_verdict, max_batch=10, max_wait=2.0)
+        if not self.moderation_classifier.ready:
+            self.moderation_classifier.train(self.violation_journal.samples())
+        
+        # QQ音乐搜索客户端，按关键词缓存搜索结果和播放链接（使用独立的会话，不带房间Cookie）
+        self.music_search = MusicSearchClient()
+        
+        # 音乐点播列表：按编号O(1)增删和移动，同一链接只保存一份，每人最多点10首，播放后移出
+        self.music_playlist = Playlist(max_size=5000, max_per_user=10, consume=True)
+        # 后台并发检测新点歌曲的链接，失效的标记后跳过；即将过期的QQ音乐链接在播放前按原搜索条件刷新
+        # 链接由用户提交，检测使用独立的会话，不带房间Cookie
+        self.link_validator = LinkValidator(on_result=self.handle_link_result, max_workers=4, max_queue=100)
+        # QQ音乐搜索结果中的播放链接 -> [关键词, 序号]，点歌时记录到歌曲上用于刷新链接
+        self.music_sources = TTLCache(max_size=256, ttl=self.music_search.url_ttl)
+        self.link_expires = {}  # 歌曲编号 -> 链接过期时间
+        self.link_refreshed = {}  # 歌曲编号 -> 上次刷新链接的时间
+        self.link_lock = threading.Lock()  # 检测线程、命令线程和监控线程都会读写上面两个字典
+        self.qq_link_ttl = 60 * 60  # QQ音乐链接没有过期参数时按1小时计算
+        self.link_refresh_margin = 10 * 60  # 距过期不足此时间时刷新（秒）
+        self.link_prefetch_window = 5  # 检查即将播放的歌曲数
+        self.link_prefetch_interval = 30  # 检查间隔（秒）
+        self.last_link_prefetch = 0
         self.auto_play_enabled = False  # 自动播放功能开关
         self.last_auto_play_time = 0
         self.auto_play_interval = 5 * 60  # 自动播放间隔（5分钟）
@@ -62,6 +131,13 @@ class DRRREnhancedAIBot:
         # 已欢迎的用户列表
         self.welcomed_users = set()
         
+        # 房间用户目录（用户名 <-> ID <-> tripcode），由房间快照增量维护
+        self.user_directory = UserDirectory()
+        
+        # 批量管理操作设置
+        self.bulk_concurrency = 4  # 同时进行的管理请求数
+        self.bulk_retries = 2  # 单个目标失败后的重试次数
+        
         # 挂房功能相关
         self.hang_room_enabled = True
         self.last_hang_room_time = 0
@@ -76,6 +152,22 @@ class DRRREnhancedAIBot:
         self.recent_messages = []  # 存储最近发送的消息
         self.max_recent_messages = 10  # 最多存储10条最近消息
         
+        # 已处理的房间消息，用于去重（按处理顺序，超出上限时淘汰最早的）
+        self.processed_talks = OrderedDict()
+        self.max_processed_talks = 1000
+        
+        # 已欢迎用户、最近消息和已处理消息会被多个线程修改，修改和保存快照时的复制都在锁内进行
+        self.state_lock = threading.Lock()
+        
+        # 状态快照：播放列表、已欢迎用户、最近消息、功能开关和已处理消息定期保存，重启后恢复
+        # 已处理消息只追加，增量中只写入新处理的消息
+        self.state_snapshot = StateSnapshot("bot_state.json",
+                                            append_fields={'processed_talks': self.max_processed_talks})
+        self.snapshot_interval = 10  # 检查状态变化并保存的间隔（秒）
+        self.last_snapshot_time = 0
+        self.state_loaded = False  # 是否已读取过快照，未读取时不保存，避免覆盖上次的状态
+        self.restart_grace = 10 * 60  # 快照在此时间内保存的视为重启，不重复发送上线消息（秒）
+        
         # 用户消息频率限制
         self.user_message_times = {}  # 存储用户最近消息的时间戳
         self.message_limit = 5  # 限制用户在指定时间内发送的消息数量
@@ -90,9 +182,60 @@ class DRRREnhancedAIBot:
         self.violations_file = "user_violations.json"
         self.load_user_violations()
         
+        # 权限列表（管理员/封禁/白名单/黑名单），持久化到磁盘
+        self.acl_file = "acl.jsonl"
+        self.acl = ACLStore(self.acl_file)
+        if self.acl.is_empty('admins'):
+            # 首次运行时以默认管理员初始化
+            self.acl.add('admins', name=self.admin_name)
+        
+        # AI对话请求使用独立的有界线程池：最多3个并发调用，最多排队10个，每个用户同时只能有1个请求
+        self.ai_pool = WorkerPool(max_workers=3, max_queue=10, per_user_limit=1, name="ai")
+        self.stop_event = threading.Event()  # 关闭时中断AI重试等待
+        
+        # 相同的AI/搜索/TTS/翻译请求同时只调用一次上游接口，等待者共享结果
+        self.single_flight = SingleFlight()
+        
+        # 每个用户的AI对话记忆（有字符预算，超出时压缩最早的对话，30分钟无对话清除）
+        # 提示词作为GET参数发送，URL编码后限制在4KB以内，避免请求行过长（HTTP 414）
+        self.conversation_memory = ConversationMemory(budget=400, summary_budget=100, turn_limit=200,
+                                                      ttl=30 * 60, max_prompt_bytes=4096)
+        
+        # AI回复缓存：按规范化的问题和模型缓存，持久化到SQLite，重启后仍可命中
+        self.ai_cache = TTLCache(max_size=500, ttl=6 * 3600, path="ai_cache.sqlite3")
+        
+        # 文本转语音客户端：音频链接按 hash(文本, 声音) 缓存并持久化；使用独立会话，不携带房间Cookie
+        self.tts = TTSClient(cache_path="tts_cache.sqlite3")
+        
+        # 预取的笑话池：AI接口空闲时在后台补充，/joke 直接从池中取
+        self.joke_pool = JokePool(self.fetch_joke, path="joke_pool.json", max_size=20,
+                                  is_idle=lambda: self.ai_pool.pending() == 0)
+        
+        # 会阻塞的命令（第三方接口调用）在工作线程池中执行，监控线程不等待
+        self.command_pool = WorkerPool(max_workers=4, max_queue=16, per_user_limit=1, name="command")
+        
+        # 聊天命令注册表：每条消息只解析一次，O(1) 查找命令
+        self.commands = CommandRouter()
+        self.register_commands()
+        
         # 保存配置信息用于重连
         self.cookie_string = None
         self.room_id_saved = None
+        self.login_config_file = "login_config.json"
+        self.bot_name = "AI机器人"
+        
+        # 实时消息传输（websocket / longpoll / auto），polling 表示只使用监控循环的轮询
+        self.transport_mode = TRANSPORT_POLLING
+        self.ws_url = None
+        self.push_client = None
+        self.pushed_talks = queue.Queue()
+        
+        # 断线重连控制器：在后台尝试重连，不阻塞监控循环
+        self.reconnect_controller = ReconnectController(
+            rejoin=self._rejoin_room,
+            reload_cookie=self._reload_cookie,
+            on_state_change=self._on_connection_state_change
+        )
         
         # 设置请求头，模拟真实浏览器
         self.session.headers.update({
@@ -171,7 +314,7 @@ class DRRREnhancedAIBot:
         logger.error("获取房间信息失败，已达到最大重试次数")
         return None
         
-    def join_room(self, room_id, max_retries=3):
+    def join_room(self, room_id, max_retries=3, timeout=30):
         """加入房间"""
         self.room_id = room_id
         
@@ -183,7 +326,7 @@ class DRRREnhancedAIBot:
                 logger.info(f"正在加入房间: {join_url} (尝试 {attempt+1}/{max_retries})")
                 
                 # 先发送GET请求访问房间页面
-                response = self.session.get(join_url, timeout=30)
+                response = self.session.get(join_url, timeout=timeout)
                 logger.info(f"访问房间页面响应状态: {response.status_code}")
                 
                 if response.status_code == 200:
@@ -310,79 +453,196 @@ class DRRREnhancedAIBot:
         logger.error("消息发送失败，已达到最大重试次数")
         return False
         
-    def is_admin(self, user_name):
+    def is_admin(self, user_name, user_id=None, tripcode=None):
         """检查用户是否为管理员"""
-        return user_name == self.admin_name
+        return self.acl.contains('admins', user_id=user_id, name=user_name, tripcode=tripcode)
+        
+    def is_denied(self, user_name, user_id=None, tripcode=None):
+        """检查用户是否被封禁或在黑名单中"""
+        return (self.acl.contains('banned', user_id=user_id, name=user_name, tripcode=tripcode) or
+                self.acl.contains('blacklist', user_id=user_id, name=user_name, tripcode=tripcode))
         
-    def handle_admin_commands(self, user_name, message_text):
-        """处理管理员命令"""
-        if not self.is_admin(user_name):
+    def register_commands(self):
+        """注册聊天命令及其权限、参数和频率限制"""
+        register = self.commands.register
+
+        # AI功能命令（对话所有用户可用，开关和模型设置仅限管理员）
+        register('ai', self.command_ai, cooldown=2)
+        register('ai on', lambda user_name, text: self.set_feature('ai_enabled', True, "AI对话功能已开启"),
+                 admin_only=True, max_args=0)
+        register('ai off', lambda user_name, text: self.set_feature('ai_enabled', False, "AI对话功能已关闭"),
+                 admin_only=True, max_args=0)
+        register('ai model', self.command_ai_model, admin_only=True)
+        register('ai models', self.command_ai_models, admin_only=True, max_args=0)
+        register('ai cache', self.command_ai_cache, admin_only=True, max_args=1,
+                 usage="请使用格式: /ai cache [clear]")
+        register('ai manage stats', self.command_ai_manage_stats, admin_only=True, max_args=0)
+        register('ai manage learn', self.command_ai_manage_learn, admin_only=True, min_args=1, max_args=1,
+                 usage="请使用格式: /ai manage learn on|off")
+        register('ai manage', self.command_ai_manage, admin_only=True, min_args=1, max_args=1,
+                 usage="请使用格式: /ai manage on|off")
+
+        # 音乐点播命令（所有用户）
+        register('play', self.command_play, min_args=2, usage="请使用格式: /play <歌曲名> <链接>")
+        register('netmusic', self.command_netmusic, min_args=1, usage="请提供要搜索的歌曲名: /netmusic <歌曲名>")
+        register('qqmusic', self.command_qqmusic, min_args=1, cooldown=5, background=True,
+                 usage="请提供要搜索的歌曲名: /qqmusic <歌曲名> [序号]")
+        register('tts', self.command_tts, min_args=1, cooldown=5, background=True,
+                 usage="请提供要转换的文本: /tts <文本>")
+        register('next', lambda user_name, text: self.play_music())
+        register('playlist', self.command_playlist)
+        register('playlist remove', self.command_playlist_remove, min_args=1, max_args=1,
+                 usage="请使用格式: /playlist remove <编号>")
+        register('playlist top', self.command_playlist_top, min_args=1, max_args=1,
+                 usage="请使用格式: /playlist top <编号>")
+        register('playlist mode', self.command_playlist_mode, admin_only=True, min_args=1, max_args=1,
+                 usage=f"请使用格式: /playlist mode {'|'.join(PLAY_MODES)}")
+        register('clear', self.command_clear)
+        # 旧的/music命令格式
+        register('music add', self.command_music_add, min_args=1, usage="请使用格式: /music add <链接>")
+        register('music list', self.command_playlist)
+        register('music play', lambda user_name, text: self.play_music())
+
+        # 信息查询命令（所有用户）
+        register('joke', self.command_joke, cooldown=3, background=True)
+        register('translate', self.command_translate, min_args=1, cooldown=3, background=True,
+                 usage="请提供要翻译的内容: /translate <内容>")
+
+        # 系统命令（仅限管理员）
+        register('hang', self.command_hang, admin_only=True, min_args=1, max_args=1,
+                 usage="请使用格式: /hang on|off")
+        register('help', self.command_help, admin_only=True)
+        register('kick', self.command_kick, admin_only=True, min_args=1,
+                 usage="请提供要踢出的用户名: /kick <用户名>")
+        register('ban', self.command_ban, admin_only=True, min_args=1,
+                 usage="请提供要封禁的用户名: /ban <用户名>")
+        register('unban', self.command_unban, admin_only=True, min_args=1,
+                 usage="请提供要解封的用户名: /unban <用户名>")
+        for action in ('kick', 'ban'):
+            for selector in ('pattern', 'recent'):
+                register(f'{action}-{selector}',
+                         lambda user_name, text, action=action, selector=selector:
+                         self.handle_bulk_command(action, selector, text),
+                         admin_only=True, background=True)
+
+    def dispatch_command(self, user_name, user_id, message_text, is_admin=False):
+        """解析并执行聊天命令，返回消息是否为命令"""
+        match = self.commands.route(message_text, user_id or user_name, is_admin)
+        if match is None:
             return False
-            
-        # 移除命令前缀
-        command = message_text.lstrip('/')
+        if match.error:
+            self.send_message(match.error)
+            return True
+        if match.spec.background:
+            self.run_in_background(user_name, user_id, match.spec.handler, match.text)
+        else:
+            match.spec.handler(user_name, match.text)
+        return True
         
-        # 处理管理命令
-        if command.startswith('ai manage'):
-            if 'on' in command:
-                self.ai_manage_enabled = True
-                self.send_message("AI房间管理功能已开启")
-                logger.info("AI房间管理功能已开启")
-                return True
-            elif 'off' in command:
-                self.ai_manage_enabled = False
-                self.send_message("AI房间管理功能已关闭")
-                logger.info("AI房间管理功能已关闭")
-                return True
-                
-        elif command.startswith('ai'):
-            if 'on' in command:
-                self.ai_enabled = True
-                self.send_message("AI对话功能已开启")
-                logger.info("AI对话功能已开启")
-                return True
-            elif 'off' in command:
-                self.ai_enabled = False
-                self.send_message("AI对话功能已关闭")
-                logger.info("AI对话功能已关闭")
-                return True
-            elif command.strip() == 'ai model':
-                # 查看当前AI模型
-                self.send_message(f"当前AI模型: {self.current_ai_model}")
-                return True
-            elif command.startswith('ai model '):
-                # 切换AI模型
-                model_name = command[9:].strip()  # 移除'ai model '前缀
-                if model_name in self.ai_models:
-                    self.current_ai_model = model_name
-                    self.send_message(f"AI模型已切换为: {model_name}")
-                    logger.info(f"AI模型已切换为: {model_name}")
-                else:
-                    models_list = ", ".join(self.ai_models)
-                    self.send_message(f"无效的AI模型: {model_name}\n可用模型: {models_list}")
-                return True
-            elif command.strip() == 'ai models':
-                # 查看可用AI模型列表
-                models_list = ", ".join(self.ai_models)
-                self.send_message(f"可用AI模型: {models_list}")
-                return True
-                
-        elif command.startswith('hang'):
-            if 'on' in command:
-                self.hang_room_enabled = True
-                self.send_message("挂房功能已开启")
-                logger.info("挂房功能已开启")
-                return True
-            elif 'off' in command:
-                self.hang_room_enabled = False
-                self.send_message("挂房功能已关闭")
-                logger.info("挂房功能已关闭")
-                return True
-                
-        elif command.startswith('help'):
-            # 显示帮助信息
-            help_text = """DRRR 增强版AI机器人 帮助信息:
-            
+    def run_in_background(self, user_name, user_id, handler, text):
+        """将会阻塞的命令交给工作线程池，队列已满或用户已有请求在处理时直接回复"""
+        future, reason = self.command_pool.submit(user_id or user_name, handler, user_name, text)
+        if future is None:
+            logger.info(f"拒绝用户 {user_name} 的命令: {reason}")
+            self.send_message(f"@{user_name} {reason}")
+            return
+        # 所有工作线程都在忙时告知排队位置
+        waiting = self.command_pool.waiting()
+        if waiting:
+            self.send_message(f"@{user_name} 请求已排队，当前排在第{waiting}位")
+
+    def set_feature(self, attribute, enabled, notice):
+        """切换功能开关并通知房间"""
+        setattr(self, attribute, enabled)
+        self.send_message(notice)
+        logger.info(notice)
+
+    def command_ai_model(self, user_name, model_name):
+        """查看或切换AI模型"""
+        if not model_name:
+            self.send_message(f"当前AI模型: {self.current_ai_model}")
+        elif model_name in self.ai_models:
+            self.current_ai_model = model_name
+            self.send_message(f"AI模型已切换为: {model_name}")
+            logger.info(f"AI模型已切换为: {model_name}")
+        else:
+            models_list = ", ".join(self.ai_models)
+            self.send_message(f"无效的AI模型: {model_name}\n可用模型: {models_list}")
+
+    def command_ai_models(self, user_name, text):
+        """查看可用AI模型列表"""
+        models_list = ", ".join(
+            f"{model}（平均{self.ai_latency[model].ewma:.1f}秒）" if self.ai_latency[model].count else model
+            for model in self.ai_models)
+        self.send_message(f"可用AI模型: {models_list}")
+
+    def command_ai_cache(self, user_name, text):
+        """查看或清空AI回复缓存"""
+        if text.lower() == 'clear':
+            self.ai_cache.clear()
+            self.send_message("AI回复缓存已清空")
+            return
+        stats = self.ai_cache.stats()
+        self.send_message(f"AI回复缓存: {stats['size']}条，命中{stats['hits']}次"
+                          f"（磁盘{stats['disk_hits']}次），未命中{stats['misses']}次，"
+                          f"命中率{stats['hit_rate']:.1%}")
+        
+    def ai_cache_key(self, user_message):
+        """AI回复缓存键：当前模型 + 规范化后的问题"""
+        return f"{self.current_ai_model}\n{normalize_prompt(user_message)}"
+        
+    def command_ai_manage(self, user_name, switch):
+        """开关AI房间管理功能"""
+        if switch.lower() == 'on':
+            self.set_feature('ai_manage_enabled', True, "AI房间管理功能已开启")
+        elif switch.lower() == 'off':
+            self.set_feature('ai_manage_enabled', False, "AI房间管理功能已关闭")
+        else:
+            self.send_message("请使用格式: /ai manage on|off")
+
+    def command_ai_manage_learn(self, user_name, switch):
+        """开关AI标注：分类器训练完成前把消息交给AI标注，用于积累训练样本"""
+        if switch.lower() == 'on':
+            self.set_feature('moderation_learning', True, "AI审核标注已开启，消息将发送给AI标注以训练本地分类器")
+        elif switch.lower() == 'off':
+            self.set_feature('moderation_learning', False, "AI审核标注已关闭")
+        else:
+            self.send_message("请使用格式: /ai manage learn on|off")
+
+    def command_ai_manage_stats(self, user_name, text):
+        """查看AI房间管理的本地分类统计"""
+        stats = self.moderation_stats
+        total = stats['clean'] + stats['violation'] + stats['forwarded'] + stats['dropped']
+        local = stats['clean'] + stats['violation']
+        classifier = self.moderation_classifier
+        if not classifier.available:
+            state = "未安装numpy，分类器不可用"
+        elif classifier.ready:
+            state = f"已用{classifier.trained_samples}条样本训练"
+        else:
+            state = "样本不足，尚未训练（仅使用关键词审核）"
+        self.send_message(f"AI房间管理: 共审核{total}条，本地判定{local}条"
+                          f"（违规{stats['violation']}，AI确认{stats['confirmed']}），转交AI {stats['forwarded']}条，"
+                          f"队列已满跳过{stats['dropped']}条；分类器{state}")
+        batcher = self.moderation_batcher.stats
+        self.send_message(f"AI批量审核: {batcher['batches']}批，批量判定{batcher['batched']}条，"
+                          f"批量请求失败{batcher['failed']}条，逐条审核{batcher['fallback']}条，"
+                          f"无法判定{batcher['unknown']}条，"
+                          f"排队中{self.moderation_batcher.pending()}条")
+        
+    def command_hang(self, user_name, switch):
+        """开关挂房功能"""
+        if switch.lower() == 'on':
+            self.set_feature('hang_room_enabled', True, "挂房功能已开启")
+        elif switch.lower() == 'off':
+            self.set_feature('hang_room_enabled', False, "挂房功能已关闭")
+        else:
+            self.send_message("请使用格式: /hang on|off")
+
+    def command_help(self, user_name, text):
+        """显示帮助信息"""
+        help_text = """DRRR 增强版AI机器人 帮助信息:
+
 AI功能命令（仅限管理员）:
 /ai on - 开启AI功能
 /ai off - 关闭AI功能
@@ -390,16 +650,22 @@ AI功能命令（仅限管理员）:
 /ai model - 查看当前AI模型
 /ai models - 查看可用AI模型列表
 /ai model <模型名> - 切换AI模型
+/ai cache [clear] - 查看或清空AI回复缓存
 /ai manage on - 开启AI房间管理功能
 /ai manage off - 关闭AI房间管理功能
+/ai manage stats - 查看AI房间管理的审核统计
+/ai manage learn on|off - 分类器训练前把消息交给AI标注
 
 音乐点播命令（所有用户）:
 /play <歌曲名> <链接> - 添加歌曲到播放列表
 /netmusic <歌曲名> - 搜索网易云音乐
 /qqmusic <歌曲名> - 搜索QQ音乐并直接输出链接
+/qqmusic <歌曲名> <序号> - 选择搜索结果中的第几首
 /tts <文本> - 将文本转换为语音并直接输出链接
 /next - 播放下一首歌曲
 /playlist - 查看播放列表
+/playlist remove <编号> - 移除自己点的歌曲
+/playlist top <编号> - 把自己点的歌曲移到下一首播放
 /clear - 清空播放列表
 
 信息查询命令（所有用户）:
@@ -409,190 +675,168 @@ AI功能命令（仅限管理员）:
 系统命令（仅限管理员）:
 /hang on - 开启挂房功能
 /hang off - 关闭挂房功能
+/playlist mode <模式> - 设置播放模式（album/single/repeat/loop/shuffle）
 /kick <用户名> - 踢出指定用户
 /ban <用户名> - 封禁指定用户
 /unban <用户名> - 解封指定用户
+/kick-pattern <正则> - 踢出用户名匹配的所有用户
+/ban-pattern <正则> - 封禁用户名匹配的所有用户
+/kick-recent <秒数> - 踢出最近N秒内加入的所有用户
+/ban-recent <秒数> - 封禁最近N秒内加入的所有用户
 /help - 显示帮助信息"""
-            self.send_message(help_text)
-            return True
-            
-        elif command.startswith('joke'):
-            # 处理笑话命令
-            joke = self.get_random_joke()
-            self.send_message(f"@{user_name} {joke}")
-            return True
-            
-        elif command.startswith('kick'):
-            # 踢出用户命令
-            target_user = command[4:].strip()  # 移除'kick'前缀
-            if target_user:
-                self.kick_user(target_user, None)  # 这里需要实际的用户ID
-                self.send_message(f"已发送踢出用户 {target_user} 的指令")
-                return True
-            else:
-                self.send_message("请提供要踢出的用户名: /kick <用户名>")
-                return True
-                
-        elif command.startswith('ban'):
-            # 封禁用户命令
-            target_user = command[3:].strip()  # 移除'ban'前缀
-            if target_user:
-                self.ban_user(target_user, None)  # 这里需要实际的用户ID
-                self.send_message(f"已发送封禁用户 {target_user} 的指令")
-                return True
-            else:
-                self.send_message("请提供要封禁的用户名: /ban <用户名>")
-                return True
-                
-        elif command.startswith('unban'):
-            # 解封用户命令
-            target_user = command[5:].strip()  # 移除'unban'前缀
-            if target_user:
-                self.unban_user(target_user)
-                self.send_message(f"已发送解封用户 {target_user} 的指令")
-                return True
-            else:
-                self.send_message("请提供要解封的用户名: /unban <用户名>")
-                return True
-                
-        # 音乐相关命令完全由handle_music_commands函数处理
-        # 这里不再处理music命令，避免命令处理冲突
-        pass
-        
-    def handle_music_commands(self, user_name, message_text):
-        """处理音乐点播命令"""
-        # 处理不同的音乐命令前缀
-        if message_text.startswith('/music'):
-            # 旧的/music命令格式
-            command_prefix = '/music'
-        elif message_text.startswith('/play'):
-            # 新的/play命令格式
-            command_prefix = '/play'
-        elif message_text.startswith('/netmusic'):
-            # 网易云音乐搜索命令
-            command_prefix = '/netmusic'
-        elif message_text.startswith('/yunting'):
-            # 云听FM搜索命令
-            command_prefix = '/yunting'
-        elif message_text.startswith('/tts'):
-            # 文本转语音命令
-            command_prefix = '/tts'
-        elif message_text.startswith('/next'):
-            # 播放下一首命令
-            command_prefix = '/next'
-        elif message_text.startswith('/playlist'):
-            # 查看播放列表命令
-            command_prefix = '/playlist'
-        elif message_text.startswith('/clear'):
-            # 清空播放列表命令
-            command_prefix = '/clear'
+        self.send_message(help_text)
+
+    def command_joke(self, user_name, text):
+        """随机段子"""
+        joke = self.get_random_joke()
+        self.send_message(f"@{user_name} {joke}")
+
+    def command_kick(self, user_name, target_user):
+        """踢出用户"""
+        target = self.user_directory.resolve(target_user)
+        if target and self.user_directory.get(target['id']):
+            self.kick_user(target['name'], target['id'])
         else:
-            return False
-            
-        # 移除命令前缀
-        command = message_text[len(command_prefix):].strip()
-        
-        if command_prefix == '/play':
-            # 提取歌曲名和链接
-            parts = command.split(' ', 1)
-            if len(parts) >= 2:
-                song_name, song_url = parts[0], parts[1]
-                self.music_playlist.append(song_url)
-                self.send_message(f"@{user_name} 已添加歌曲 '{song_name}' 到播放列表")
-                logger.info(f"用户 {user_name} 添加歌曲 '{song_name}' 到播放列表: {song_url}")
-                return True
-            else:
-                self.send_message("请使用格式: /play <歌曲名> <链接>")
-                return True
-                
-        elif command_prefix == '/netmusic':
-            # 搜索网易云音乐
-            if command:
-                self.send_message(f"@{user_name} 正在搜索网易云音乐: {command}")
-                # 这里应该调用网易云音乐搜索API
-                # 暂时用模拟回复
-                self.send_message(f"@{user_name} 搜索完成，找到相关歌曲，请使用/play命令添加到播放列表")
-                return True
-            else:
-                self.send_message("请提供要搜索的歌曲名: /netmusic <歌曲名>")
-                return True
-                
-        elif command_prefix == '/yunting':
-            # 搜索云听FM专辑
-            if command:
-                self.send_message(f"@{user_name} 正在搜索云听FM专辑: {command}")
-                # 这里应该调用云听FM搜索API
-                # 暂时用模拟回复
-                self.send_message(f"@{user_name} 搜索完成，找到相关专辑，请使用/play命令添加到播放列表")
-                return True
-            else:
-                self.send_message("请提供要搜索的专辑名: /yunting <专辑名>")
-                return True
-                
-        elif command_prefix == '/tts':
-            # 文本转语音
-            if command:
-                self.send_message(f"@{user_name} 正在将文本转换为语音...")
-                # 这里应该调用TTS API
-                # 暂时用模拟回复
-                tts_url = "https://example.com/tts/" + command[:10]  # 模拟TTS链接
-                self.music_playlist.append(tts_url)
-                self.send_message(f"@{user_name} 文本转语音完成，已添加到播放列表")
-                return True
-            else:
-                self.send_message("请提供要转换的文本: /tts <文本>")
-                return True
-                
-        elif command_prefix == '/next':
-            # 播放下一首
-            self.play_music()
-            return True
-            
-        elif command_prefix == '/playlist':
-            # 查看播放列表
-            if self.music_playlist:
-                playlist_msg = f"@{user_name} 当前播放列表:\n" + "\n".join(self.music_playlist)
-            else:
-                playlist_msg = f"@{user_name} 播放列表为空"
-            self.send_message(playlist_msg)
-            return True
-            
-        elif command_prefix == '/clear':
-            # 清空播放列表
-            self.music_playlist.clear()
-            self.send_message(f"@{user_name} 播放列表已清空")
-            logger.info(f"用户 {user_name} 清空了播放列表")
-            return True
-            
-        # 处理原有的/music命令
-        if command.startswith('add'):
-            # 提取音乐链接
-            music_url = command[3:].strip()  # 移除'add'前缀
-            if music_url:
-                self.music_playlist.append(music_url)
-                self.send_message(f"@{user_name} 已添加到播放列表")
-                logger.info(f"用户 {user_name} 添加音乐到播放列表: {music_url}")
-                return True
-                
-        elif command == 'list':
-            if self.music_playlist:
-                playlist_msg = f"@{user_name} 当前播放列表:\n" + "\n".join(self.music_playlist)
-            else:
-                playlist_msg = f"@{user_name} 播放列表为空"
-            self.send_message(playlist_msg)
-            return True
-            
-        elif command == 'play':
-            self.play_music()
-            return True
-            
-        return False
-        
-    def handle_ai_command(self, user_name, message_text):
+            self.send_message(f"房间中未找到用户: {target_user}")
+
+    def command_ban(self, user_name, target_user):
+        """封禁用户，记录到封禁名单，再次进入房间时自动处理"""
+        target = self.user_directory.resolve(target_user)
+        if target:
+            self.acl.add('banned', user_id=target['id'], name=target['name'], tripcode=target.get('tripcode'))
+            self.ban_user(target['name'], target['id'], target.get('tripcode'))
+        else:
+            # 找不到用户时仅按用户名记录封禁
+            self.acl.add('banned', name=target_user)
+            self.ban_user(target_user, None)
+
+    def command_unban(self, user_name, target_user):
+        """解封用户，从封禁名单中移除"""
+        target = self.user_directory.resolve(target_user)
+        if target:
+            self.acl.remove('banned', user_id=target['id'], name=target['name'], tripcode=target.get('tripcode'))
+            self.unban_user(target['name'], target['id'], target.get('tripcode'))
+        else:
+            self.acl.remove('banned', name=target_user)
+            self.unban_user(target_user)
+
+    def command_play(self, user_name, text):
+        """添加歌曲到播放列表"""
+        song_name, song_url = text.split(None, 1)
+        query, index = self.music_sources.get(song_url) or ("", 0)
+        song, reason = self.music_playlist.add(song_url, title=song_name, user=user_name, query=query, index=index)
+        if song is None:
+            self.send_message(f"@{user_name} {reason}")
+            return
+        self.check_song_link(song)
+        self.send_message(f"@{user_name} 已添加歌曲 '{song_name}' 到播放列表（编号{song.id}）")
+        logger.info(f"用户 {user_name} 添加歌曲 '{song_name}' 到播放列表: {song_url}")
+
+    def command_music_add(self, user_name, music_url):
+        """添加音乐链接到播放列表（旧命令格式）"""
+        query, index = self.music_sources.get(music_url) or ("", 0)
+        song, reason = self.music_playlist.add(music_url, user=user_name, query=query, index=index)
+        if song is None:
+            self.send_message(f"@{user_name} {reason}")
+            return
+        self.check_song_link(song)
+        self.send_message(f"@{user_name} 已添加到播放列表（编号{song.id}）")
+        logger.info(f"用户 {user_name} 添加音乐到播放列表: {music_url}")
+
+    def command_netmusic(self, user_name, keyword):
+        """搜索网易云音乐"""
+        self.send_message(f"@{user_name} 正在搜索网易云音乐: {keyword}")
+        # 这里应该调用网易云音乐搜索API
+        # 暂时用模拟回复
+        self.send_message(f"@{user_name} 搜索完成，找到相关歌曲，请使用/play命令添加到播放列表")
+
+    def command_qqmusic(self, user_name, text):
+        """搜索QQ音乐，可在歌曲名后加序号选择第几首"""
+        self.send_message(f"@{user_name} 正在搜索QQ音乐: {text}")
+        # 解析序号时的搜索也在同一次调用中，相同的并发命令只请求一次接口
+        result = self.single_flight.do(('qqmusic', self.music_search.normalize(text)),
+                                       self.search_qq_music_text, text)
+        self.send_message(f"@{user_name} {result}")
+
+    def search_qq_music_text(self, text):
+        """解析 "<歌曲名> [序号]" 并搜索QQ音乐"""
+        song_name, index = text, 1
+        parts = text.rsplit(None, 1)
+        if len(parts) == 2 and parts[1].isdecimal():
+            # 末尾的数字只有在搜索结果范围内时才是序号（如 "Taylor Swift 1989" 是歌名）
+            candidates, error = self.music_search.search(parts[0], limit=100)
+            if not error and 1 <= int(parts[1]) <= len(candidates):
+                song_name, index = parts[0], int(parts[1])
+        return self.search_qq_music(song_name, index)
+
+    def command_tts(self, user_name, text):
+        """文本转语音"""
+        self.send_message(f"@{user_name} 正在将文本转换为语音...")
+        tts_result = self.single_flight.do(('tts', tts_key(text, self.tts.voice)), self.text_to_speech, text)
+        if tts_result:
+            # 直接输出URL而不是添加到播放列表
+            self.send_message(f"@{user_name} 文本转语音完成:\n{tts_result}")
+        else:
+            self.send_message(f"@{user_name} 文本转语音失败，请稍后再试")
+
+    def command_playlist(self, user_name, text):
+        """查看播放列表（最多显示20首）"""
+        if self.music_playlist:
+            songs = self.music_playlist.songs(limit=20)
+            lines = [f"{'▶ ' if song.id == self.music_playlist.current_id else ''}"
+                     f"{'✗ ' if self.music_playlist.is_dead(song.id) else ''}{song.id}. {song.display()}"
+                     for song in songs]
+            if len(self.music_playlist) > len(songs):
+                lines.append(f"……共{len(self.music_playlist)}首")
+            playlist_msg = f"@{user_name} 当前播放列表（{self.music_playlist.mode}）:\n" + "\n".join(lines)
+        else:
+            playlist_msg = f"@{user_name} 播放列表为空"
+        self.send_message(playlist_msg)
+
+    def find_own_song(self, user_name, song_id):
+        """按编号查找歌曲，只有点歌的用户和管理员可以操作，否则回复原因并返回None"""
+        song = self.music_playlist.get(int(song_id)) if song_id.isdigit() else None
+        if song is None:
+            self.send_message(f"@{user_name} 播放列表中没有编号为 {song_id} 的歌曲")
+            return None
+        if song.user != user_name and not self.is_admin(user_name):
+            self.send_message(f"@{user_name} 只能操作自己点的歌曲")
+            return None
+        return song
+
+    def command_playlist_remove(self, user_name, song_id):
+        """从播放列表移除歌曲"""
+        song = self.find_own_song(user_name, song_id)
+        if song:
+            self.music_playlist.remove(song.id)
+            self.send_message(f"@{user_name} 已从播放列表移除: {song.display()}")
+
+    def command_playlist_top(self, user_name, song_id):
+        """把歌曲移到当前歌曲之后，作为下一首播放"""
+        song = self.find_own_song(user_name, song_id)
+        if song and self.music_playlist.move(song.id, self.music_playlist.current_id):
+            self.send_message(f"@{user_name} 下一首将播放: {song.display()}")
+
+    def command_playlist_mode(self, user_name, mode):
+        """设置播放模式"""
+        if self.music_playlist.set_mode(mode):
+            self.send_message(f"播放模式已设置为: {mode}")
+        else:
+            self.send_message(f"无效的播放模式。可用模式: {', '.join(PLAY_MODES)}")
+
+    def command_clear(self, user_name, text):
+        """清空播放列表"""
+        self.music_playlist.clear()
+        self.send_message(f"@{user_name} 播放列表已清空")
+        logger.info(f"用户 {user_name} 清空了播放列表")
+
+    def command_translate(self, user_name, text):
+        """翻译内容"""
+        result = self.single_flight.do(('translate', ' '.join(text.split())), self.translate_text, text)
+        self.send_message(f"@{user_name} {result}")
+
+    def command_ai(self, user_name, user_message):
         """处理AI对话命令"""
-        if not message_text.startswith('/ai'):
-            return False
-            
         # 检查AI功能是否开启
         if not self.ai_enabled:
             # 如果是管理员，提示如何开启AI功能
@@ -600,21 +844,32 @@ AI功能命令（仅限管理员）:
                 self.send_message("AI对话功能未开启，请使用 '/ai on' 命令开启")
             else:
                 self.send_message("AI对话功能未开启，请管理员先开启")
-            return True
-            
-        # 提取用户消息
-        user_message = message_text[3:].strip()  # 移除'/ai'前缀
-        
+            return
+
         if not user_message:
             self.send_message("请输入要对话的内容")
-            return True
-            
-        # 提示用户等待
-        self.send_message(f"@{user_name} 正在处理您的请求，请稍等...")
+            return
+
+        # 带上该用户的对话记忆；有记忆时回复依赖上下文，不使用缓存也不与他人合并
+        prompt = self.conversation_memory.build_prompt(user_name, user_message)
+        stateless = prompt == user_message
+        cache_key = self.ai_cache_key(user_message)
+        flight_key = ('ai', cache_key) if stateless else ('ai-context', user_name, prompt)
+        
+        def remember(ai_response):
+            if ai_response and not isinstance(ai_response, AIErrorMessage):
+                self.conversation_memory.record(user_name, user_message, ai_response)
+                
+        # 相同问题直接使用缓存的回复
+        cached = self.ai_cache.get(cache_key) if stateless else None
+        if cached:
+            logger.info(f"AI回复缓存命中: {user_message[:50]}")
+            self.send_message(f"@{user_name} {cached}")
+            remember(cached)
+            return
             
-        # 异步调用AI接口，避免阻塞主线程
-        def async_call_ai():
-            ai_response = self.call_ai_api(user_message)
+        def deliver(ai_response):
+            remember(ai_response)
             if ai_response:
                 # 检查是否为空响应或特定错误消息
                 if ai_response == "AI接口返回空响应，请稍后再试":
@@ -626,132 +881,271 @@ AI功能命令（仅限管理员）:
                     self.send_message(f"@{user_name} {ai_response}")
             else:
                 self.send_message(f"@{user_name} AI接口调用失败，请稍后再试")
-        
-        # 在新线程中执行AI调用
-        ai_thread = threading.Thread(target=async_call_ai)
-        ai_thread.daemon = True  # 设置为守护线程
-        ai_thread.start()
+                
+        # 相同问题正在请求中时等待其结果，不再占用AI线程池
+        if stateless and self.single_flight.subscribe(flight_key, deliver):
+            logger.info(f"合并相同的AI请求: {user_message[:50]}")
+            self.send_message(f"@{user_name} 相同的问题正在处理中，请稍等...")
+            return
             
-        return True
+        # 在AI线程池中调用AI接口，避免阻塞主线程
+        def async_call_ai():
+            if self.stop_event.is_set():
+                return
+            if self.ai_stream_url or self.ai_stream_backend:
+                # 流式输出由发起请求的线程逐段发送，合并的相同请求结束后收到完整回复
+                remember(self.single_flight.do(flight_key, self.stream_ai_reply, user_name, prompt, stateless))
+            else:
+                deliver(self.single_flight.do(flight_key, self.call_ai_api, prompt, stateless))
+
+        # 房间内用户名唯一，按用户名限制每个用户的并发请求
+        future, reason = self.ai_pool.submit(user_name, async_call_ai)
+        if future is None:
+            # 队列已满或该用户已有请求在处理
+            self.send_message(f"@{user_name} {reason}")
+            return
+            
+        # 提示用户等待
+        waiting = self.ai_pool.waiting()
+        if waiting:
+            self.send_message(f"@{user_name} 已加入AI请求队列，当前排在第{waiting}位，请稍等...")
+        else:
+            self.send_message(f"@{user_name} 正在处理您的请求，请稍等...")
         
-    def call_ai_api(self, user_message):
-        """调用AI接口"""
+    def request_ai(self, user_message, model, timeout):
+        """向AI接口发送一次请求，返回 (状态, 内容)，状态为 ok / retry / fail"""
+        # 构造请求参数
+        params = {
+            "msg": user_message
+        }
+        params.update(self.ai_model_params.get(model, {}))
+
+        # 设置请求头
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/json',
+            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive'
+        }
+
+        start_time = time.time()
         try:
-            # 构造请求参数
-            params = {
-                "msg": user_message
-            }
+            response = self.session.get(self.ai_api_url, params=params, headers=headers, timeout=timeout)
+        except requests.exceptions.Timeout:
+            response_time = time.time() - start_time
+            # 超时也计入延迟统计，使慢模型的EWMA升高
+            self.ai_latency[model].record(response_time)
+            logger.warning(f"AI接口请求超时（{model}），耗时: {response_time:.2f}秒")
+            return 'retry', "AI接口请求超时，请稍后再试"
+        except requests.exceptions.RequestException as e:
+            logger.error(f"AI接口网络请求错误（{model}）: {e}，耗时: {time.time() - start_time:.2f}秒")
+            return 'retry', "网络请求错误，请稍后再试"
 
-            logger.info(f"调用AI接口: {self.ai_api_url}")
-            logger.info(f"请求参数: {params}")
+        response_time = time.time() - start_time
+        self.ai_latency[model].record(response_time)
+        logger.info(f"AI接口响应状态码: {response.status_code}")
+        logger.info(f"AI接口响应时间（{model}）: {response_time:.2f}秒")
+        logger.info(f"AI接口响应内容长度: {len(response.text)}字符")
 
-            # 设置请求头
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive'
-            }
+        if response.status_code == 200:
+            # 解析JSON响应
+            try:
+                response_data = response.json()
+            except json.JSONDecodeError:
+                logger.error(f"AI接口响应不是有效的JSON格式: {response.text}")
+                return 'fail', "AI接口响应格式错误，请稍后再试"
+            if response_data.get("status") == "success":
+                content = response_data.get("content", "")
+                if content.strip():
+                    logger.info(f"AI接口调用成功，返回内容: {content[:100]}{'...' if len(content) > 100 else ''}")
+                    return 'ok', content
+                logger.warning("AI接口返回空内容")
+                return 'retry', "AI接口返回空内容，请稍后再试"
+            error_msg = response_data.get("message", "未知错误")
+            logger.error(f"AI接口返回错误: {error_msg}")
+            return 'fail', f"AI接口返回错误: {error_msg}"
 
-            # 实现重试机制以优化延迟问题
-            max_retries = 3
-            retry_delay = 5  # 重试间隔（秒）
+        logger.error(f"AI接口调用失败，状态码: {response.status_code}")
+        logger.error(f"AI接口错误响应: {response.text}")
+        # 根据错误码返回相应的错误信息
+        errors = {
+            400: "请求错误，请稍后再试",
+            403: "请求被服务器拒绝，请稍后再试",
+            405: "客户端请求的方法被禁止，请稍后再试",
+            408: "请求时间过长，请稍后再试",
+            500: "服务器内部出现错误，请稍后再试",
+            501: "服务器不支持请求的功能，请稍后再试",
+            503: "系统维护中，请稍后再试",
+        }
+        if response.status_code in errors:
+            return 'fail', errors[response.status_code]
+        return 'retry', f"AI接口调用失败，状态码: {response.status_code}"
 
-            for attempt in range(max_retries):
+    def request_ai_hedged(self, user_message, model, timeout):
+        """发送请求，超过该模型p90延迟仍未返回时再发送一次相同的对冲请求，取先成功的结果"""
+        start_time = time.time()
+        futures = {self.ai_hedge_pool.submit(self.request_ai, user_message, model, timeout): "主请求"}
+        hedge_delay = self.ai_latency[model].percentile(0.9) if self.ai_hedge_enabled else None
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                logger.info(f"AI请求（{model}）超过p90延迟{hedge_delay:.1f}秒，发送对冲请求")
+                futures[self.ai_hedge_pool.submit(self.request_ai, user_message, model,
+                                                  max(1.0, timeout - hedge_delay))] = "对冲请求"
+
+        result = ('retry', "AI接口请求超时，请稍后再试")
+        pending = set(futures)
+        while pending:
+            remaining = timeout - (time.time() - start_time)
+            done, pending = wait(pending, timeout=max(0.0, remaining) + 1, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
                 try:
-                    logger.info(f"开始第{attempt + 1}次AI接口调用")
-                    start_time = time.time()
+                    status, content = future.result()
+                except Exception as e:
+                    status, content = 'retry', f"调用AI接口时出错: {e}"
+                if status == 'ok':
+                    if len(futures) > 1:
+                        logger.info(f"AI{futures[future]}先返回")
+                    return status, content
+                # 保留最严重的失败结果，等待另一个请求
+                if result[0] != 'fail':
+                    result = (status, content)
+        return result
 
-                    # 发送GET请求，增加超时时间以适应长时间响应（最大可能需要1分钟）
-                    response = self.session.get(self.ai_api_url, params=params, headers=headers, timeout=70)
+    def call_ai_api(self, user_message, cache=True):
+        """调用AI接口
 
-                    end_time = time.time()
-                    response_time = end_time - start_time
-                    logger.info(f"AI接口响应状态码: {response.status_code}")
-                    logger.info(f"AI接口响应时间: {response_time:.2f}秒")
-                    logger.info(f"AI接口响应内容长度: {len(response.text)}字符")
+        整个请求的总时限为 ai_deadline 秒，按剩余时间分配给每次重试；
+        始终使用管理员选择的当前模型，每次尝试超过p90延迟时发送相同的对冲请求。
+        失败时返回 AIErrorMessage；cache 为False时不缓存回复（如带有对话记忆的提示词）。
+        """
+        cache_key = self.ai_cache_key(user_message)
+        try:
+            logger.info(f"调用AI接口: {self.ai_api_url}")
+            logger.info(f"请求参数: {{'msg': {user_message!r}}}")
 
-                    if response.status_code == 200:
-                        # 解析JSON响应
-                        try:
-                            response_data = response.json()
-                            if response_data.get("status") == "success":
-                                content = response_data.get("content", "")
-                                if content.strip():
-                                    logger.info(f"AI接口调用成功，返回内容: {content[:100]}{'...' if len(content) > 100 else ''}")
-                                    return content
-                                else:
-                                    logger.warning("AI接口返回空内容")
-                                    # 如果不是最后一次尝试，等待后重试
-                                    if attempt < max_retries - 1:
-                                        logger.info(f"AI接口返回空内容，{retry_delay}秒后进行第{attempt + 2}次重试")
-                                        time.sleep(retry_delay)
-                                        continue
-                                    return "AI接口返回空内容，请稍后再试"
-                            else:
-                                error_msg = response_data.get("message", "未知错误")
-                                logger.error(f"AI接口返回错误: {error_msg}")
-                                return f"AI接口返回错误: {error_msg}"
-                        except json.JSONDecodeError:
-                            logger.error(f"AI接口响应不是有效的JSON格式: {response.text}")
-                            return "AI接口响应格式错误，请稍后再试"
-                    else:
-                        logger.error(f"AI接口调用失败，状态码: {response.status_code}")
-                        logger.error(f"AI接口错误响应: {response.text}")
-                        # 根据错误码返回相应的错误信息
-                        if response.status_code == 400:
-                            return "请求错误，请稍后再试"
-                        elif response.status_code == 403:
-                            return "请求被服务器拒绝，请稍后再试"
-                        elif response.status_code == 405:
-                            return "客户端请求的方法被禁止，请稍后再试"
-                        elif response.status_code == 408:
-                            return "请求时间过长，请稍后再试"
-                        elif response.status_code == 500:
-                            return "服务器内部出现错误，请稍后再试"
-                        elif response.status_code == 501:
-                            return "服务器不支持请求的功能，请稍后再试"
-                        elif response.status_code == 503:
-                            return "系统维护中，请稍后再试"
-                        else:
-                            # 如果不是最后一次尝试，等待后重试
-                            if attempt < max_retries - 1:
-                                logger.info(f"AI接口调用失败，{retry_delay}秒后进行第{attempt + 2}次重试")
-                                time.sleep(retry_delay)
-                                continue
-                            return f"AI接口调用失败，状态码: {response.status_code}"
-
-                except requests.exceptions.Timeout:
-                    end_time = time.time()
-                    response_time = end_time - start_time
-                    logger.warning(f"AI接口请求超时，第{attempt + 1}次尝试，耗时: {response_time:.2f}秒")
-                    # 如果不是最后一次尝试，等待后重试
-                    if attempt < max_retries - 1:
-                        logger.info(f"AI接口请求超时，{retry_delay}秒后进行第{attempt + 2}次重试")
-                        time.sleep(retry_delay)
-                        continue
-                    return "AI接口请求超时，请稍后再试"
-                except requests.exceptions.RequestException as e:
-                    end_time = time.time()
-                    response_time = end_time - start_time
-                    logger.error(f"AI接口网络请求错误: {e}，耗时: {response_time:.2f}秒")
-                    # 如果不是最后一次尝试，等待后重试
-                    if attempt < max_retries - 1:
-                        logger.info(f"AI接口网络请求错误，{retry_delay}秒后进行第{attempt + 2}次重试")
-                        time.sleep(retry_delay)
-                        continue
-                    return "网络请求错误，请稍后再试"
+            max_retries = 3
+            retry_delay = 2  # 重试间隔（秒）
+            deadline = time.time() + self.ai_deadline
+            result = "AI接口调用失败，请稍后再试"
+
+            for attempt in range(max_retries):
+                remaining = deadline - time.time()
+                if remaining < 3:
+                    break
+                # 每次尝试使用剩余时间的2/3，最后一次使用全部剩余时间
+                timeout = remaining if attempt == max_retries - 1 else remaining * 2 / 3
+                model = self.current_ai_model
+                logger.info(f"开始第{attempt + 1}次AI接口调用（{model}），超时{timeout:.1f}秒")
+
+                status, result = self.request_ai_hedged(user_message, model, timeout)
+                if status == 'ok':
+                    if cache:
+                        self.ai_cache.set(cache_key, result)
+                    return result
+                if status == 'fail':
+                    return AIErrorMessage(result)
+
+                # 如果不是最后一次尝试，等待后重试
+                if attempt < max_retries - 1:
+                    logger.info(f"{result}，{retry_delay}秒后进行第{attempt + 2}次重试")
+                    if self.stop_event.wait(min(retry_delay, max(0, deadline - time.time()))):
+                        return AIErrorMessage("机器人正在关闭，请稍后再试")
 
             # 所有重试都失败
-            return "AI接口调用失败，请稍后再试"
-                
+            return AIErrorMessage(result)
+
         except Exception as e:
             logger.error(f"调用AI接口时出错: {e}")
-            return "调用AI接口时出错，请稍后再试"
+            return AIErrorMessage("调用AI接口时出错，请稍后再试")
+            
+    def open_ai_stream(self, user_message):
+        """打开流式AI接口，返回文本片段迭代器"""
+        if self.ai_stream_backend:
+            return self.ai_stream_backend(user_message)
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'text/event-stream, text/plain, application/json',
+            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'
+        }
+        # 连接超时10秒，两个数据块之间最多等待30秒
+        response = self.session.get(self.ai_stream_url, params={"msg": user_message, "stream": 1},
+                                    headers=headers, stream=True, timeout=(10, 30))
+        if response.status_code != 200:
+            response.close()
+            raise requests.exceptions.HTTPError(f"流式AI接口状态码: {response.status_code}")
+        return iter_response_text(response)
+        
+    def stream_ai_reply(self, user_name, user_message, cache=True):
+        """流式获取AI回复，每凑满一段（100字符）立即发送，返回完整回复（中断或失败时为 AIErrorMessage）
+
+        和 send_message 分段发送一样，相邻两段之间至少间隔1秒，避免发送过快。
+        """
+        segmenter = StreamSegmenter(100)
+        segmenter.feed(f"@{user_name} ")
+        parts = []
+        interrupted = False
+        start_time = time.time()
+        last_sent = 0.0
+
+        def send_segment(segment):
+            nonlocal last_sent
+            delay = 1 - (time.time() - last_sent)
+            if delay > 0:
+                time.sleep(delay)
+            self._send_single_message(segment)
+            last_sent = time.time()
+
+        try:
+            for text in self.open_ai_stream(user_message):
+                if not parts:
+                    logger.info(f"AI流式回复首个片段耗时: {time.time() - start_time:.2f}秒")
+                parts.append(text)
+                for segment in segmenter.feed(text):
+                    send_segment(segment)
+                if self.stop_event.is_set():
+                    interrupted = True
+                    break
+        except Exception as e:
+            logger.error(f"AI流式回复出错: {e}")
+            if not segmenter.count and not ''.join(parts).strip():
+                # 还没有输出任何内容，改用普通请求
+                reply = self.call_ai_api(user_message, cache)
+                self.send_message(f"@{user_name} {reply}")
+                return reply
+            interrupted = True
+        content = ''.join(parts)
+        if interrupted:
+            for segment in segmenter.feed("（回复中断）"):
+                send_segment(segment)
+        elif content.strip():
+            if cache:
+                self.ai_cache.set(self.ai_cache_key(user_message), content)
+            logger.info(f"AI流式回复完成，共{len(content)}字符，耗时: {time.time() - start_time:.2f}秒")
+        last_segment = segmenter.finish()
+        if last_segment:
+            send_segment(last_segment)
+        if not content.strip():
+            self.send_message(f"@{user_name} AI接口返回空内容，请稍后再试")
+            return AIErrorMessage("AI接口返回空内容，请稍后再试")
+        return AIErrorMessage(content) if interrupted else content
             
     def get_random_joke(self):
-        """获取随机笑话"""
+        """获取随机笑话，优先从预取的笑话池中取，池为空时实时生成"""
+        joke = self.joke_pool.take()
+        if joke:
+            return joke
+        joke = self.fetch_joke()
+        if not joke:
+            return "抱歉，暂时无法生成笑话，请稍后再试。"
+        self.joke_pool.mark_served(joke_fingerprint(joke))
+        return joke
+        
+    def fetch_joke(self):
+        """通过AI接口生成一个笑话，失败时返回None"""
         try:
             # 使用AI接口生成笑话
             joke_prompt = "请给我讲一个简短的笑话，最好是中文的，适合在聊天室分享。"
@@ -779,18 +1173,18 @@ AI功能命令（仅限管理员）:
             
             if response.status_code == 200:
                 # 对于文本响应，直接返回内容
-                return response.text
+                return response.text.strip() or None
             else:
                 logger.error(f"笑话接口调用失败，状态码: {response.status_code}")
                 logger.error(f"笑话接口错误响应: {response.text}")
-                return "抱歉，暂时无法生成笑话，请稍后再试。"
+                return None
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"笑话接口网络请求错误: {e}")
-            return "网络请求错误，请稍后再试"
+            return None
         except Exception as e:
             logger.error(f"获取笑话时出错: {e}")
-            return "抱歉，暂时无法生成笑话，请稍后再试。"
+            return None
             
     def search_bilibili(self, uid):
         """搜索B站用户动态"""
@@ -890,81 +1284,16 @@ AI功能命令（仅限管理员）:
             logger.error(f"搜索百科内容时出错: {e}")
             return "抱歉，暂时无法获取百科内容，请稍后再试。"
             
-    def search_qq_music(self, song_name):
-        """搜索QQ音乐"""
-        try:
-            # 使用QQ音乐API搜索歌曲
-            url = "https://api.suyanw.cn/api/QQ_Music.php"
-            params = {
-                "msg": song_name,
-                "n": 1  # 默认选择第一首
-            }
-            
-            logger.info(f"请求QQ音乐: {url}")
-            
-            # 设置请求头
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive'
-            }
-            
-            response = self.session.get(url, params=params, headers=headers, timeout=30)
-            
-            logger.info(f"QQ音乐接口响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                # 解析JSON响应
-                data = response.json()
-                
-                # 检查是否有内容
-                if 'code' in data and data['code'] == 200:
-                    # 提取歌曲信息
-                    song_info = data.get('data', {})
-                    if song_info:
-                        title = song_info.get('title', '未知歌曲')
-                        singer = song_info.get('singer', '未知歌手')
-                        song_url = song_info.get('url', '')
-                        
-                        result = f"找到歌曲: {title} - {singer}"
-                        if song_url:
-                            # 将歌曲添加到播放列表
-                            self.music_playlist.append(song_url)
-                            result += f"\n已添加到播放列表"
-                        else:
-                            result += f"\n无法获取播放链接"
-                        
-                        return result
-                    else:
-                        return f"抱歉，未找到与'{song_name}'相关的歌曲。"
-                else:
-                    error_msg = data.get('text', '未知错误')
-                    return f"QQ音乐搜索失败: {error_msg}"
-            else:
-                logger.error(f"QQ音乐接口调用失败，状态码: {response.status_code}")
-                logger.error(f"QQ音乐接口错误响应: {response.text}")
-                return "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"QQ音乐接口网络请求错误: {e}")
-            return "网络请求错误，请稍后再试"
-        except Exception as e:
-            logger.error(f"搜索QQ音乐时出错: {e}")
-            return "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
-            
-    def search_qq_music_direct(self, song_name):
-        """搜索QQ音乐并直接输出URL"""
+    def translate_text(self, text):
+        """翻译内容（中文译为英文，其他语言译为中文）"""
         try:
-            # 使用QQ音乐API搜索歌曲
-            url = "https://api.suyanw.cn/api/QQ_Music.php"
+            # 使用AI接口翻译
+            prompt = f"请翻译以下内容，如果是中文则翻译成英文，否则翻译成中文，只返回译文：\n{text}"
             params = {
-                "msg": song_name,
-                "n": 1  # 默认选择第一首
+                "msg": prompt
             }
             
-            logger.info(f"请求QQ音乐: {url}")
+            logger.info(f"请求AI翻译: {self.ai_api_url}")
             
             # 设置请求头
             headers = {
@@ -975,266 +1304,158 @@ AI功能命令（仅限管理员）:
                 'Connection': 'keep-alive'
             }
             
-            response = self.session.get(url, params=params, headers=headers, timeout=30)
+            response = self.session.get(self.ai_api_url, params=params, headers=headers, timeout=30)
             
-            logger.info(f"QQ音乐接口响应状态码: {response.status_code}")
+            logger.info(f"AI接口响应状态码: {response.status_code}")
             
             if response.status_code == 200:
                 # 解析JSON响应
                 data = response.json()
                 
                 # 检查是否有内容
-                if 'code' in data and data['code'] == 200:
-                    # 提取歌曲信息
-                    song_info = data.get('data', {})
-                    if song_info:
-                        title = song_info.get('title', '未知歌曲')
-                        singer = song_info.get('singer', '未知歌手')
-                        song_url = song_info.get('url', '')
-                        
-                        result = f"找到歌曲: {title} - {singer}"
-                        if song_url:
-                            # 直接输出URL而不是添加到播放列表
-                            result += f"\n歌曲链接: {song_url}"
-                        else:
-                            result += f"\n无法获取播放链接"
-                        
-                        return result
+                if data.get("status") == "success":
+                    content = data.get("content", "")
+                    if content.strip():
+                        return f"翻译结果: {content.strip()}"
                     else:
-                        return f"抱歉，未找到与'{song_name}'相关的歌曲。"
+                        return "抱歉，未能得到翻译结果。"
                 else:
-                    error_msg = data.get('text', '未知错误')
-                    return f"QQ音乐搜索失败: {error_msg}"
+                    return "抱歉，暂时无法翻译，请稍后再试。"
             else:
-                logger.error(f"QQ音乐接口调用失败，状态码: {response.status_code}")
-                logger.error(f"QQ音乐接口错误响应: {response.text}")
-                return "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
+                logger.error(f"AI接口调用失败，状态码: {response.status_code}")
+                logger.error(f"AI接口错误响应: {response.text}")
+                return "抱歉，暂时无法翻译，请稍后再试。"
                 
         except requests.exceptions.RequestException as e:
-            logger.error(f"QQ音乐接口网络请求错误: {e}")
+            logger.error(f"AI接口网络请求错误: {e}")
             return "网络请求错误，请稍后再试"
         except Exception as e:
-            logger.error(f"搜索QQ音乐时出错: {e}")
-            return "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
+            logger.error(f"翻译时出错: {e}")
+            return "抱歉，暂时无法翻译，请稍后再试。"
+            
+    def search_qq_music(self, song_name, index=1):
+        """搜索QQ音乐，返回第index首的链接及其他候选结果"""
+        song, error = self.music_search.get(song_name, index)
+        if error:
+            return error
+        if song is None:
+            return f"抱歉，未找到与'{song_name}'相关的歌曲。"
+        logger.info(f"QQ音乐搜索 '{song_name}' 第{index}首: {song.title} - {song.singer}")
+        
+        result = f"找到歌曲: {song.title} - {song.singer}"
+        if song.url:
+            self.music_sources.set(song.url, [song_name, index])
+            result += f"\n歌曲链接: {song.url}"
+        else:
+            result += f"\n无法获取播放链接"
+        # 候选列表已在缓存中，不会再次请求接口
+        others = [other for other in self.music_search.search(song_name)[0] if other.index != song.index]
+        if others:
+            result += "\n其他结果: " + "；".join(f"{other.index}. {other.title} - {other.singer}"
+                                              for other in others[:4])
+            result += f"\n发送 /qqmusic {song_name} <序号> 选择其他歌曲"
+        return result
             
     def text_to_speech(self, text):
-        """文本转语音"""
+        """文本转语音，返回音频链接，相同文本和声音直接使用缓存"""
         try:
-            # 使用文本转语音API
-            url = "https://api.suyanw.cn/api/tts.php"
-            params = {
-                "text": text,
-                "voice": "素颜"  # 使用默认声音
-            }
-            
-            logger.info(f"请求文本转语音: {url}")
-            
-            # 设置请求头
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'application/json',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive'
-            }
-            
-            response = self.session.get(url, params=params, headers=headers, timeout=30)
-            
-            logger.info(f"文本转语音接口响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                # 解析JSON响应
-                data = response.json()
-                
-                # 检查是否有内容
-                if 'code' in data and data['code'] == 200:
-                    # 提取音频链接
-                    file_link = data['data']['file_link']
-                    return file_link
-                else:
-                    error_msg = data.get('msg', '未知错误')
-                    logger.error(f"文本转语音失败: {error_msg}")
-                    return None
-            else:
-                logger.error(f"文本转语音接口调用失败，状态码: {response.status_code}")
-                logger.error(f"文本转语音接口错误响应: {response.text}")
-                return None
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"文本转语音接口网络请求错误: {e}")
-            return None
+            file_link = self.tts.synthesize(text)
+            if file_link:
+                logger.info(f"文本转语音完成: {file_link}")
+            return file_link
         except Exception as e:
             logger.error(f"文本转语音时出错: {e}")
             return None
             
-    def handle_info_commands(self, user_name, message_text):
-        """处理信息查询命令"""
-        # 处理不同的信息查询命令前缀
-        if message_text.startswith('/translate'):
-            # 翻译命令
-            command_prefix = '/translate'
-        else:
-            return False
+    def play_music(self):
+        """播放音乐"""
+        # 按播放模式移动游标，上一首已播放的歌曲会移出列表
+        song = self.music_playlist.advance()
+        if song is None:
+            self.send_message("播放列表中没有可播放的歌曲" if self.music_playlist else "播放列表为空")
+            return
             
-        # 移除命令前缀
-        command = message_text[len(command_prefix):].strip()
+        title = f"{song.title} " if song.title else ""
+        info = self.link_validator.result(song.id)
+        duration = f"（{format_duration(info.duration)}）" if info and info.duration else ""
+        self.send_message(f"正在播放: {title}{duration}{song.url}")
+        logger.info(f"播放音乐: {song.url}")
         
-        if command_prefix == '/translate':
-            # 翻译文本
-            if command:
-                result = self.translate_text(command)
-                self.send_message(f"@{user_name} {result}")
-                return True
-            else:
-                self.send_message("请提供要翻译的内容: /translate <内容>")
-                return True
-                
-        return True
+    def is_expiring_link(self, url):
+        """是否为会过期的QQ音乐链接"""
+        host = (urlparse(url).hostname or '').lower()
+        return host.endswith('qq.com') or 'qqmusic' in host
         
-    def handle_music_commands(self, user_name, message_text):
-        """处理音乐点播命令"""
-        # 处理不同的音乐命令前缀
-        if message_text.startswith('/music'):
-            # 旧的/music命令格式
-            command_prefix = '/music'
-        elif message_text.startswith('/play'):
-            # 新的/play命令格式
-            command_prefix = '/play'
-        elif message_text.startswith('/netmusic'):
-            # 网易云音乐搜索命令
-            command_prefix = '/netmusic'
-        elif message_text.startswith('/qqmusic'):
-            # QQ音乐搜索命令
-            command_prefix = '/qqmusic'
-        elif message_text.startswith('/tts'):
-            # 文本转语音命令
-            command_prefix = '/tts'
-        elif message_text.startswith('/next'):
-            # 播放下一首命令
-            command_prefix = '/next'
-        elif message_text.startswith('/playlist'):
-            # 查看播放列表命令
-            command_prefix = '/playlist'
-        elif message_text.startswith('/clear'):
-            # 清空播放列表命令
-            command_prefix = '/clear'
-        else:
+    def check_song_link(self, song):
+        """记录歌曲链接的过期时间并提交后台检测"""
+        default = time.time() + self.qq_link_ttl if self.is_expiring_link(song.url) else float('inf')
+        with self.link_lock:
+            self.link_expires[song.id] = link_expiry(song.url, default)
+        self.link_validator.forget(song.id)
+        self.link_validator.submit(song.id, song.url)
+        
+    def handle_link_result(self, song_id, url, info):
+        """链接检测完成（在检测线程中执行）：失效的链接先尝试刷新，无法刷新时标记并跳过"""
+        song = self.music_playlist.get(song_id)
+        if song is None or song.url != url or info.alive is not False:
+            return
+        logger.info(f"歌曲 {song.display()} 的链接已失效: {info.error}")
+        if self.refresh_song_link(song):
+            return
+        self.music_playlist.mark_dead(song_id)
+        owner = f"@{song.user} " if song.user else ""
+        self.send_message(f"{owner}歌曲 {song.display()} 的链接已失效（{info.error}），播放时将跳过，"
+                          f"可使用 /playlist remove {song_id} 移除")
+        
+    def refresh_song_link(self, song):
+        """按点歌时的搜索关键词和序号重新获取歌曲链接，成功时更换链接并返回True"""
+        now = time.time()
+        # 不是来自QQ音乐搜索的歌曲无法确定是哪一首，不刷新
+        if not song.query or not self.is_expiring_link(song.url):
             return False
-            
-        # 移除命令前缀
-        command = message_text[len(command_prefix):].strip()
-        
-        if command_prefix == '/play':
-            # 提取歌曲名和链接
-            parts = command.split(' ', 1)
-            if len(parts) >= 2:
-                song_name, song_url = parts[0], parts[1]
-                self.music_playlist.append(song_url)
-                self.send_message(f"@{user_name} 已添加歌曲 '{song_name}' 到播放列表")
-                logger.info(f"用户 {user_name} 添加歌曲 '{song_name}' 到播放列表: {song_url}")
-                return True
-            else:
-                self.send_message("请使用格式: /play <歌曲名> <链接>")
-                return True
-                
-        elif command_prefix == '/netmusic':
-            # 搜索网易云音乐
-            if command:
-                self.send_message(f"@{user_name} 正在搜索网易云音乐: {command}")
-                # 这里应该调用网易云音乐搜索API
-                # 暂时用模拟回复
-                self.send_message(f"@{user_name} 搜索完成，找到相关歌曲，请使用/play命令添加到播放列表")
-                return True
-            else:
-                self.send_message("请提供要搜索的歌曲名: /netmusic <歌曲名>")
-                return True
-                
-        elif command_prefix == '/qqmusic':
-            # 搜索QQ音乐
-            if command:
-                self.send_message(f"@{user_name} 正在搜索QQ音乐: {command}")
-                # 调用QQ音乐搜索API
-                result = self.search_qq_music_direct(command)
-                self.send_message(f"@{user_name} {result}")
-                return True
-            else:
-                self.send_message("请提供要搜索的歌曲名: /qqmusic <歌曲名>")
-                return True
-                
-        elif command_prefix == '/tts':
-            # 文本转语音
-            if command:
-                self.send_message(f"@{user_name} 正在将文本转换为语音...")
-                # 调用文本转语音API
-                tts_result = self.text_to_speech(command)
-                if tts_result:
-                    # 直接输出URL而不是添加到播放列表
-                    self.send_message(f"@{user_name} 文本转语音完成:\n{tts_result}")
-                else:
-                    self.send_message(f"@{user_name} 文本转语音失败，请稍后再试")
-                return True
-            else:
-                self.send_message("请提供要转换的文本: /tts <文本>")
-                return True
-                
-        elif command_prefix == '/next':
-            # 播放下一首
-            self.play_music()
-            return True
-            
-        elif command_prefix == '/playlist':
-            # 查看播放列表
-            if self.music_playlist:
-                playlist_msg = f"@{user_name} 当前播放列表:\n" + "\n".join(self.music_playlist)
-            else:
-                playlist_msg = f"@{user_name} 播放列表为空"
-            self.send_message(playlist_msg)
-            return True
-            
-        elif command_prefix == '/clear':
-            # 清空播放列表
-            self.music_playlist.clear()
-            self.send_message(f"@{user_name} 播放列表已清空")
-            logger.info(f"用户 {user_name} 清空了播放列表")
-            return True
-            
-        # 处理原有的/music命令
-        if command.startswith('add'):
-            # 提取音乐链接
-            music_url = command[3:].strip()  # 移除'add'前缀
-            if music_url:
-                self.music_playlist.append(music_url)
-                self.send_message(f"@{user_name} 已添加到播放列表")
-                logger.info(f"用户 {user_name} 添加音乐到播放列表: {music_url}")
-                return True
-                
-        elif command == 'list':
-            if self.music_playlist:
-                playlist_msg = f"@{user_name} 当前播放列表:\n" + "\n".join(self.music_playlist)
-            else:
-                playlist_msg = f"@{user_name} 播放列表为空"
-            self.send_message(playlist_msg)
-            return True
-            
-        elif command == 'play':
-            self.play_music()
-            return True
-            
+        with self.link_lock:
+            # 同一首歌10分钟内只刷新一次，避免新链接仍失效时反复请求
+            if now - self.link_refreshed.get(song.id, 0) < self.link_refresh_margin:
+                return False
+            self.link_refreshed[song.id] = now
+        # 直接请求接口，不使用也不清除其他搜索共用的缓存
+        result, error = self.music_search.fetch(song.query, song.index)
+        if result is None or not result.url or result.url == song.url:
+            logger.info(f"刷新歌曲 {song.display()} 的链接失败: {error or '没有找到新链接'}")
+            return False
+        if not self.music_playlist.replace_url(song.id, result.url):
+            return False
+        logger.info(f"已刷新歌曲 {song.display()} 的链接")
+        self.check_song_link(self.music_playlist.get(song.id))
         return True
         
-    def play_music(self):
-        """播放音乐"""
-        if not self.music_playlist:
-            self.send_message("播放列表为空")
+    def prefetch_upcoming_links(self):
+        """检查即将播放的歌曲：补充检测未检测的链接，刷新即将过期的链接"""
+        current_time = time.time()
+        if current_time - self.last_link_prefetch < self.link_prefetch_interval:
             return
-            
-        # 播放第一首音乐
-        music_url = self.music_playlist[0]
-        self.send_message(f"正在播放: {music_url}")
-        logger.info(f"播放音乐: {music_url}")
+        self.last_link_prefetch = current_time
         
-        # 移除已播放的音乐
-        self.music_playlist.pop(0)
+        # 清理已移出列表的歌曲的记录
+        with self.link_lock:
+            removed = [song_id for song_id in self.link_expires if song_id not in self.music_playlist]
+            for song_id in removed:
+                self.link_expires.pop(song_id, None)
+                self.link_refreshed.pop(song_id, None)
+            link_expires = dict(self.link_expires)
+        for song_id in removed:
+            self.link_validator.forget(song_id)
+            
+        for song in self.music_playlist.upcoming(limit=self.link_prefetch_window):
+            if self.music_playlist.is_dead(song.id) or self.link_validator.checking(song.id):
+                continue
+            if song.id not in link_expires:
+                # 从快照恢复的歌曲
+                self.check_song_link(song)
+            elif link_expires[song.id] - current_time < self.link_refresh_margin:
+                self.command_pool.submit('', self.refresh_song_link, song)
+            elif self.link_validator.result(song.id) is None:
+                self.link_validator.submit(song.id, song.url)
         
     def auto_play_music(self):
         """自动播放音乐"""
@@ -1243,7 +1464,11 @@ AI功能命令（仅限管理员）:
             
         current_time = time.time()
         if current_time - self.last_auto_play_time >= self.auto_play_interval:
-            self.play_music()
+            if self.music_playlist.peek_next() is None:
+                # 已播放到末尾：点歌队列移出播放完的歌曲后停止，不再提示列表为空
+                self.music_playlist.finish()
+            else:
+                self.play_music()
             self.last_auto_play_time = current_time
             
     def send_hang_room_message(self):
@@ -1267,21 +1492,29 @@ AI功能命令（仅限管理员）:
         except Exception as e:
             logger.error(f"发送活跃信号失败: {e}")
             
-    def welcome_new_users(self):
+    def welcome_new_users(self, users=None):
         """欢迎新用户"""
         try:
-            room_info = self.get_room_info()
-            if not room_info:
-                return
-                
-            users = room_info.get('room', {}).get('users', [])
+            if users is None:
+                room_info = self.get_room_info()
+                if not room_info:
+                    return
+                users = room_info.get('room', {}).get('users', [])
             
             for user in users:
                 user_name = user.get('name', '')
                 user_id = user.get('id', '')
                 
                 # 跳过机器人自己和已欢迎的用户
-                if user_name == 'AI机器人' or user_id in self.welcomed_users:
+                if user_name == self.bot_name or user_id in self.welcomed_users:
+                    continue
+                    
+                # 被封禁或在黑名单中的用户直接踢出，不再欢迎
+                if self.is_denied(user_name, user_id, user.get('tripcode')):
+                    logger.info(f"封禁用户进入房间: {user_name}")
+                    self.kick_user(user_name, user_id)
+                    with self.state_lock:
+                        self.welcomed_users.add(user_id)
                     continue
                     
                 # 欢迎新用户
@@ -1290,7 +1523,8 @@ AI功能命令（仅限管理员）:
                 logger.info(f"已欢迎新用户: {user_name}")
                 
                 # 添加到已欢迎用户列表
-                self.welcomed_users.add(user_id)
+                with self.state_lock:
+                    self.welcomed_users.add(user_id)
                 
         except Exception as e:
             logger.error(f"欢迎新用户时出错: {e}")
@@ -1360,48 +1594,233 @@ AI功能命令（仅限管理员）:
             logger.error(f"保存用户违规记录失败: {e}")
             
     def auto_manage_user(self, user_name, user_id, violation_count):
-        """自动管理用户"""
+        """自动管理用户：只提醒和踢出，不发送封禁也不写入封禁名单（封禁只能由管理员执行）"""
         try:
             # 根据违规次数采取不同措施
             if violation_count >= 5:
                 # 踢出房间
                 self.kick_user(user_name, user_id)
             elif violation_count >= 3:
-                # 禁言
-                self.ban_user(user_name, user_id)
+                # 提醒用户继续违规将被踢出
+                logger.info(f"用户 {user_name} 已违规{violation_count}次")
+                self.send_message(f"@{user_name} 已多次发送不当内容，第5次违规将被踢出房间")
         except Exception as e:
             logger.error(f"自动管理用户时出错: {e}")
             
+    def _room_action_status(self, data, description):
+        """向房间发送管理操作，返回响应分类（ACTION_OK 等）"""
+        try:
+            response = self.session.post(f"{self.base_url}/room/?ajax=1&api=json", data=data, timeout=30)
+        except Exception as e:
+            logger.error(f"{description}时出错: {e}")
+            return ACTION_ERROR
+        status = DRRRAPI.classify_action_response(response.status_code, response.text, next(iter(data)))
+        if status != ACTION_OK:
+            logger.error(f"{description}失败（{status}），状态码: {response.status_code}，响应: {response.text[:200]}")
+        if status in (ACTION_REDIRECT, ACTION_AUTH_LOST):
+            # 已不在房间中或登录失效，交给重连流程处理
+            self.reconnect_controller.mark_degraded(f"{description}失败: {status}")
+        return status
+        
+    def _post_room_action(self, data, description):
+        """向房间发送管理操作，返回是否成功"""
+        return self._room_action_status(data, description) == ACTION_OK
+        
+    def handle_bulk_command(self, action, selector, argument):
+        """处理批量管理命令"""
+        if not argument:
+            hint = "<正则>" if selector == 'pattern' else "<秒数>"
+            self.send_message(f"请使用格式: /{action}-{selector} {hint}")
+            return
+        try:
+            if selector == 'pattern':
+                targets = self.user_directory.select(pattern=argument)
+            else:
+                targets = self.user_directory.select(joined_within=float(argument))
+        except (re.error, ValueError) as e:
+            self.send_message(f"无效的参数: {argument} ({e})")
+            return
+            
+        # 不处理机器人自己和管理员
+        targets = [user for user in targets
+                   if user.get('name') != self.bot_name
+                   and not self.is_admin(user.get('name'), user.get('id'), user.get('tripcode'))]
+        if not targets:
+            self.send_message("没有符合条件的用户")
+            return
+            
+        results = self.bulk_moderate(action, targets)
+        succeeded = [r['name'] for r in results if r['success']]
+        failed = [r['name'] for r in results if not r['success']]
+        action_name = "踢出" if action == 'kick' else "封禁"
+        summary = f"批量{action_name}完成: 成功{len(succeeded)}人"
+        if succeeded:
+            summary += f" ({', '.join(succeeded)})"
+        if failed:
+            summary += f"\n失败{len(failed)}人: {', '.join(failed)}"
+        if any(r['status'] in (ACTION_REDIRECT, ACTION_AUTH_LOST) for r in results):
+            summary += "\n机器人已不在房间中或登录已失效，已停止其余操作"
+        self.send_message(summary)
+        
+    def bulk_moderate(self, action, targets):
+        """以有限并发批量执行踢出/封禁，返回每个目标的结果
+
+        被重定向到休息室或登录失效时重试不会成功，停止重试并跳过其余目标。
+        """
+        aborted = threading.Event()
+        
+        def run(user):
+            data = {action: user['id']}
+            result = {"id": user['id'], "name": user.get('name'), "success": False, "attempts": 0,
+                      "status": ACTION_ERROR}
+            for attempt in range(self.bulk_retries + 1):
+                if aborted.is_set():
+                    break
+                result['attempts'] = attempt + 1
+                result['status'] = self._room_action_status(data, "踢出用户" if action == 'kick' else "封禁用户")
+                if result['status'] == ACTION_OK:
+                    if action == 'ban':
+                        self.acl.add('banned', user_id=user['id'], name=user.get('name'),
+                                     tripcode=user.get('tripcode'))
+                    result['success'] = True
+                    break
+                if result['status'] in (ACTION_REDIRECT, ACTION_AUTH_LOST):
+                    aborted.set()
+                    break
+                if attempt < self.bulk_retries:
+                    time.sleep(attempt + 1)
+            return result
+            
+        logger.info(f"批量{action}: {[user.get('name') for user in targets]}")
+        with ThreadPoolExecutor(max_workers=self.bulk_concurrency) as executor:
+            return list(executor.map(run, targets))
+        
     def kick_user(self, user_name, user_id):
         """踢出用户"""
         try:
-            # 这里应该调用实际的踢人API
             logger.info(f"踢出用户: {user_name} ({user_id})")
-            # 发送通知消息
-            self.send_message(f"用户 {user_name} 已被管理员踢出房间")
+            if not user_id:
+                logger.warning(f"未知用户ID，无法踢出: {user_name}")
+                return False
+            if self._post_room_action({'kick': user_id}, "踢出用户"):
+                # 发送通知消息
+                self.send_message(f"用户 {user_name} 已被管理员踢出房间")
+                return True
+            self.send_message(f"踢出用户 {user_name} 失败")
         except Exception as e:
             logger.error(f"踢出用户时出错: {e}")
+        return False
             
-    def ban_user(self, user_name, user_id):
-        """禁言用户"""
+    def ban_user(self, user_name, user_id, tripcode=None):
+        """禁言用户（只发送房间封禁，封禁名单由管理员命令维护）"""
         try:
-            # 这里应该调用实际的禁言API
             logger.info(f"禁言用户: {user_name} ({user_id})")
+            if user_id and not self._post_room_action({'ban': user_id}, "封禁用户"):
+                self.send_message(f"封禁用户 {user_name} 失败")
+                return False
             # 发送通知消息
             self.send_message(f"用户 {user_name} 已被管理员封禁")
+            return True
         except Exception as e:
             logger.error(f"禁言用户时出错: {e}")
+        return False
             
-    def unban_user(self, user_name):
-        """解封用户"""
+    def unban_user(self, user_name, user_id=None, tripcode=None):
+        """解封用户（只发送房间解封，封禁名单由管理员命令维护）"""
         try:
-            # 这里应该调用实际的解封API
             logger.info(f"解封用户: {user_name}")
+            if user_id and not self._post_room_action({'unban': user_id, 'userName': user_name}, "解封用户"):
+                self.send_message(f"解封用户 {user_name} 失败")
+                return False
             # 发送通知消息
             self.send_message(f"用户 {user_name} 已被管理员解封")
+            return True
         except Exception as e:
             logger.error(f"解封用户时出错: {e}")
+        return False
             
+    def handle_inappropriate(self, user_name, user_id, reason):
+        """处理包含不当内容的消息：记录违规、延迟警告并按违规次数自动管理"""
+        # 增加用户违规计数
+        user_key = f"{user_name}_{user_id}"
+        self.user_violations[user_key] = self.user_violations.get(user_key, 0) + 1
+        violation_count = self.user_violations[user_key]
+        
+        # 保存违规记录
+        self.save_user_violations()
+        
+        # 警告用户（延迟回复）
+        warning_msg = f"@{user_name} 发送的消息包含不当内容，已被系统拦截。请遵守聊天室规则。这是第{violation_count}次违规。"
+        # 延迟5-10秒发送警告消息，模拟缓慢回复
+        delay = random.randint(5, 10)
+        threading.Timer(delay, self.send_message, args=[warning_msg, None, None, True]).start()
+        logger.info(f"已检测到不当内容，将在{delay}秒后警告用户 {user_name}: {reason}")
+        
+        # 根据违规次数采取自动管理措施
+        self.auto_manage_user(user_name, user_id, violation_count)
+        
+    def moderate_message(self, user_name, user_id, message_text):
+        """用本地分类器审核消息，判定违规时拦截并返回True
+
+        本地判定违规的消息交给AI确认，确认后才按违规处理；不确定的消息交给AI标注，
+        AI的结果只记入违规日志用于训练，不单独作为处理依据。
+        """
+        verdict, probability = self.moderation_classifier.classify(message_text)
+        if verdict == VERDICT_CLEAN:
+            self.moderation_stats['clean'] += 1
+            return False
+        if verdict == VERDICT_VIOLATION:
+            self.moderation_stats['violation'] += 1
+            logger.info(f"本地分类器判定违规（{probability:.2f}），等待AI确认: {user_name}")
+        submitted = self.moderation_batcher.submit(message_text, (user_name, user_id, verdict))
+        self.moderation_stats['forwarded' if submitted else 'dropped'] += 1
+        return verdict == VERDICT_VIOLATION
+        
+    def ai_moderation_batch(self, texts):
+        """把多条消息合并为一个审核请求，返回AI的原始回复，失败时返回None"""
+        status, content = self.request_ai(build_batch_prompt(texts), self.current_ai_model, 60)
+        if status != 'ok':
+            logger.warning(f"批量AI审核失败，{len(texts)}条改为逐条审核: {content}")
+            return None
+        return content
+        
+    def ai_moderation_verdict(self, message_text):
+        """请求AI判断消息是否违规，返回True/False，无法判断时返回None"""
+        prompt = ("你是聊天室管理员，请判断下面这条消息是否包含辱骂、色情、暴力、赌博、毒品、诈骗或广告等不当内容。"
+                  f"只回答“是”或“否”。\n消息：{message_text}")
+        status, content = self.request_ai(prompt, self.current_ai_model, 30)
+        if status != 'ok':
+            return None
+        answer = content.strip().lstrip('“"\'')
+        if answer.startswith('是'):
+            return True
+        if answer.startswith('否') or answer.startswith('不'):
+            return False
+        return None
+        
+    def apply_moderation_verdict(self, message_text, context, verdict):
+        """处理AI审核结果（在审核线程中执行），结果记入违规日志
+
+        只有本地分类器和AI都判定违规时才计入违规次数。
+        """
+        user_name, user_id, local_verdict = context
+        self.violation_journal.append(message_text, 1 if verdict else 0, 'ai')
+        if verdict and local_verdict == VERDICT_VIOLATION:
+            self.moderation_stats['confirmed'] += 1
+            self.handle_inappropriate(user_name, user_id, "本地分类器和AI审核均判定违规")
+        self.maybe_retrain_classifier()
+        
+    def maybe_retrain_classifier(self):
+        """违规日志新增足够多样本后在后台重新训练分类器"""
+        if self.violation_journal.appended - self.moderation_trained_at < self.moderation_retrain_every:
+            return
+        self.moderation_trained_at = self.violation_journal.appended
+        
+        def retrain():
+            if self.moderation_classifier.train(self.violation_journal.samples()):
+                logger.info(f"本地审核分类器已重新训练，样本数: {self.moderation_classifier.trained_samples}")
+        threading.Thread(target=retrain, daemon=True).start()
+        
     def check_inappropriate_content(self, message):
         """检查不当内容"""
         try:
@@ -1436,17 +1855,18 @@ AI功能命令（仅限管理员）:
     def is_duplicate_message(self, message):
         """检查是否为重复消息"""
         try:
-            # 检查消息是否在最近发送的消息中
-            if message in self.recent_messages:
-                return True
-                
-            # 添加到最近消息列表
-            self.recent_messages.append(message)
-            
-            # 保持列表大小在限制范围内
-            if len(self.recent_messages) > self.max_recent_messages:
-                self.recent_messages.pop(0)
+            with self.state_lock:
+                # 检查消息是否在最近发送的消息中
+                if message in self.recent_messages:
+                    return True
+                    
+                # 添加到最近消息列表
+                self.recent_messages.append(message)
                 
+                # 保持列表大小在限制范围内
+                if len(self.recent_messages) > self.max_recent_messages:
+                    self.recent_messages.pop(0)
+                    
             return False
         except Exception as e:
             logger.error(f"检查重复消息时出错: {e}")
@@ -1462,6 +1882,7 @@ AI功能命令（仅限管理员）:
                 user = message_data.get('from', {})
                 user_name = user.get('name', 'Unknown')
                 user_id = user.get('id', '')
+                tripcode = user.get('tripcode', '')
                 message_text = message_data.get('message', '')
                 
                 # 处理表情符号
@@ -1469,8 +1890,15 @@ AI功能命令（仅限管理员）:
                 
                 logger.info(f"[{user_name}]: {message_text}")
                 
+                is_admin = self.is_admin(user_name, user_id, tripcode)
+                
+                # 忽略被封禁或在黑名单中的用户
+                if not is_admin and self.is_denied(user_name, user_id, tripcode):
+                    logger.info(f"忽略封禁用户的消息: {user_name}")
+                    return
+                
                 # 检查用户是否触发频率限制（管理员除外）
-                if not self.is_admin(user_name) and self.is_user_rate_limited(user_id):
+                if not is_admin and self.is_user_rate_limited(user_id):
                     # 增加用户违规计数
                     user_key = f"{user_name}_{user_id}"
                     self.user_violations[user_key] = self.user_violations.get(user_key, 0) + 1
@@ -1492,7 +1920,7 @@ AI功能命令（仅限管理员）:
                     return  # 不继续处理该消息
                 
                 # 检查用户是否重复发送相同消息（管理员除外）
-                if not self.is_admin(user_name) and self.is_user_repeating_message(user_id, message_text):
+                if not is_admin and self.is_user_repeating_message(user_id, message_text):
                     # 增加用户违规计数
                     user_key = f"{user_name}_{user_id}"
                     self.user_violations[user_key] = self.user_violations.get(user_key, 0) + 1
@@ -1513,42 +1941,21 @@ AI功能命令（仅限管理员）:
                     return  # 不继续处理该消息
                     
                 # 检查消息是否包含不当内容（管理员除外）
-                if not self.is_admin(user_name):
+                if not is_admin:
                     is_inappropriate, reason = self.check_inappropriate_content(message_text)
                     if is_inappropriate:
-                        # 增加用户违规计数
-                        user_key = f"{user_name}_{user_id}"
-                        self.user_violations[user_key] = self.user_violations.get(user_key, 0) + 1
-                        violation_count = self.user_violations[user_key]
-                        
-                        # 保存违规记录
-                        self.save_user_violations()
-                        
-                        # 警告用户（延迟回复）
-                        warning_msg = f"@{user_name} 发送的消息包含不当内容，已被系统拦截。请遵守聊天室规则。这是第{violation_count}次违规。"
-                        # 延迟5-10秒发送警告消息，模拟缓慢回复
-                        delay = random.randint(5, 10)
-                        threading.Timer(delay, self.send_message, args=[warning_msg, None, None, True]).start()
-                        logger.info(f"已检测到不当内容，将在{delay}秒后警告用户 {user_name}: {reason}")
-                        
-                        # 根据违规次数采取自动管理措施
-                        self.auto_manage_user(user_name, user_id, violation_count)
+                        self.violation_journal.append(message_text, 1, 'keyword')
+                        self.handle_inappropriate(user_name, user_id, reason)
                         return  # 不继续处理该消息
+                        
+                    # AI房间管理：分类器训练完成（或开启AI标注）后才使用本地分类器和远程AI审核
+                    if self.ai_manage_enabled and not message_text.startswith('/') and \
+                            (self.moderation_classifier.ready or self.moderation_learning):
+                        if self.moderate_message(user_name, user_id, message_text):
+                            return  # 不继续处理该消息
                 
-                # 处理管理员命令（仅管理员可以使用）
-                if self.handle_admin_commands(user_name, message_text):
-                    return
-                    
-                # 处理AI对话命令（所有用户都可以使用）
-                if self.handle_ai_command(user_name, message_text):
-                    return
-                    
-                # 处理音乐点播命令（所有用户都可以使用）
-                if self.handle_music_commands(user_name, message_text):
-                    return
-                    
-                # 处理信息查询命令（所有用户都可以使用）
-                if self.handle_info_commands(user_name, message_text):
+                # 处理命令（权限、参数和频率限制由命令注册表统一检查）
+                if self.dispatch_command(user_name, user_id, message_text, is_admin):
                     return
                     
                 # 其他消息可以在这里处理
@@ -1562,24 +1969,56 @@ AI功能命令（仅限管理员）:
         # 缩短心跳间隔到30秒，更频繁地检查连接状态
         if current_time - self.last_heartbeat > 30:
             logger.info("检测到连接可能已断开，尝试重新连接...")
-            self.is_connected = False
+            self.reconnect_controller.mark_degraded("心跳超时")
             
+    def is_bot_in_room(self, room_info):
+        """检查机器人是否在房间用户列表中"""
+        users = room_info.get('room', {}).get('users', [])
+        return any(user.get('name') == self.bot_name for user in users)
+        
     def reconnect(self):
-        """重新连接"""
+        """重新连接（由重连控制器在后台执行）"""
         logger.info("尝试重新连接...")
-        try:
-            # 重新加入房间
-            if self.join_room(self.room_id_saved):
-                logger.info("重新连接成功")
-                self.is_connected = True
-                self.last_heartbeat = time.time()
-            else:
-                logger.error("重新连接失败")
-                # 如果重连失败，等待一段时间再试
-                time.sleep(30)
-        except Exception as e:
-            logger.error(f"重新连接时出错: {e}")
-            time.sleep(30)
+        self.reconnect_controller.request_rejoin("手动重连")
+        
+    def _rejoin_room(self):
+        """重新加入房间并确认机器人已在房间中"""
+        if not self.join_room(self.room_id_saved, max_retries=1, timeout=10):
+            logger.error("重新连接失败")
+            return False
+        room_info = self.get_room_info(max_retries=1)
+        if room_info and self.is_bot_in_room(room_info):
+            logger.info("重新连接成功")
+            return True
+        logger.error("重新连接失败: 机器人不在房间中")
+        return False
+        
+    def _reload_cookie(self):
+        """重新读取login_config.json中的Cookie，确认仍处于登录状态后重新加入房间
+
+        机器人无法自行登录，Cookie失效时只能等待人工更新配置文件。
+        """
+        logger.info("多次重新加入房间失败，重新读取Cookie并检查登录状态...")
+        login_bot = SmartLoginBot(self.login_config_file)
+        # 优先使用配置文件中可能已更新的Cookie
+        cookie_string = login_bot.config.get('cookie') or self.cookie_string
+        login_bot.set_cookie(cookie_string)
+        if not login_bot.check_login_status():
+            logger.error("Cookie已失效，请更新login_config.json中的cookie")
+            return False
+        # 合并服务器下发的新Cookie
+        cookies = dict(item.split('=', 1) for item in cookie_string.split('; ') if '=' in item)
+        cookies.update(login_bot.session.cookies.get_dict())
+        self.cookie_string = "; ".join(f"{key}={value}" for key, value in cookies.items())
+        self.set_cookie(self.cookie_string)
+        return self._rejoin_room()
+        
+    def _on_connection_state_change(self, old_state, new_state):
+        """连接状态变化"""
+        logger.info(f"连接状态: {old_state} -> {new_state}")
+        self.is_connected = new_state == STATE_CONNECTED
+        if self.is_connected:
+            self.last_heartbeat = time.time()
             
     def save_heartbeat(self):
         """保存心跳信息"""
@@ -1594,12 +2033,52 @@ AI功能命令（仅限管理员）:
         except Exception as e:
             logger.error(f"保存心跳信息失败: {e}")
             
+    def start_push_transport(self):
+        """启动实时消息传输，推送的消息会在监控循环中立即处理"""
+        if self.transport_mode == TRANSPORT_POLLING or self.push_client:
+            return
+        # 推送不可用时由监控循环的轮询兜底，无需再单独轮询
+        self.push_client = DRRRWebSocketClient(self.base_url, mode=self.transport_mode,
+                                               ws_url=self.ws_url, fallback_polling=False)
+        self.push_client.start_background(self.pushed_talks, self.cookie_string, self.room_id)
+        logger.info(f"已启动实时消息传输: {self.transport_mode}")
+        
+    def wait_for_pushed_talks(self, timeout):
+        """等待推送的消息，超时返回空列表"""
+        if not self.push_client:
+            time.sleep(max(0, timeout))
+            return []
+        try:
+            talks = [self.pushed_talks.get(timeout=max(0.01, timeout))]
+        except queue.Empty:
+            return []
+        # 一次取出所有已到达的消息
+        while True:
+            try:
+                talks.append(self.pushed_talks.get_nowait())
+            except queue.Empty:
+                return talks
+                
+    def process_talks(self, talks, processed_messages):
+        """处理未处理过的消息，返回更新后的已处理记录"""
+        for talk in talks:
+            # 简单的去重检查（基于消息内容和发送者）
+            talk_key = f"{talk.get('message', '')}_{talk.get('from', {}).get('id', '')}_{talk.get('time', 0)}"
+            if talk_key not in processed_messages:
+                self.process_message(talk)
+                with self.state_lock:
+                    processed_messages[talk_key] = None
+                    # 只保留最近处理的消息记录
+                    while len(processed_messages) > self.max_processed_talks:
+                        processed_messages.popitem(last=False)
+                # 限制消息处理速度，避免过快
+                time.sleep(0.1)
+        return processed_messages
+        
     def monitor_room(self):
         """监控房间活动"""
         logger.info("开始监控房间活动...")
-        last_users = set()
         last_keep_alive_time = time.time()
-        processed_messages = set()  # 用于跟踪已处理的消息
         
         while True:
             try:
@@ -1611,33 +2090,9 @@ AI功能命令（仅限管理员）:
                     self.last_heartbeat = current_time
                     # 保存心跳信息
                     self.save_heartbeat()
-                    # 检查连接状态
-                    if not self.is_connected:
-                        logger.warning("检测到连接断开")
-                        # 尝试重新连接
-                        self.reconnect()
-                        
-                # 增加额外的连接检查，确保机器人在房间中
-                if self.is_connected:
-                    # 每30秒检查一次是否仍在房间中
-                    if current_time - self.last_heartbeat >= 30:
-                        try:
-                            room_info = self.get_room_info()
-                            if room_info:
-                                # 检查机器人是否仍在房间中
-                                users = room_info.get('room', {}).get('users', [])
-                                bot_in_room = any(user.get('name') == 'AI机器人' for user in users)
-                                if not bot_in_room:
-                                    logger.warning("检测到机器人不在房间中，尝试重新加入...")
-                                    self.is_connected = False
-                                    self.reconnect()
-                            else:
-                                logger.warning("无法获取房间信息，可能连接已断开")
-                                self.is_connected = False
-                                self.reconnect()
-                        except Exception as e:
-                            logger.warning(f"检查房间信息时出错: {e}")
-                            # 即使检查失败，也继续运行
+                    
+                # 推进断线重连（在后台进行，不阻塞后续处理）
+                self.reconnect_controller.step()
                         
                 # 发送挂房消息
                 self.send_hang_room_message()
@@ -1645,54 +2100,60 @@ AI功能命令（仅限管理员）:
                 # 自动播放音乐
                 self.auto_play_music()
                 
+                # 检查即将播放的歌曲链接
+                self.prefetch_upcoming_links()
+                
                 # 每3分钟发送一次活跃信号，防止账号被踢
                 current_time = time.time()
                 if current_time - last_keep_alive_time >= 3 * 60:
                     self.keep_alive()
                     last_keep_alive_time = current_time
                     
-                # 获取最新的房间信息
+                # 获取最新的房间信息（重试由重连控制器负责）
                 try:
-                    room_info = self.get_room_info()
+                    room_info = self.get_room_info(max_retries=1)
                     if room_info:
-                        # 检查新用户加入
+                        # 同时作为连接健康检查，确保机器人在房间中
+                        if self.is_bot_in_room(room_info):
+                            self.reconnect_controller.mark_healthy()
+                        else:
+                            logger.warning("检测到机器人不在房间中，尝试重新加入...")
+                            self.reconnect_controller.request_rejoin("机器人不在房间中")
+                            
+                        # 根据房间快照增量更新用户目录，检查新用户加入
                         users = room_info.get('room', {}).get('users', [])
-                        current_users = {user.get('id', '') for user in users}
-                        
-                        # 检查是否有新用户
-                        new_users = current_users - last_users
+                        new_users, _ = self.user_directory.update(users)
                         if new_users:
-                            self.welcome_new_users()
-                            
-                        last_users = current_users
+                            self.welcome_new_users(new_users)
                         
                         # 检查新消息
                         talks = room_info.get('room', {}).get('talks', [])
                     else:
+                        logger.warning("无法获取房间信息，可能连接已断开")
+                        self.reconnect_controller.mark_degraded("无法获取房间信息")
                         talks = []
                 except Exception as e:
                     logger.warning(f"获取房间信息时出错: {e}")
+                    self.reconnect_controller.mark_degraded(str(e))
                     # 即使获取房间信息失败，也继续运行
                     room_info = None
                     talks = []
                     
                 # 处理所有未处理的消息
                 if talks:
-                    for talk in talks:
-                        # 简单的去重检查（基于消息内容和发送者）
-                        talk_key = f"{talk.get('message', '')}_{talk.get('from', {}).get('id', '')}_{talk.get('time', 0)}"
-                        if talk_key not in processed_messages:
-                            self.process_message(talk)
-                            processed_messages.add(talk_key)
-                            # 限制消息处理速度，避免过快
-                            time.sleep(0.1)
-                        
-                        # 保持processed_messages集合大小合理
-                        if len(processed_messages) > 1000:
-                            # 只保留最近的500条消息的记录
-                            processed_messages = set(list(processed_messages)[-500:])
-                            
-                time.sleep(3)  # 每3秒检查一次
+                    self.processed_talks = self.process_talks(talks, self.processed_talks)
+                    
+                # 保存状态快照（只写入变化的部分）
+                if current_time - self.last_snapshot_time >= self.snapshot_interval:
+                    self.save_state()
+                    self.last_snapshot_time = current_time
+                    
+                # 每3秒轮询一次；期间推送到达的消息立即处理
+                next_poll_time = time.time() + 3
+                while time.time() < next_poll_time:
+                    pushed = self.wait_for_pushed_talks(next_poll_time - time.time())
+                    if pushed:
+                        self.processed_talks = self.process_talks(pushed, self.processed_talks)
                 
             except KeyboardInterrupt:
                 logger.info("\n接收到中断信号")
@@ -1701,6 +2162,77 @@ AI功能命令（仅限管理员）:
                 logger.error(f"监控房间时出错: {e}")
                 time.sleep(5)
                 
+    def collect_state(self):
+        """需要在重启后恢复的状态"""
+        with self.state_lock:
+            welcomed_users = sorted(self.welcomed_users)
+            recent_messages = list(self.recent_messages)
+            processed_talks = list(self.processed_talks)
+        with self.link_lock:
+            link_expires = {str(song_id): expires for song_id, expires in self.link_expires.items()
+                            if expires != float('inf')}
+        return {
+            'playlist': self.music_playlist.snapshot(),
+            'welcomed_users': welcomed_users,
+            'recent_messages': recent_messages,
+            'processed_talks': processed_talks,
+            'link_expires': link_expires,
+            'features': {
+                'ai_enabled': self.ai_enabled,
+                'ai_manage_enabled': self.ai_manage_enabled,
+                'moderation_learning': self.moderation_learning,
+                'auto_play_enabled': self.auto_play_enabled,
+                'hang_room_enabled': self.hang_room_enabled,
+                'current_ai_model': self.current_ai_model,
+            },
+        }
+        
+    def save_state(self, full=False):
+        """保存状态快照"""
+        try:
+            self.state_snapshot.save(self.collect_state(), full=full)
+        except Exception as e:
+            logger.error(f"保存状态快照时出错: {e}")
+            
+    def restore_state(self):
+        """从状态快照恢复，返回快照保存的时间，没有快照时返回None"""
+        start_time = time.time()
+        state = self.state_snapshot.load()
+        self.state_loaded = True
+        if not state:
+            return None
+        if 'playlist' in state:
+            self.music_playlist.restore(state['playlist'])
+        with self.state_lock:
+            self.welcomed_users = set(state.get('welcomed_users', []))
+            self.recent_messages = state.get('recent_messages', [])[-self.max_recent_messages:]
+            self.processed_talks = OrderedDict.fromkeys(state.get('processed_talks', [])[-self.max_processed_talks:])
+        with self.link_lock:
+            self.link_expires = {int(song_id): expires for song_id, expires in state.get('link_expires', {}).items()}
+        for attribute, value in state.get('features', {}).items():
+            if attribute == 'current_ai_model' and value not in self.ai_models:
+                continue
+            setattr(self, attribute, value)
+        logger.info(f"已恢复状态快照：播放列表{len(self.music_playlist)}首，已欢迎用户{len(self.welcomed_users)}人，"
+                    f"耗时{(time.time() - start_time) * 1000:.1f}毫秒")
+        return self.state_snapshot.saved_at
+        
+    def shutdown(self):
+        """停止后台任务"""
+        if self.state_loaded:
+            self.save_state(full=True)
+        self.stop_event.set()
+        self.joke_pool.stop()
+        self.ai_pool.shutdown()
+        self.moderation_batcher.stop()
+        self.ai_hedge_pool.shutdown(wait=False, cancel_futures=True)
+        self.command_pool.shutdown()
+        self.link_validator.shutdown()
+        self.ai_cache.close()
+        self.tts.cache.close()
+        if self.push_client:
+            self.push_client.stop_background()
+            
     def run_bot(self, room_id, cookie_string):
         """运行机器人"""
         try:
@@ -1708,6 +2240,10 @@ AI功能命令（仅限管理员）:
             self.cookie_string = cookie_string
             self.room_id_saved = room_id
             
+            # 恢复上次运行的状态
+            saved_at = self.restore_state()
+            restarted = saved_at is not None and time.time() - saved_at < self.restart_grace
+            
             # 设置Cookie
             self.set_cookie(cookie_string)
             
@@ -1716,8 +2252,15 @@ AI功能命令（仅限管理员）:
                 logger.error("加入房间失败")
                 return
                 
-            # 发送上线消息
-            self.send_message("AI机器人已上线")
+            # 启动实时消息传输（如已配置）
+            self.start_push_transport()
+            
+            # 在后台补充笑话池
+            self.joke_pool.start()
+            
+            # 发送上线消息（刚重启时不发送，房间内感知不到重启）
+            if not restarted:
+                self.send_message("AI机器人已上线")
             
             # 保存初始心跳信息
             self.save_heartbeat()
@@ -1729,6 +2272,8 @@ AI功能命令（仅限管理员）:
             logger.error(f"运行时出错: {e}")
             import traceback
             traceback.print_exc()
+        finally:
+            self.shutdown()
 
 def main():
     """主函数"""
@@ -1737,12 +2282,20 @@ def main():
     
     bot = DRRREnhancedAIBot()
     
+    # 收到SIGTERM（如节点重启时的pkill）时正常退出，保存最终状态快照
+    def handle_sigterm(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
     # 从login_config.json读取配置信息
     try:
         with open('login_config.json', 'r', encoding='utf-8') as f:
             config = json.load(f)
         cookie_string = config.get('cookie', '')
         room_id = config.get('room_id', '')
+        bot.transport_mode = config.get('transport', TRANSPORT_POLLING)
+        bot.ws_url = config.get('ws_url') or None
+        bot.ai_stream_url = config.get('ai_stream_url') or None
         
         if not cookie_string or not room_id:
             print("错误：login_config.json中缺少cookie或room_id")
@@ -0,0 +1,210 @@
+# 权限列表存储模块
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.helpers import normalize_name
+
+# 支持的名单和索引字段
+ACL_LISTS = ('admins', 'banned', 'whitelist', 'blacklist')
+ACL_FIELDS = ('id', 'name', 'tripcode')
+# 用户名需精确匹配的名单：任何人都可以取相似的用户名，管理员不能按规范化后的用户名匹配
+EXACT_NAME_LISTS = ('admins',)
+
+
+class ACLStore:
+    """权限列表存储
+
+    每个名单按用户ID、用户名、tripcode分别建立哈希索引，成员检查为O(1)。
+    变更以JSON Lines追加写入日志文件，日志过长时原子压缩；
+    其他进程修改文件后会在下次查询时自动增量重新加载。
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 2.0):
+        self.path = path  # 为None时仅保存在内存中
+        self.reload_interval = reload_interval  # 检查文件变更的最小间隔（秒）
+        self._lock = threading.RLock()
+        self._index: Dict[Tuple[str, str], Set[str]] = {
+            (acl, field): set() for acl in ACL_LISTS for field in ACL_FIELDS
+        }
+        self._log_lines = 0  # 日志中的记录条数
+        self._file_state = None  # (inode, size, mtime)
+        self._offset = 0  # 已读取到的文件位置
+        self._last_check = 0.0
+        if self.path:
+            self._load()
+
+    @staticmethod
+    def _key(acl: str, field: str, value: str) -> str:
+        """生成索引键，封禁类名单的用户名忽略大小写和全角差异，管理员名单精确匹配"""
+        if field == 'name' and acl not in EXACT_NAME_LISTS:
+            return normalize_name(value)
+        return str(value)
+
+    def _apply(self, record: Dict[str, str]):
+        """将一条日志记录应用到索引"""
+        acl, field, op = record.get('list'), record.get('field'), record.get('op')
+        bucket = self._index.get((acl, field))
+        if bucket is None or not record.get('value'):
+            return
+        key = self._key(acl, field, record['value'])
+        if op == 'add':
+            bucket.add(key)
+        elif op == 'remove':
+            bucket.discard(key)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_size, st.st_mtime)
+        except OSError:
+            return None
+
+    def _load(self):
+        """从头加载日志文件"""
+        for bucket in self._index.values():
+            bucket.clear()
+        self._log_lines = 0
+        self._offset = 0
+        self._read_from_offset()
+
+    def _read_from_offset(self):
+        """从上次读取的位置继续应用日志"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                f.seek(self._offset)
+                while True:
+                    line = f.readline()
+                    # 不完整的最后一行留到下次读取
+                    if not line or not line.endswith('\n'):
+                        break
+                    self._offset = f.tell()
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._apply(json.loads(line))
+                        self._log_lines += 1
+                    except (json.JSONDecodeError, AttributeError):
+                        print(f"跳过无效的权限记录: {line[:100]}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"加载权限列表失败: {e}")
+        self._file_state = self._stat()
+
+    def _maybe_reload(self, force: bool = False):
+        """文件被外部修改时重新加载"""
+        if not self.path:
+            return
+        now = time.time()
+        if not force and now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        state = self._stat()
+        if state == self._file_state:
+            return
+        if (state and self._file_state and state[0] == self._file_state[0]
+                and state[1] >= self._offset):
+            # 同一文件追加了新记录，增量读取
+            self._read_from_offset()
+        else:
+            self._load()
+
+    def _append(self, records: List[Dict[str, str]]):
+        """追加写入日志"""
+        if not self.path or not records:
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self._offset = f.tell()
+            self._log_lines += len(records)
+            self._file_state = self._stat()
+        except Exception as e:
+            print(f"保存权限列表失败: {e}")
+            return
+        # 失效记录超过有效条目时压缩日志
+        if self._log_lines > 2 * self.size() + 100:
+            self.compact()
+
+    def compact(self):
+        """将当前索引重写为紧凑的日志文件"""
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    count = 0
+                    for (acl, field), bucket in self._index.items():
+                        for value in sorted(bucket):
+                            f.write(json.dumps({'op': 'add', 'list': acl, 'field': field,
+                                                'value': value}, ensure_ascii=False) + '\n')
+                            count += 1
+                    f.flush()
+                    os.fsync(f.fileno())
+                    offset = f.tell()
+                os.replace(tmp_path, self.path)
+                self._log_lines = count
+                self._offset = offset
+                self._file_state = self._stat()
+            except Exception as e:
+                print(f"压缩权限列表失败: {e}")
+
+    def _records(self, op: str, acl: str, user_id=None, name=None, tripcode=None):
+        if acl not in ACL_LISTS:
+            raise ValueError(f"未知的权限列表: {acl}")
+        return [{'op': op, 'list': acl, 'field': field, 'value': value}
+                for field, value in (('id', user_id), ('name', name), ('tripcode', tripcode))
+                if value]
+
+    def add(self, acl: str, user_id: str = None, name: str = None, tripcode: str = None) -> bool:
+        """添加用户到名单，返回是否有新增"""
+        with self._lock:
+            # 写入前先同步外部变更，保证读取位置与文件末尾一致
+            self._maybe_reload(force=True)
+            records = [r for r in self._records('add', acl, user_id, name, tripcode)
+                       if self._key(acl, r['field'], r['value']) not in self._index[(acl, r['field'])]]
+            for record in records:
+                self._apply(record)
+            self._append(records)
+            return bool(records)
+
+    def remove(self, acl: str, user_id: str = None, name: str = None, tripcode: str = None) -> bool:
+        """从名单移除用户，返回是否有移除"""
+        with self._lock:
+            self._maybe_reload(force=True)
+            records = [r for r in self._records('remove', acl, user_id, name, tripcode)
+                       if self._key(acl, r['field'], r['value']) in self._index[(acl, r['field'])]]
+            for record in records:
+                self._apply(record)
+            self._append(records)
+            return bool(records)
+
+    def contains(self, acl: str, user_id: str = None, name: str = None, tripcode: str = None) -> bool:
+        """检查用户ID、用户名或tripcode任一是否在名单中"""
+        with self._lock:
+            self._maybe_reload()
+            return ((bool(user_id) and str(user_id) in self._index[(acl, 'id')]) or
+                    (bool(name) and self._key(acl, 'name', name) in self._index[(acl, 'name')]) or
+                    (bool(tripcode) and tripcode in self._index[(acl, 'tripcode')]))
+
+    def entries(self, acl: str, field: str) -> List[str]:
+        """列出名单中某一字段的所有值"""
+        with self._lock:
+            self._maybe_reload()
+            return sorted(self._index[(acl, field)])
+
+    def is_empty(self, acl: str) -> bool:
+        """名单是否为空"""
+        with self._lock:
+            self._maybe_reload()
+            return not any(self._index[(acl, field)] for field in ACL_FIELDS)
+
+    def size(self) -> int:
+        """所有名单的条目总数"""
+        return sum(len(bucket) for bucket in self._index.values())
@@ -0,0 +1,141 @@
+# 命令路由模块
+import math
+import re
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+_TOKEN_RE = re.compile(r'\S+')
+
+
+class CommandSpec(NamedTuple):
+    """命令定义"""
+    name: str  # 完整命令名，多级命令用空格分隔，如 'ai model'
+    handler: Callable
+    admin_only: bool = False  # 是否仅限管理员
+    min_args: int = 0  # 最少参数个数
+    max_args: Optional[int] = None  # 最多参数个数，None表示不限制
+    usage: str = ""  # 参数不符合要求时的提示
+    cooldown: float = 0.0  # 同一用户两次调用的最小间隔（秒）
+    background: bool = False  # 是否会阻塞（调用第三方接口），需放到工作线程中执行
+    timeout: Optional[float] = None  # 异步执行时的超时（秒），None表示使用默认超时，0表示不限制
+
+
+class CommandMatch(NamedTuple):
+    """命令解析结果"""
+    spec: CommandSpec
+    args: List[str]  # 按空白切分的参数
+    text: str  # 命令名之后的原始参数文本
+    error: Optional[str] = None  # 参数错误或调用过于频繁时的提示，为空表示可以执行
+
+
+class CommandRouter:
+    """命令路由器
+
+    命令按空格分隔的词注册到前缀树中（如 'ai'、'ai model'），每条消息只解析一次：
+    逐词向下查找，取用户有权限使用的最长匹配，剩余部分作为参数。
+    管理员子命令对普通用户不可见，会回退到上一级命令（如普通用户的 '/ai on' 仍是AI对话）。
+    不以命令前缀开头的消息只需检查一个字符即可返回。
+    """
+
+    def __init__(self, prefix: str = '/'):
+        self.prefix = prefix
+        self._root: Dict[str, Dict[str, Any]] = {}  # 词 -> 节点 {'spec': CommandSpec, 'children': {...}}
+        self._last_used: Dict[Tuple[str, str], float] = {}  # (命令名, 用户) -> 上次调用时间
+
+    def register(self, name: str, handler: Callable, admin_only: bool = False, min_args: int = 0,
+                 max_args: Optional[int] = None, usage: str = "", cooldown: float = 0.0,
+                 background: bool = False, aliases: Tuple[str, ...] = (),
+                 timeout: Optional[float] = None) -> CommandSpec:
+        """注册命令，同名命令会被覆盖"""
+        spec = CommandSpec(name.lower(), handler, admin_only, min_args, max_args, usage, cooldown, background,
+                           timeout)
+        for command in (name,) + tuple(aliases):
+            tokens = command.lower().split()
+            if not tokens:
+                raise ValueError("命令名不能为空")
+            node = {'children': self._root}
+            for token in tokens:
+                node = node['children'].setdefault(token, {'spec': None, 'children': {}})
+            node['spec'] = spec
+        return spec
+
+    def unregister(self, name: str) -> bool:
+        """移除命令，返回是否存在"""
+        node = {'children': self._root}
+        for token in name.lower().split():
+            node = node['children'].get(token)
+            if node is None:
+                return False
+        found = node.get('spec') is not None
+        node['spec'] = None
+        return found
+
+    def commands(self) -> List[CommandSpec]:
+        """所有已注册的命令"""
+        specs, stack = [], [self._root]
+        while stack:
+            for node in stack.pop().values():
+                if node['spec'] is not None and node['spec'] not in specs:
+                    specs.append(node['spec'])
+                stack.append(node['children'])
+        return specs
+
+    def get(self, name: str) -> Optional[CommandSpec]:
+        """按完整命令名查找命令"""
+        node = {'children': self._root}
+        for token in name.lower().split():
+            node = node['children'].get(token)
+            if node is None:
+                return None
+        return node.get('spec')
+
+    def _lookup(self, text: str, is_admin: bool) -> Optional[Tuple[CommandSpec, str]]:
+        """查找有权限使用的最长匹配命令，返回 (命令, 参数文本)"""
+        body = text[len(self.prefix):]
+        children = self._root
+        best = None
+        for match in _TOKEN_RE.finditer(body):
+            node = children.get(match.group().lower())
+            if node is None:
+                break
+            spec = node['spec']
+            if spec is not None and (is_admin or not spec.admin_only):
+                best = (spec, match.end())
+            children = node['children']
+            if not children:
+                break
+        if best is None:
+            return None
+        spec, end = best
+        return spec, body[end:].strip()
+
+    def _check_rate(self, spec: CommandSpec, user_key: str) -> float:
+        """返回还需等待的秒数，0表示可以调用"""
+        if not spec.cooldown or not user_key:
+            return 0.0
+        now = time.time()
+        key = (spec.name, user_key)
+        remaining = self._last_used.get(key, 0.0) + spec.cooldown - now
+        if remaining > 0:
+            return remaining
+        self._last_used[key] = now
+        if len(self._last_used) > 10000:
+            # 清理已过冷却时间的记录
+            self._last_used = {k: t for k, t in self._last_used.items() if now - t < 3600}
+        return 0.0
+
+    def route(self, text: str, user_key: str = "", is_admin: bool = False) -> Optional[CommandMatch]:
+        """解析消息，非命令或没有可用命令时返回None"""
+        if not text or text[0] != self.prefix:
+            return None
+        found = self._lookup(text, is_admin)
+        if found is None:
+            return None
+        spec, rest = found
+        args = rest.split()
+        if len(args) < spec.min_args or (spec.max_args is not None and len(args) > spec.max_args):
+            return CommandMatch(spec, args, rest, spec.usage or f"命令参数错误: {self.prefix}{spec.name}")
+        remaining = self._check_rate(spec, user_key)
+        if remaining:
+            return CommandMatch(spec, args, rest, f"命令使用过于频繁，请{math.ceil(remaining)}秒后再试")
+        return CommandMatch(spec, args, rest)
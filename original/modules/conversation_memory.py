@@ -0,0 +1,131 @@
+# 对话记忆模块
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+from urllib.parse import quote_plus
+
+
+class _Conversation:
+    """单个用户的对话记录"""
+    __slots__ = ('turns', 'chars', 'summary', 'last_active')
+
+    def __init__(self):
+        self.turns: deque = deque()  # (问题, 回答)
+        self.chars = 0  # turns 中的总字符数
+        self.summary = ""  # 被移出的早期对话的摘要
+        self.last_active = time.time()
+
+
+class ConversationMemory:
+    """按用户保存的AI对话记忆
+
+    每个用户的对话总字符数不超过 budget；超出时最早的对话被移出并压缩为简短摘要
+    （每轮只保留问题开头），摘要本身也有长度上限。拼接提示词只遍历预算内的内容，
+    与用户的总对话时长无关。超过 ttl 秒未对话的用户记忆会被清除。
+    提示词通过GET参数发送，指定 max_prompt_bytes 时按URL编码后的长度限制提示词，
+    超出时从最早的一轮开始省略（中文每个字编码后占9字节）。
+    """
+
+    def __init__(self, budget: int = 1200, summary_budget: int = 200, ttl: float = 30 * 60,
+                 max_users: int = 500, turn_limit: int = 400, max_prompt_bytes: Optional[int] = None):
+        self.budget = budget  # 每个用户保存的对话最大字符数
+        self.summary_budget = summary_budget  # 摘要的最大字符数
+        self.ttl = ttl  # 用户无对话多久后清除记忆（秒）
+        self.max_users = max_users  # 最多保存记忆的用户数
+        self.turn_limit = turn_limit  # 单轮问题/回答保存的最大字符数
+        self.max_prompt_bytes = max_prompt_bytes  # 提示词URL编码后的最大字节数，None表示不限制
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _expire(self, now: float):
+        """清除长时间未对话的用户"""
+        while self._conversations:
+            user_key, conversation = next(iter(self._conversations.items()))
+            if len(self._conversations) > self.max_users or now - conversation.last_active > self.ttl:
+                del self._conversations[user_key]
+            else:
+                break
+
+    def _get(self, user_key: str, now: float) -> Optional[_Conversation]:
+        self._expire(now)
+        return self._conversations.get(user_key)
+
+    def _summarize(self, conversation: _Conversation, question: str):
+        """将移出的一轮对话压缩进摘要"""
+        item = question[:30] + ("…" if len(question) > 30 else "")
+        summary = f"{conversation.summary}；{item}" if conversation.summary else item
+        if len(summary) > self.summary_budget:
+            # 摘要过长时丢弃最早的部分
+            summary = "…" + summary[-(self.summary_budget - 1):]
+        conversation.summary = summary
+
+    def record(self, user_key: str, question: str, answer: str):
+        """记录一轮对话"""
+        now = time.time()
+        question, answer = question[:self.turn_limit], answer[:self.turn_limit]
+        with self._lock:
+            conversation = self._get(user_key, now)
+            if conversation is None:
+                conversation = self._conversations[user_key] = _Conversation()
+            self._conversations.move_to_end(user_key)
+            conversation.last_active = now
+            conversation.turns.append((question, answer))
+            conversation.chars += len(question) + len(answer)
+            while conversation.chars > self.budget and conversation.turns:
+                old_question, old_answer = conversation.turns.popleft()
+                conversation.chars -= len(old_question) + len(old_answer)
+                self._summarize(conversation, old_question)
+
+    @staticmethod
+    def _render(summary: str, turns: list, message: str) -> str:
+        lines = []
+        if summary:
+            lines.append(f"之前聊过的话题：{summary}")
+        if turns:
+            lines.append("最近的对话：")
+            for question, answer in turns:
+                lines.append(f"用户：{question}")
+                lines.append(f"AI：{answer}")
+        lines.append(f"请结合以上对话回答用户的新问题：{message}")
+        return "\n".join(lines)
+
+    def build_prompt(self, user_key: str, message: str) -> str:
+        """拼接带有对话记忆的提示词，没有记忆或记忆放不下时直接返回原消息"""
+        with self._lock:
+            conversation = self._get(user_key, time.time())
+            if conversation is None or not (conversation.turns or conversation.summary):
+                return message
+            summary, turns = conversation.summary, list(conversation.turns)
+        prompt = self._render(summary, turns, message)
+        if self.max_prompt_bytes is None:
+            return prompt
+        # 超出长度时依次省略最早的对话和摘要
+        while len(quote_plus(prompt)) > self.max_prompt_bytes:
+            if turns:
+                turns.pop(0)
+            elif summary:
+                summary = ""
+            else:
+                return message
+            if not (turns or summary):
+                return message
+            prompt = self._render(summary, turns, message)
+        return prompt
+
+    def forget(self, user_key: str) -> bool:
+        """清除某个用户的对话记忆"""
+        with self._lock:
+            return self._conversations.pop(user_key, None) is not None
+
+    def stats(self) -> Dict[str, int]:
+        """记忆的用户数和总字符数"""
+        with self._lock:
+            self._expire(time.time())
+            return {
+                'users': len(self._conversations),
+                'chars': sum(c.chars + len(c.summary) for c in self._conversations.values()),
+            }
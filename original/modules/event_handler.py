@@ -1,73 +1,151 @@
 # 事件处理模块
 import re
 import json
-from typing import Dict, List, Callable, Any
+import time
+import asyncio
+from typing import Dict, List, Callable, Any, Optional, Tuple
+
+from modules.command_router import CommandRouter
 
 class EventHandler:
-    """事件处理类"""
-    
-    def __init__(self):
-        self.event_handlers: Dict[str, List[Callable]] = {
+    """事件处理类
+
+    同一事件的处理器并发执行，慢处理器不会拖住其他处理器；默认不限制耗时，
+    需要限制的处理器在注册时指定 timeout。注册时指定 order 的处理器按 order 顺序串行执行
+    （整体仍与其他处理器并发）。调用统计按注册区分，同一函数注册多次时分别统计。
+    """
+
+    def __init__(self, default_timeout: Optional[float] = None):
+        self.event_handlers: Dict[str, List[Tuple[Callable, Optional[float], Optional[int], str]]] = {
             'join': [],
             'leave': [],
             'message': [],
             'dm': [],
             'music': [],
             'new_host': []
-        }
-        self.command_handlers: Dict[str, Callable] = {}
-        self.regex_handlers: List[tuple] = []  # (pattern, handler)
-        
-    def register_event_handler(self, event_type: str, handler: Callable):
-        """注册事件处理器"""
+        }  # 事件类型 -> [(handler, timeout, order, 统计键)]
+        self.commands = CommandRouter()
+        self.regex_handlers: List[tuple] = []  # (pattern, handler, timeout, 统计键)
+        self.default_timeout = default_timeout  # 处理器默认超时（秒），None表示不限制
+        self.handler_stats: Dict[str, Dict[str, float]] = {}  # 统计键 -> 调用统计
+        self._stats_keys = set()
+
+    def register_event_handler(self, event_type: str, handler: Callable,
+                               timeout: Optional[float] = None, order: Optional[int] = None):
+        """注册事件处理器，timeout 为空时使用默认超时，指定 order 时按顺序串行执行"""
         if event_type in self.event_handlers:
-            self.event_handlers[event_type].append(handler)
-            
-    def register_command_handler(self, command: str, handler: Callable):
-        """注册命令处理器"""
-        self.command_handlers[command.lower()] = handler
-        
-    def register_regex_handler(self, pattern: str, handler: Callable):
+            key = self._stats_key(f"event:{event_type}", handler)
+            self.event_handlers[event_type].append((handler, timeout, order, key))
+
+    def register_command_handler(self, command: str, handler: Callable, **options):
+        """注册命令处理器，options 为权限、参数、频率、超时等命令元数据（见 CommandRouter.register）"""
+        self.commands.register(command, handler, **options)
+
+    @property
+    def command_handlers(self) -> Dict[str, Callable]:
+        return {spec.name: spec.handler for spec in self.commands.commands()}
+
+    def register_regex_handler(self, pattern: str, handler: Callable, timeout: Optional[float] = None):
         """注册正则表达式处理器"""
-        self.regex_handlers.append((re.compile(pattern), handler))
-        
+        self.regex_handlers.append((re.compile(pattern), handler, timeout,
+                                    self._stats_key(f"regex:{pattern}", handler)))
+
+    @staticmethod
+    def _handler_name(handler: Callable) -> str:
+        return getattr(handler, '__qualname__', None) or repr(handler)
+
+    def _stats_key(self, prefix: str, handler: Callable) -> str:
+        """为一次注册生成统计键（注册位置+处理器名），重复时加序号"""
+        base = f"{prefix} {self._handler_name(handler)}"
+        key, n = base, 1
+        while key in self._stats_keys:
+            n += 1
+            key = f"{base}#{n}"
+        self._stats_keys.add(key)
+        return key
+
+    def _record(self, name: str, elapsed: float, outcome: str):
+        """记录处理器的耗时和结果"""
+        stats = self.handler_stats.setdefault(name, {
+            'calls': 0, 'failures': 0, 'timeouts': 0, 'total_time': 0.0, 'max_time': 0.0
+        })
+        stats['calls'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        if outcome == 'failure':
+            stats['failures'] += 1
+        elif outcome == 'timeout':
+            stats['timeouts'] += 1
+
+    def get_handler_stats(self) -> Dict[str, Dict[str, float]]:
+        """获取每个处理器的调用次数、失败/超时次数和平均/最大耗时"""
+        return {
+            name: dict(stats, avg_time=stats['total_time'] / stats['calls'] if stats['calls'] else 0.0)
+            for name, stats in self.handler_stats.items()
+        }
+
+    async def _run_handler(self, kind: str, handler: Callable, args: tuple, timeout: Optional[float], key: str):
+        """执行单个处理器，超时会被取消，异常只记录不向外传播；timeout为None时使用默认超时，0表示不限制"""
+        name = self._handler_name(handler)
+        timeout = self.default_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            if timeout:
+                await asyncio.wait_for(handler(*args), timeout)
+            else:
+                await handler(*args)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            print(f"{kind}超时({timeout}秒): {name}")
+        except Exception as e:
+            outcome = 'failure'
+            print(f"{kind}出错: {e}")
+        finally:
+            self._record(key, time.perf_counter() - start, outcome)
+
+    async def _run_ordered(self, kind: str, handlers: List[tuple], args: tuple):
+        """按 order 顺序串行执行处理器"""
+        for handler, timeout, _, key in sorted(handlers, key=lambda item: item[2]):
+            await self._run_handler(kind, handler, args, timeout, key)
+
     async def handle_event(self, event_type: str, data: Dict[str, Any]):
         """处理事件"""
-        # 处理事件处理器
-        if event_type in self.event_handlers:
-            for handler in self.event_handlers[event_type]:
-                try:
-                    await handler(data)
-                except Exception as e:
-                    print(f"事件处理器出错: {e}")
-                    
-    async def handle_message(self, message: str, user: Dict[str, Any]):
+        handlers = self.event_handlers.get(event_type)
+        if not handlers:
+            return
+        args = (data,)
+        ordered = [item for item in handlers if item[2] is not None]
+        coros = [self._run_handler("事件处理器", handler, args, timeout, key)
+                 for handler, timeout, order, key in handlers if order is None]
+        if ordered:
+            coros.append(self._run_ordered("事件处理器", ordered, args))
+        # 处理器自身的异常已被捕获；外部取消时 gather 会取消所有未完成的处理器
+        await asyncio.gather(*coros)
+
+    async def handle_message(self, message: str, user: Dict[str, Any], is_admin: bool = False):
         """处理消息"""
         # 检查是否为命令
-        if message.startswith('/'):
-            await self.handle_command(message, user)
+        if message.startswith(self.commands.prefix):
+            await self.handle_command(message, user, is_admin)
         else:
-            # 检查正则表达式处理器
-            for pattern, handler in self.regex_handlers:
+            # 所有匹配的正则表达式处理器并发执行
+            coros = []
+            for pattern, handler, timeout, key in self.regex_handlers:
                 match = pattern.match(message)
                 if match:
-                    try:
-                        await handler(message, user, match)
-                    except Exception as e:
-                        print(f"正则表达式处理器出错: {e}")
-                        
-    async def handle_command(self, command: str, user: Dict[str, Any]):
-        """处理命令"""
-        command_parts = command[1:].split()
-        if not command_parts:
-            return
-            
-        cmd = command_parts[0].lower()
-        args = command_parts[1:] if len(command_parts) > 1 else []
-        
-        # 查找命令处理器
-        if cmd in self.command_handlers:
-            try:
-                await self.command_handlers[cmd](cmd, args, user)
-            except Exception as e:
-                print(f"命令处理器出错: {e}")
\ No newline at end of file
+                    coros.append(self._run_handler("正则表达式处理器", handler,
+                                                   (message, user, match), timeout, key))
+            if coros:
+                await asyncio.gather(*coros)
+
+    async def handle_command(self, command: str, user: Dict[str, Any], is_admin: bool = False) -> Optional[str]:
+        """处理命令，参数错误或调用过于频繁时返回提示信息"""
+        match = self.commands.route(command, user.get('id', ''), is_admin)
+        if match is None:
+            return None
+        if match.error:
+            return match.error
+        await self._run_handler("命令处理器", match.spec.handler, (match.spec.name, match.args, user),
+                                match.spec.timeout, f"command:{match.spec.name}")
+        return None
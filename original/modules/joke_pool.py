@@ -0,0 +1,136 @@
+# 笑话预取模块
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+from utils.helpers import normalize_prompt
+
+
+def joke_fingerprint(text: str) -> str:
+    """笑话指纹，忽略大小写、全角差异、空白和标点"""
+    return re.sub(r'[\W_]+', '', normalize_prompt(text))
+
+
+class JokePool:
+    """预先生成的笑话池
+
+    后台线程在AI接口空闲时逐个补充笑话，直到池满；取用时立即返回。
+    新笑话会与池中和最近发出的笑话去重，池内容和最近发出记录持久化到磁盘，重启后继续使用。
+    """
+
+    def __init__(self, fetch: Callable[[], Optional[str]], path: Optional[str] = None,
+                 max_size: int = 20, recent_size: int = 100, refill_interval: float = 30.0,
+                 is_idle: Optional[Callable[[], bool]] = None):
+        self.fetch = fetch  # 获取一个新笑话，失败时返回None
+        self.path = path  # 持久化文件路径，为None时仅保存在内存中
+        self.max_size = max_size  # 池中最多保存的笑话数
+        self.refill_interval = refill_interval  # 两次补充之间的间隔（秒）
+        self.is_idle = is_idle  # 判断AI接口是否空闲，空闲时才补充
+        self.jokes: deque = deque()
+        self.recent: deque = deque(maxlen=recent_size)  # 最近发出的笑话指纹
+        self._fingerprints = set()  # 池中笑话的指纹
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'served': 0, 'empty': 0, 'fetched': 0, 'duplicates': 0}
+        if self.path:
+            self._load()
+
+    def __len__(self):
+        return len(self.jokes)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"加载笑话池失败: {e}")
+            return
+        self.recent.extend(data.get('recent', []))
+        for joke in data.get('jokes', [])[:self.max_size]:
+            fingerprint = joke_fingerprint(joke)
+            if fingerprint and fingerprint not in self._fingerprints:
+                self.jokes.append(joke)
+                self._fingerprints.add(fingerprint)
+
+    def _save(self):
+        """原子写入持久化文件"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'jokes': list(self.jokes), 'recent': list(self.recent)}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存笑话池失败: {e}")
+
+    def take(self) -> Optional[str]:
+        """取出一个笑话，池为空时返回None"""
+        with self._lock:
+            if not self.jokes:
+                self.stats['empty'] += 1
+                return None
+            joke = self.jokes.popleft()
+            fingerprint = joke_fingerprint(joke)
+            self._fingerprints.discard(fingerprint)
+            self.mark_served(fingerprint)
+            self._save()
+            return joke
+
+    def mark_served(self, fingerprint: str):
+        """记录已发出的笑话，之后补充时跳过"""
+        if fingerprint and fingerprint not in self.recent:
+            self.recent.append(fingerprint)
+        self.stats['served'] += 1
+
+    def add(self, joke: str) -> bool:
+        """加入一个笑话，与池中或最近发出的重复时返回False"""
+        joke = (joke or '').strip()
+        fingerprint = joke_fingerprint(joke)
+        with self._lock:
+            if not fingerprint or fingerprint in self._fingerprints or fingerprint in self.recent:
+                self.stats['duplicates'] += 1
+                return False
+            if len(self.jokes) >= self.max_size:
+                return False
+            self.jokes.append(joke)
+            self._fingerprints.add(fingerprint)
+            self._save()
+            return True
+
+    def fill_once(self) -> bool:
+        """获取并加入一个新笑话"""
+        joke = self.fetch()
+        if not joke:
+            return False
+        self.stats['fetched'] += 1
+        return self.add(joke)
+
+    def _refill_loop(self):
+        while not self._stop.wait(self.refill_interval):
+            if len(self.jokes) >= self.max_size:
+                continue
+            if self.is_idle and not self.is_idle():
+                continue
+            try:
+                self.fill_once()
+            except Exception as e:
+                print(f"补充笑话池出错: {e}")
+
+    def start(self):
+        """启动后台补充线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refill_loop, name="joke-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台补充线程"""
+        self._stop.set()
@@ -0,0 +1,246 @@
+# 音乐链接检测模块
+import ipaddress
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from utils.worker_pool import WorkerPool
+
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+}
+
+# MPEG音频帧头中的比特率（kbps）和采样率
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1 Layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2/2.5 Layer III
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+_MAX_REDIRECTS = 5
+
+
+class UnsafeURLError(requests.exceptions.RequestException):
+    """链接（或重定向的目标）指向内网等不允许访问的地址"""
+
+
+class LinkInfo(NamedTuple):
+    """链接检测结果"""
+    alive: Optional[bool]  # 是否可以播放，网络错误等无法确定时为None
+    status: int = 0  # HTTP状态码
+    content_type: str = ""
+    size: Optional[int] = None  # 文件大小（字节）
+    duration: Optional[float] = None  # 时长（秒），仅能从MP3帧头推算
+    error: str = ""
+    checked_at: float = 0.0
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """格式化时长为 分:秒"""
+    if not seconds:
+        return ""
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def mp3_duration(data: bytes, total_size: Optional[int]) -> Optional[float]:
+    """根据文件开头的MP3帧头推算时长：有Xing/Info头时按总帧数计算，否则按比特率和文件大小估算"""
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        # ID3v2标签长度为4个7位字节
+        tag_size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        offset = 10 + tag_size
+    # 查找帧同步
+    while offset + 4 <= len(data):
+        if data[offset] == 0xFF and data[offset + 1] & 0xE0 == 0xE0:
+            break
+        offset += 1
+    else:
+        return None
+    header = struct.unpack('>I', data[offset:offset + 4])[0]
+    version = (header >> 19) & 0x3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    layer = (header >> 17) & 0x3  # 1: Layer III
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    samples_per_frame = 1152 if version == 3 else 576
+
+    # VBR文件的Xing/Info头中记录了总帧数
+    for tag in (b'Xing', b'Info'):
+        position = data.find(tag, offset + 4, offset + 64)
+        if position != -1 and position + 12 <= len(data):
+            flags = struct.unpack('>I', data[position + 4:position + 8])[0]
+            if flags & 0x1:
+                frames = struct.unpack('>I', data[position + 8:position + 12])[0]
+                return frames * samples_per_frame / sample_rate
+    if total_size:
+        return (total_size - offset) * 8 / bitrate
+    return None
+
+
+def check_url(url: str) -> str:
+    """检查链接是否可以访问，返回拒绝的原因；只允许解析到公网地址的 http/https 链接"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return "只支持http/https链接"
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except (ValueError, OSError):
+        return "无法解析链接的域名"
+    for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split('%', 1)[0])
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved \
+                or ip.is_multicast or ip.is_unspecified:
+            return "不允许访问内网地址"
+    return ""
+
+
+def _open(session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
+    """发送请求并手动跟随重定向，每一跳都先检查目标地址"""
+    for _ in range(_MAX_REDIRECTS + 1):
+        error = check_url(url)
+        if error:
+            raise UnsafeURLError(error)
+        response = session.request(method, url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        url = urljoin(url, response.headers['Location'])
+        response.close()
+    raise requests.exceptions.TooManyRedirects("重定向次数过多")
+
+
+def _total_size(response) -> Optional[int]:
+    """从 Content-Range（bytes 0-1023/12345）或 Content-Length 读取文件总大小"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() and response.status_code == 200 else None
+
+
+def _is_playable(content_type: str) -> bool:
+    """音频/视频或未声明类型的二进制文件视为可播放，网页视为失效"""
+    content_type = content_type.split(';')[0].strip().lower()
+    return not content_type.startswith('text/') and 'json' not in content_type
+
+
+def probe_link(session: requests.Session, url: str, timeout: float = 10, range_bytes: int = 16 * 1024) -> LinkInfo:
+    """检测链接：先发HEAD请求，不支持HEAD或需要读取时长时再请求文件开头的一段；内网地址直接视为失效"""
+    now = time.time()
+    error = check_url(url)
+    if error:
+        return LinkInfo(False, error=error, checked_at=now)
+    head = None
+    try:
+        head = _open(session, 'HEAD', url, headers=_HEADERS, timeout=timeout)
+    except requests.exceptions.RequestException:
+        pass
+    if head is not None and head.status_code in (404, 410):
+        return LinkInfo(False, head.status_code, error="链接不存在", checked_at=now)
+    if head is not None and head.status_code < 400:
+        content_type = head.headers.get('Content-Type', '')
+        if not _is_playable(content_type):
+            return LinkInfo(False, head.status_code, content_type, error="不是音频链接", checked_at=now)
+        if 'mpeg' not in content_type.lower() and 'mp3' not in content_type.lower():
+            return LinkInfo(True, head.status_code, content_type, _total_size(head), checked_at=now)
+
+    # 不支持HEAD（405等）或MP3需要读取帧头推算时长
+    headers = dict(_HEADERS, Range=f"bytes=0-{range_bytes - 1}")
+    try:
+        with _open(session, 'GET', url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code >= 400:
+                alive = False if response.status_code in (403, 404, 410) else None
+                return LinkInfo(alive, response.status_code, error=f"状态码{response.status_code}", checked_at=now)
+            content_type = response.headers.get('Content-Type', '')
+            if not _is_playable(content_type):
+                return LinkInfo(False, response.status_code, content_type, error="不是音频链接", checked_at=now)
+            data = b''
+            for chunk in response.iter_content(chunk_size=4096):
+                data += chunk
+                if len(data) >= range_bytes:
+                    break
+            size = _total_size(response)
+    except UnsafeURLError as e:
+        return LinkInfo(False, error=str(e), checked_at=now)
+    except requests.exceptions.RequestException as e:
+        return LinkInfo(None, error=str(e), checked_at=now)
+    return LinkInfo(True, response.status_code, content_type, size, mp3_duration(data, size), checked_at=now)
+
+
+class LinkValidator:
+    """后台链接检测器
+
+    新加入播放列表的链接交给有界线程池并发检测，结果通过 on_result 回调通知；
+    同一个键正在检测时不会重复提交，队列已满时直接跳过（播放前会再次检查）。
+    链接由用户提交，不要传入带有房间Cookie的会话；指向内网地址的链接（包括重定向）不会被请求。
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None,
+                 on_result: Optional[Callable[[Any, str, LinkInfo], None]] = None,
+                 max_workers: int = 4, max_queue: int = 100, timeout: float = 10):
+        self.session = session or requests.Session()
+        self.on_result = on_result  # 检测完成后的回调 (键, 链接, 结果)
+        self.timeout = timeout
+        self.results: Dict[Any, LinkInfo] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = WorkerPool(max_workers=max_workers, max_queue=max_queue, per_user_limit=1,
+                                name="link-validator")
+        self.stats = {'checked': 0, 'dead': 0, 'unknown': 0, 'skipped': 0}
+
+    def submit(self, key: Any, url: str) -> bool:
+        """提交检测，已在检测或队列已满时返回False"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        future, _ = self._pool.submit('', self._check, key, url)
+        if future is None:
+            with self._lock:
+                self._pending.discard(key)
+                self.stats['skipped'] += 1
+            return False
+        return True
+
+    def _check(self, key: Any, url: str):
+        try:
+            info = probe_link(self.session, url, self.timeout)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+        with self._lock:
+            self.results[key] = info
+            self.stats['checked'] += 1
+            if info.alive is False:
+                self.stats['dead'] += 1
+            elif info.alive is None:
+                self.stats['unknown'] += 1
+        if self.on_result:
+            self.on_result(key, url, info)
+
+    def result(self, key: Any) -> Optional[LinkInfo]:
+        return self.results.get(key)
+
+    def checking(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._pending
+
+    def forget(self, key: Any):
+        """删除检测结果（如歌曲已移出列表或链接已更换）"""
+        with self._lock:
+            self.results.pop(key, None)
+
+    def shutdown(self):
+        self._pool.shutdown()
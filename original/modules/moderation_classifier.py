@@ -0,0 +1,189 @@
+# 本地内容审核分类模块
+import json
+import os
+import threading
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 未安装numpy时分类器不可用，所有消息视为不确定
+    np = None
+
+from utils.helpers import normalize_prompt
+
+# 分类结果
+VERDICT_VIOLATION = "violation"
+VERDICT_CLEAN = "clean"
+VERDICT_UNCERTAIN = "uncertain"
+
+
+def ngram_features(text: str, n_features: int = 1 << 14, ngram_range: Tuple[int, int] = (1, 3)) -> List[int]:
+    """字符n-gram哈希特征，返回特征下标列表（同一n-gram在不同进程中哈希一致）"""
+    text = normalize_prompt(text)
+    indices = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        for i in range(len(text) - n + 1):
+            indices.append(zlib.crc32(text[i:i + n].encode('utf-8')) % n_features)
+    return indices
+
+
+class ViolationJournal:
+    """违规日志
+
+    以JSON Lines追加记录带标签的消息（1为违规，0为正常）及其来源（关键词/AI/管理员），
+    作为本地分类器的训练数据。文件行数达到 max_samples 的两倍时重写为最近的 max_samples 条。
+    """
+
+    def __init__(self, path: str, max_samples: int = 5000):
+        self.path = path
+        self.max_samples = max_samples  # 训练时最多读取、轮转时保留的最近样本数
+        self._lock = threading.Lock()
+        self.appended = 0  # 本次运行追加的记录数
+        self._lines = self._count_lines()  # 文件当前的行数
+
+    def _count_lines(self) -> int:
+        try:
+            with open(self.path, 'rb') as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def append(self, text: str, label: int, source: str):
+        """记录一条样本"""
+        record = {'text': text, 'label': int(label), 'source': source, 'time': int(time.time())}
+        with self._lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.appended += 1
+                self._lines += 1
+                if self._lines >= self.max_samples * 2:
+                    self._rotate()
+            except Exception as e:
+                print(f"写入违规日志失败: {e}")
+
+    def _rotate(self):
+        """只保留最近的 max_samples 行（先写临时文件再原子替换）"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()[-self.max_samples:]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+        self._lines = len(lines)
+
+    def samples(self) -> List[Tuple[str, int]]:
+        """读取最近的样本"""
+        samples = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        samples.append((record['text'], int(record['label'])))
+                    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取违规日志失败: {e}")
+        return samples[-self.max_samples:]
+
+
+class ModerationClassifier:
+    """基于字符n-gram哈希特征的朴素贝叶斯分类器
+
+    使用NumPy计算每个特征的对数似然比，打分只需对消息的特征下标求和，单条消息为微秒级。
+    概率高于 high 判为违规、低于 low 判为正常，中间的不确定区间交给远程AI审核。
+    训练样本不足或未安装numpy时所有消息都视为不确定。
+    """
+
+    def __init__(self, n_features: int = 1 << 14, low: float = 0.2, high: float = 0.9,
+                 min_samples: int = 20, path: Optional[str] = None):
+        self.n_features = n_features
+        self.low = low  # 低于此概率判为正常
+        self.high = high  # 高于此概率判为违规
+        self.min_samples = min_samples  # 每个类别至少需要的样本数
+        self.path = path  # 模型保存路径（.npz）
+        self.weights = None  # 每个特征的对数似然比
+        self.bias = 0.0  # 先验对数几率
+        self.trained_samples = 0
+        if path:
+            self.load()
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    @property
+    def ready(self) -> bool:
+        return self.weights is not None
+
+    def train(self, samples: List[Tuple[str, int]], alpha: float = 1.0) -> bool:
+        """用 (文本, 标签) 样本训练，样本不足时返回False"""
+        if np is None:
+            return False
+        positives = sum(1 for _, label in samples if label)
+        negatives = len(samples) - positives
+        if positives < self.min_samples or negatives < self.min_samples:
+            return False
+        counts = np.zeros((2, self.n_features), dtype=np.float64)
+        for text, label in samples:
+            indices = ngram_features(text, self.n_features)
+            if indices:
+                np.add.at(counts[1 if label else 0], indices, 1.0)
+        # 拉普拉斯平滑后的对数似然比
+        log_probs = np.log(counts + alpha) - np.log(counts.sum(axis=1, keepdims=True) + alpha * self.n_features)
+        self.weights = log_probs[1] - log_probs[0]
+        self.bias = float(np.log(positives / negatives))
+        self.trained_samples = len(samples)
+        self.save()
+        return True
+
+    def score(self, text: str) -> Optional[float]:
+        """违规概率，分类器不可用时返回None"""
+        if self.weights is None:
+            return None
+        indices = ngram_features(text, self.n_features)
+        logit = self.bias + float(self.weights[indices].sum()) if indices else self.bias
+        # 防止溢出
+        logit = max(-30.0, min(30.0, logit))
+        return float(1.0 / (1.0 + np.exp(-logit)))
+
+    def classify(self, text: str) -> Tuple[str, Optional[float]]:
+        """返回 (分类结果, 违规概率)"""
+        probability = self.score(text)
+        if probability is None:
+            return VERDICT_UNCERTAIN, None
+        if probability >= self.high:
+            return VERDICT_VIOLATION, probability
+        if probability <= self.low:
+            return VERDICT_CLEAN, probability
+        return VERDICT_UNCERTAIN, probability
+
+    def save(self):
+        """保存模型"""
+        if not self.path or self.weights is None:
+            return
+        tmp_path = f"{self.path}.tmp.npz"
+        try:
+            np.savez(tmp_path, weights=self.weights, bias=self.bias, samples=self.trained_samples)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存分类器失败: {e}")
+
+    def load(self):
+        """加载已保存的模型"""
+        if np is None or not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path)
+            if data['weights'].shape != (self.n_features,):
+                return
+            self.weights = data['weights']
+            self.bias = float(data['bias'])
+            self.trained_samples = int(data['samples'])
+        except Exception as e:
+            print(f"加载分类器失败: {e}")
@@ -1,112 +1,93 @@
 # 音乐播放模块
 import asyncio
-import random
-from typing import List, Dict, Any
+from typing import Optional
+
+from modules.playlist import PLAY_MODES, Playlist, Song
 
 class MusicPlayer:
     """音乐播放器类"""
     
-    def __init__(self):
-        self.playlist: List[Dict[str, str]] = []  # 播放列表
-        self.current_song = None
-        self.play_mode = "album"  # album, single, repeat, loop
+    def __init__(self, max_size: int = 5000, max_per_user: int = 0):
+        # 播放过的歌曲移出列表（repeat/loop模式除外）
+        self.playlist = Playlist(max_size=max_size, max_per_user=max_per_user, consume=True)
         self.is_playing = False
         
-    def add_to_playlist(self, title: str, url: str, singer: str = ""):
+    @property
+    def play_mode(self) -> str:
+        return self.playlist.mode
+        
+    @property
+    def current_song(self) -> Optional[Song]:
+        return self.playlist.current
+        
+    def add_to_playlist(self, title: str, url: str, singer: str = "", user: str = ""):
         """添加到播放列表"""
-        song = {
-            "title": title,
-            "url": url,
-            "singer": singer
-        }
-        self.playlist.append(song)
-        return f"已添加到播放列表: {self.format_song_title(song)}"
+        song, reason = self.playlist.add(url, title, singer, user)
+        if song is None:
+            return reason
+        return f"已添加到播放列表: {self.format_song_title(song)}（编号{song.id}）"
         
-    def remove_from_playlist(self, index: int):
-        """从播放列表移除"""
-        if 0 <= index < len(self.playlist):
-            song = self.playlist.pop(index)
+    def remove_from_playlist(self, song_id: int):
+        """按编号从播放列表移除"""
+        song = self.playlist.remove(song_id)
+        if song:
             return f"已从播放列表移除: {self.format_song_title(song)}"
         else:
-            return "索引超出范围"
+            return "播放列表中没有这个编号"
+            
+    def move_song(self, song_id: int, after_id: Optional[int] = None):
+        """移动歌曲到另一首之后，不指定时移动到当前歌曲之后（下一首播放）"""
+        if after_id is None:
+            after_id = self.playlist.current_id
+        if self.playlist.move(song_id, after_id):
+            return f"已移动歌曲: {self.format_song_title(self.playlist.get(song_id))}"
+        else:
+            return "播放列表中没有这个编号"
             
-    def list_playlist(self):
-        """列出播放列表"""
+    def list_playlist(self, limit: int = 20):
+        """列出播放列表（最多 limit 首）"""
         if not self.playlist:
             return "播放列表为空"
             
         result = "播放列表:\n"
-        for i, song in enumerate(self.playlist):
-            result += f"{i+1}. {self.format_song_title(song)}\n"
+        for song in self.playlist.songs(limit=limit):
+            marker = "▶ " if song.id == self.playlist.current_id else ""
+            result += f"{marker}{song.id}. {self.format_song_title(song)}\n"
+        if len(self.playlist) > limit:
+            result += f"……共{len(self.playlist)}首\n"
         return result.strip()
         
-    def format_song_title(self, song: Dict[str, str]):
+    def format_song_title(self, song: Song):
         """格式化歌曲标题"""
-        title = song["title"]
-        if song["singer"]:
-            title = f"{title} - {song['singer']}"
-        return title
+        return song.display()
         
     def set_play_mode(self, mode: str):
         """设置播放模式"""
-        valid_modes = ["album", "single", "repeat", "loop"]
-        if mode in valid_modes:
-            self.play_mode = mode
+        if self.playlist.set_mode(mode):
             return f"播放模式已设置为: {mode}"
         else:
-            return f"无效的播放模式。可用模式: {', '.join(valid_modes)}"
+            return f"无效的播放模式。可用模式: {', '.join(PLAY_MODES)}"
             
     def get_next_song(self):
         """获取下一首歌曲"""
-        if not self.playlist:
-            return None
-            
-        if self.play_mode == "single":
-            # 单曲播放，不自动播放下一首
-            return None
-        elif self.play_mode == "repeat":
-            # 单曲循环，返回当前歌曲
-            return self.current_song
-        elif self.play_mode == "loop":
-            # 列表循环，返回第一首
-            return self.playlist[0]
-        else:
-            # 专辑模式，按顺序播放
-            if self.current_song and self.current_song in self.playlist:
-                current_index = self.playlist.index(self.current_song)
-                if current_index + 1 < len(self.playlist):
-                    return self.playlist[current_index + 1]
-                else:
-                    return None  # 播放完毕
-            else:
-                return self.playlist[0]  # 从第一首开始
+        return self.playlist.peek_next()
                 
     def play_next(self):
         """播放下一首"""
-        next_song = self.get_next_song()
-        if next_song:
-            self.current_song = next_song
-            self.is_playing = True
-            # 从播放列表移除（如果不是循环模式）
-            if self.play_mode != "repeat" and self.play_mode != "loop":
-                if next_song in self.playlist:
-                    self.playlist.remove(next_song)
-            return next_song
-        else:
-            self.is_playing = False
-            return None
+        next_song = self.playlist.advance()
+        self.is_playing = next_song is not None
+        return next_song
             
     def shuffle_playlist(self):
-        """随机播放列表"""
+        """随机播放列表（切换到随机模式，不打乱列表顺序）"""
         if self.playlist:
-            random.shuffle(self.playlist)
-            return "播放列表已随机排序"
+            self.playlist.set_mode("shuffle")
+            return "已切换为随机播放"
         else:
             return "播放列表为空"
             
     def clear_playlist(self):
         """清空播放列表"""
         self.playlist.clear()
-        self.current_song = None
         self.is_playing = False
-        return "播放列表已清空"
\ No newline at end of file
+        return "播放列表已清空"
@@ -0,0 +1,166 @@
+# 音乐搜索模块
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from utils.helpers import normalize_prompt
+from utils.ttl_cache import TTLCache
+
+QQ_MUSIC_API = "https://api.suyanw.cn/api/QQ_Music.php"
+
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive'
+}
+
+
+class SongResult(NamedTuple):
+    """一条搜索结果"""
+    index: int  # 在搜索结果中的序号（从1开始）
+    title: str
+    singer: str
+    url: str  # 播放链接，列表结果可能为空
+    expires: float  # 播放链接的过期时间
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires
+
+
+def _parse_song(item: Dict[str, Any], index: int, expires: float) -> SongResult:
+    return SongResult(
+        index=int(item.get('n') or index),
+        title=item.get('title') or item.get('song') or item.get('name') or '未知歌曲',
+        singer=item.get('singer') or item.get('author') or '未知歌手',
+        url=item.get('url') or item.get('music') or '',
+        expires=expires,
+    )
+
+
+class MusicSearchClient:
+    """QQ音乐搜索客户端
+
+    一次不带序号的搜索返回多条结果，按规范化后的关键词缓存，之后选择第N首
+    （/qqmusic <歌曲名> N）直接从缓存中取；列表中没有播放链接时再按序号请求一次并缓存。
+    播放链接有时效，缓存时间不超过 url_ttl；接口明确返回空结果的关键词缓存 negative_ttl 秒，
+    限流、接口错误等失败不缓存，错误信息原样返回给调用方。
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, api_url: str = QQ_MUSIC_API,
+                 max_size: int = 256, url_ttl: float = 30 * 60, negative_ttl: float = 5 * 60,
+                 timeout: float = 30):
+        self.session = session or requests.Session()
+        self.api_url = api_url
+        self.url_ttl = url_ttl  # 播放链接的有效时间（秒）
+        self.negative_ttl = negative_ttl  # 无结果的缓存时间（秒）
+        self.timeout = timeout
+        self.cache = TTLCache(max_size=max_size, ttl=url_ttl)
+        self.stats = {'requests': 0, 'negative_hits': 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """规范化搜索关键词，忽略大小写、全角差异和多余空白"""
+        return normalize_prompt(query)
+
+    def _request(self, query: str, n: Optional[int] = None) -> Tuple[Optional[Any], str]:
+        """请求搜索接口，返回 (data字段, 错误信息)"""
+        params = {"msg": query}
+        if n is not None:
+            params["n"] = n
+        self.stats['requests'] += 1
+        try:
+            response = self.session.get(self.api_url, params=params, headers=_HEADERS, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            print(f"QQ音乐接口网络请求错误: {e}")
+            return None, "网络请求错误，请稍后再试"
+        if response.status_code != 200:
+            print(f"QQ音乐接口调用失败，状态码: {response.status_code}")
+            return None, "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
+        try:
+            data = response.json()
+        except ValueError:
+            print(f"QQ音乐接口响应不是有效的JSON格式: {response.text[:200]}")
+            return None, "抱歉，暂时无法搜索QQ音乐，请稍后再试。"
+        if not isinstance(data, dict) or data.get('code') != 200:
+            # 限流、上游错误等都不能当作无结果缓存
+            error_msg = data.get('text', '未知错误') if isinstance(data, dict) else '未知错误'
+            print(f"QQ音乐搜索失败: {query}（{error_msg}）")
+            return None, f"QQ音乐搜索失败: {error_msg}"
+        return data.get('data') or [], ""
+
+    def _store(self, key: str, results: List[SongResult]):
+        """缓存结果，无结果时只缓存 negative_ttl 秒"""
+        ttl = self.negative_ttl if not results else self.url_ttl
+        self.cache.set(key, [list(result) for result in results], ttl=ttl)
+
+    def _load(self, key: str) -> Optional[List[SongResult]]:
+        items = self.cache.get(key)
+        if items is None:
+            return None
+        return [SongResult(*item) for item in items]
+
+    def search(self, query: str, limit: int = 5) -> Tuple[List[SongResult], str]:
+        """搜索歌曲，返回 (结果列表, 错误信息)；无结果时列表为空"""
+        key = f"list:{self.normalize(query)}"
+        results = self._load(key)
+        if results is not None:
+            if not results:
+                self.stats['negative_hits'] += 1
+                return [], ""
+            return results[:limit], ""
+        data, error = self._request(query)
+        if data is None:
+            return [], error
+        expires = time.time() + self.url_ttl
+        items = data if isinstance(data, list) else [data]
+        results = [_parse_song(item, i, expires) for i, item in enumerate(items, 1) if isinstance(item, dict)]
+        self._store(key, results)
+        return results[:limit], ""
+
+    def get(self, query: str, n: int = 1) -> Tuple[Optional[SongResult], str]:
+        """取第n首带播放链接的结果，返回 (结果, 错误信息)；无结果时结果为None"""
+        results, error = self.search(query, limit=max(n, 5))
+        if error:
+            return None, error
+        if not results:
+            return None, ""
+        if len(results) >= n:
+            song = results[n - 1]
+            if song.url and not song.expired:
+                return song, ""
+
+        # 列表中没有这首或没有播放链接，按序号请求并缓存
+        key = f"song:{self.normalize(query)}#{n}"
+        cached = self._load(key)
+        if cached is not None:
+            if not cached:
+                self.stats['negative_hits'] += 1
+            return (cached[0] if cached else None), ""
+        detail, error = self.fetch(query, n)
+        if error:
+            return None, error
+        self._store(key, [detail] if detail else [])
+        return detail, ""
+
+    def fetch(self, query: str, n: int) -> Tuple[Optional[SongResult], str]:
+        """不经过缓存直接请求第n首（如刷新过期的播放链接），不影响其他调用方的缓存"""
+        data, error = self._request(query, n)
+        if data is None:
+            return None, error
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        if not data:
+            return None, ""
+        return _parse_song(data, n, time.time() + self.url_ttl)._replace(index=n), ""
+
+    def invalidate(self, query: str, n: Optional[int] = None):
+        """删除缓存（如播放链接已失效）"""
+        normalized = self.normalize(query)
+        if n is None:
+            self.cache.delete(f"list:{normalized}")
+        else:
+            self.cache.delete(f"song:{normalized}#{n}")
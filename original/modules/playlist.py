@@ -0,0 +1,409 @@
+# 播放列表模块
+import itertools
+import random
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# 播放模式
+PLAY_MODES = ("album", "single", "repeat", "loop", "shuffle")
+# consume为True时这些模式下播放过的歌曲会移出列表
+CONSUMED_MODES = ("album", "single", "shuffle")
+
+
+class Song(NamedTuple):
+    """播放列表中的歌曲"""
+    id: int  # 稳定编号，删除或移动其他歌曲时不会改变
+    url: str
+    title: str = ""
+    singer: str = ""
+    user: str = ""  # 点歌的用户
+    query: str = ""  # 来自QQ音乐搜索时的关键词，用于刷新过期链接
+    index: int = 0  # 在搜索结果中的序号，不是来自搜索时为0
+
+    def display(self) -> str:
+        """显示用的标题"""
+        title = self.title or self.url
+        return f"{title} - {self.singer}" if self.singer else title
+
+
+class _Node:
+    """双向链表节点"""
+    __slots__ = ('song', 'prev', 'next')
+
+    def __init__(self, song: Song):
+        self.song = song
+        self.prev: Optional[int] = None
+        self.next: Optional[int] = None
+
+
+class Playlist:
+    """播放列表
+
+    歌曲保存在以编号为键的双向链表中，入队、出队、按编号删除和移动都是O(1)；
+    同一链接只保存一份，每个用户在列表中的歌曲数有上限。
+    播放模式通过游标实现，不重排列表：album按顺序、loop到末尾后回到开头、repeat重复当前歌曲、
+    single播放完当前歌曲后停止、shuffle在本轮未播放的歌曲中随机选择。
+    consume为True时album/single/shuffle模式播放过的歌曲会移出列表（点歌队列），repeat和loop保留。
+    """
+
+    def __init__(self, max_size: int = 5000, max_per_user: int = 0, consume: bool = False):
+        self.max_size = max_size  # 列表最多保存的歌曲数
+        self.max_per_user = max_per_user  # 每个用户最多点的歌曲数，0表示不限制
+        self.consume = consume
+        self.mode = "album"
+        self._ids = itertools.count(1)
+        self._nodes: Dict[int, _Node] = {}
+        self._head: Optional[int] = None
+        self._tail: Optional[int] = None
+        self._by_url: Dict[str, int] = {}
+        self._per_user: Dict[str, int] = {}
+        self.current_id: Optional[int] = None  # 当前播放的歌曲
+        self._resume_id: Optional[int] = None  # 当前歌曲被删除后，下一首从这里继续
+        self._ended = False  # 被删除的当前歌曲是最后一首，之后新加入的歌曲才是下一首
+        # 随机模式本轮尚未播放的歌曲（数组+下标索引，随机选取和删除都是O(1)）
+        self._round: List[int] = []
+        self._round_pos: Dict[int, int] = {}
+        self._shuffle_next: Optional[int] = None  # 已预先选出的随机下一首
+        self._dead = set()  # 链接已失效、播放时跳过的歌曲
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, song_id: int):
+        return song_id in self._nodes
+
+    def __iter__(self) -> Iterator[Song]:
+        return iter(self.songs())
+
+    @property
+    def current(self) -> Optional[Song]:
+        node = self._nodes.get(self.current_id)
+        return node.song if node else None
+
+    def get(self, song_id: int) -> Optional[Song]:
+        node = self._nodes.get(song_id)
+        return node.song if node else None
+
+    def find_url(self, url: str) -> Optional[Song]:
+        """按链接查找歌曲"""
+        return self.get(self._by_url.get(url))
+
+    def songs(self, start: Optional[int] = None, limit: Optional[int] = None) -> List[Song]:
+        """从 start（默认列表开头）开始按顺序列出最多 limit 首歌曲"""
+        with self._lock:
+            result = []
+            song_id = self._head if start is None else start
+            while song_id is not None and (limit is None or len(result) < limit):
+                node = self._nodes[song_id]
+                result.append(node.song)
+                song_id = node.next
+            return result
+
+    def upcoming(self, limit: Optional[int] = None) -> List[Song]:
+        """按顺序列出当前歌曲之后的歌曲"""
+        with self._lock:
+            node = self._nodes.get(self.current_id)
+            if node is not None:
+                start = node.next
+            elif self._resume_id in self._nodes:
+                start = self._resume_id
+            elif self._ended:
+                return []
+            else:
+                start = self._head
+            if start is None:
+                return []
+            return self.songs(start, limit)
+
+    # ---- 链表操作 ----
+
+    def _link_after(self, song_id: int, after_id: Optional[int]):
+        """把节点插入到 after_id 之后，after_id 为None时插入到开头"""
+        node = self._nodes[song_id]
+        if after_id is None:
+            node.prev, node.next = None, self._head
+            if self._head is not None:
+                self._nodes[self._head].prev = song_id
+            self._head = song_id
+        else:
+            after = self._nodes[after_id]
+            node.prev, node.next = after_id, after.next
+            if after.next is not None:
+                self._nodes[after.next].prev = song_id
+            after.next = song_id
+        if node.next is None:
+            self._tail = song_id
+
+    def _unlink(self, song_id: int):
+        node = self._nodes[song_id]
+        if node.prev is not None:
+            self._nodes[node.prev].next = node.next
+        else:
+            self._head = node.next
+        if node.next is not None:
+            self._nodes[node.next].prev = node.prev
+        else:
+            self._tail = node.prev
+        node.prev = node.next = None
+
+    def _round_add(self, song_id: int):
+        if song_id not in self._round_pos:
+            self._round_pos[song_id] = len(self._round)
+            self._round.append(song_id)
+
+    def _round_discard(self, song_id: int):
+        index = self._round_pos.pop(song_id, None)
+        if index is None:
+            return
+        last = self._round.pop()
+        if last != song_id:
+            self._round[index] = last
+            self._round_pos[last] = index
+
+    # ---- 增删改 ----
+
+    def add(self, url: str, title: str = "", singer: str = "", user: str = "",
+            query: str = "", index: int = 0) -> Tuple[Optional[Song], str]:
+        """加入歌曲，返回 (歌曲, '')；被拒绝时返回 (None, 原因)"""
+        with self._lock:
+            existing = self._by_url.get(url)
+            if existing is not None:
+                return None, f"这首歌已在播放列表中（编号{existing}）"
+            if len(self._nodes) >= self.max_size:
+                return None, "播放列表已满"
+            if user and self.max_per_user and self._per_user.get(user, 0) >= self.max_per_user:
+                return None, f"每人最多点{self.max_per_user}首歌，请等已点的歌曲播放后再点"
+            song = Song(next(self._ids), url, title, singer, user, query, index)
+            self._nodes[song.id] = _Node(song)
+            self._link_after(song.id, self._tail)
+            self._by_url[url] = song.id
+            if user:
+                self._per_user[user] = self._per_user.get(user, 0) + 1
+            self._round_add(song.id)
+            if self._ended:
+                # 已播放到末尾，新加入的歌曲接着播放
+                self._resume_id = song.id
+                self._ended = False
+            return song, ""
+
+    def remove(self, song_id: int) -> Optional[Song]:
+        """按编号删除歌曲"""
+        with self._lock:
+            node = self._nodes.get(song_id)
+            if node is None:
+                return None
+            if song_id == self.current_id:
+                self._resume_id = node.next
+                self._ended = node.next is None
+                self.current_id = None
+            elif song_id == self._resume_id:
+                self._resume_id = node.next
+                self._ended = node.next is None
+            if song_id == self._shuffle_next:
+                self._shuffle_next = None
+            self._unlink(song_id)
+            del self._nodes[song_id]
+            song = node.song
+            self._by_url.pop(song.url, None)
+            if song.user:
+                count = self._per_user.get(song.user, 0) - 1
+                if count > 0:
+                    self._per_user[song.user] = count
+                else:
+                    self._per_user.pop(song.user, None)
+            self._round_discard(song_id)
+            self._dead.discard(song_id)
+            return song
+
+    def pop(self) -> Optional[Song]:
+        """取出列表开头的歌曲"""
+        with self._lock:
+            return self.remove(self._head) if self._head is not None else None
+
+    def move(self, song_id: int, after_id: Optional[int] = None) -> bool:
+        """把歌曲移动到 after_id 之后，after_id 为None时移动到开头"""
+        with self._lock:
+            if song_id not in self._nodes or song_id == after_id:
+                return False
+            if after_id is not None and after_id not in self._nodes:
+                return False
+            self._unlink(song_id)
+            self._link_after(song_id, after_id)
+            return True
+
+    def clear(self):
+        """清空列表"""
+        with self._lock:
+            self._nodes.clear()
+            self._head = self._tail = None
+            self._by_url.clear()
+            self._per_user.clear()
+            self._round.clear()
+            self._round_pos.clear()
+            self._dead.clear()
+            self.current_id = self._resume_id = self._shuffle_next = None
+            self._ended = False
+
+    def mark_dead(self, song_id: int, dead: bool = True) -> bool:
+        """标记歌曲链接已失效，播放时跳过"""
+        with self._lock:
+            if song_id not in self._nodes:
+                return False
+            if dead:
+                self._dead.add(song_id)
+                self._round_discard(song_id)
+                if song_id == self._shuffle_next:
+                    self._shuffle_next = None
+            else:
+                self._dead.discard(song_id)
+                self._round_add(song_id)
+            return True
+
+    def is_dead(self, song_id: int) -> bool:
+        return song_id in self._dead
+
+    def replace_url(self, song_id: int, url: str) -> bool:
+        """更换歌曲链接（如刷新过期链接），编号和位置不变，并清除失效标记"""
+        with self._lock:
+            node = self._nodes.get(song_id)
+            existing = self._by_url.get(url)
+            if node is None or existing not in (None, song_id):
+                return False
+            self._by_url.pop(node.song.url, None)
+            node.song = node.song._replace(url=url)
+            self._by_url[url] = song_id
+            self.mark_dead(song_id, False)
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出可JSON序列化的列表状态"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'current': self.current_id,
+                'songs': [list(song) for song in self.songs()],
+                'dead': sorted(self._dead),
+            }
+
+    def restore(self, data: Dict[str, Any]):
+        """从 snapshot() 的结果恢复，歌曲编号保持不变"""
+        with self._lock:
+            self.clear()
+            max_id = 0
+            for item in data.get('songs', []):
+                song = Song(*item)
+                if song.url in self._by_url or len(self._nodes) >= self.max_size:
+                    continue
+                self._nodes[song.id] = _Node(song)
+                self._link_after(song.id, self._tail)
+                self._by_url[song.url] = song.id
+                if song.user:
+                    self._per_user[song.user] = self._per_user.get(song.user, 0) + 1
+                self._round_add(song.id)
+                max_id = max(max_id, song.id)
+            self._ids = itertools.count(max_id + 1)
+            self.set_mode(data.get('mode', "album"))
+            if data.get('current') in self._nodes:
+                self.current_id = data['current']
+            for song_id in data.get('dead', []):
+                self.mark_dead(song_id)
+
+    def user_count(self, user: str) -> int:
+        """用户在列表中的歌曲数"""
+        return self._per_user.get(user, 0)
+
+    # ---- 播放模式 ----
+
+    def set_mode(self, mode: str) -> bool:
+        if mode not in PLAY_MODES:
+            return False
+        with self._lock:
+            self.mode = mode
+            self._shuffle_next = None
+            return True
+
+    def _next_in_order(self) -> Optional[int]:
+        node = self._nodes.get(self.current_id)
+        if node is not None:
+            return node.next
+        if self._resume_id in self._nodes:
+            return self._resume_id
+        if self._ended:
+            return None
+        return self._head
+
+    def _skip_dead(self, song_id: Optional[int]) -> Optional[int]:
+        """从 song_id 开始按顺序跳过失效的歌曲（loop模式到末尾后回到开头）"""
+        skipped = 0
+        while song_id is not None and song_id in self._dead:
+            skipped += 1
+            if skipped > len(self._dead):
+                return None
+            song_id = self._nodes[song_id].next
+            if song_id is None and self.mode == "loop":
+                song_id = self._head
+        return song_id
+
+    def _pick_shuffle(self) -> Optional[int]:
+        if self._shuffle_next in self._nodes:
+            return self._shuffle_next
+        # 失效的歌曲不参与本轮随机
+        for song_id in list(self._dead):
+            self._round_discard(song_id)
+        if not self._round:
+            # 新一轮：所有歌曲（当前歌曲除外）重新参与随机
+            for song_id in self._nodes:
+                if song_id != self.current_id and song_id not in self._dead:
+                    self._round_add(song_id)
+            # 只剩当前歌曲时重复播放它（点歌队列中当前歌曲播放后会被移出，不再重复）
+            if not self._round and not self.consume and self.current_id in self._nodes \
+                    and self.current_id not in self._dead:
+                self._round_add(self.current_id)
+        if not self._round:
+            return None
+        self._shuffle_next = random.choice(self._round)
+        return self._shuffle_next
+
+    def peek_next(self) -> Optional[Song]:
+        """下一首将播放的歌曲（不移动游标）"""
+        with self._lock:
+            if not self._nodes or self.mode == "single" and self.current_id is not None:
+                return None
+            if self.mode == "repeat" and self.current_id is not None and self.current_id not in self._dead:
+                return self.current
+            if self.mode == "shuffle":
+                return self.get(self._pick_shuffle())
+            song_id = self._next_in_order()
+            if song_id is None and self.mode == "loop":
+                song_id = self._head
+            return self.get(self._skip_dead(song_id))
+
+    def advance(self) -> Optional[Song]:
+        """移动游标到下一首并返回，没有下一首时返回None"""
+        with self._lock:
+            song = self.peek_next()
+            previous = self.current_id
+            if song is None:
+                if self.consume and previous is not None and self.mode in CONSUMED_MODES:
+                    self.remove(previous)
+                self.current_id = None
+                self._resume_id = None
+                self._ended = False
+                return None
+            self.current_id = song.id
+            self._resume_id = None
+            self._ended = False
+            self._shuffle_next = None
+            if self.mode == "shuffle":
+                self._round_discard(song.id)
+            if self.consume and previous is not None and previous != song.id and self.mode in CONSUMED_MODES:
+                self.remove(previous)
+            return song
+
+    def finish(self) -> Optional[Song]:
+        """没有下一首时结束当前歌曲：点歌队列中移出已播放的歌曲并返回，其他情况不改变列表"""
+        with self._lock:
+            if self.consume and self.current_id is not None and self.mode in CONSUMED_MODES:
+                return self.remove(self.current_id)
+            return None
@@ -0,0 +1,129 @@
+# 断线重连模块
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+# 连接状态
+STATE_CONNECTED = "connected"  # 正常
+STATE_DEGRADED = "degraded"  # 健康检查失败，观察中
+STATE_REJOINING = "rejoining"  # 正在重新加入房间
+STATE_AUTH_LOST = "auth_lost"  # 重新加入多次失败，Cookie可能已失效，等待更新Cookie
+
+
+class ReconnectController:
+    """非阻塞的断线重连控制器
+
+    状态按 connected -> degraded -> rejoining -> auth_lost 逐级升级。
+    监控循环每轮调用 step()，到达重试时间时在后台线程中执行一次重连尝试，
+    监控循环本身从不阻塞；失败后按指数退避（带随机抖动）安排下一次尝试。
+    机器人无法自行登录，auth_lost 状态下只按 max_delay 间隔重新读取配置中的Cookie，
+    直到Cookie被更新且能重新加入房间。
+    """
+
+    def __init__(self, rejoin: Callable[[], bool], reload_cookie: Callable[[], bool],
+                 on_state_change: Optional[Callable[[str, str], None]] = None,
+                 degrade_threshold: int = 2, rejoin_attempts: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 60.0):
+        self.rejoin = rejoin  # 重新加入房间，成功返回True
+        self.reload_cookie = reload_cookie  # 重新读取Cookie，有效时重新加入房间，成功返回True
+        self.on_state_change = on_state_change  # 状态变化回调 (旧状态, 新状态)
+        self.degrade_threshold = degrade_threshold  # 连续健康检查失败多少次后开始重连
+        self.rejoin_attempts = rejoin_attempts  # 重新加入失败多少次后认为Cookie可能失效
+        self.base_delay = base_delay  # 首次重试延迟（秒）
+        self.max_delay = max_delay  # 最大重试延迟（秒）
+
+        self.state = STATE_CONNECTED
+        self.failures = 0  # 连续健康检查失败次数
+        self.attempts = 0  # 当前状态下连续重连失败次数
+        self.next_attempt_time = 0.0
+        self.last_error = ""
+        self._lock = threading.RLock()
+        self._worker: Optional[threading.Thread] = None
+
+    def _set_state(self, state: str):
+        old_state, self.state = self.state, state
+        if old_state != state and self.on_state_change:
+            try:
+                self.on_state_change(old_state, state)
+            except Exception as e:
+                print(f"连接状态回调出错: {e}")
+
+    @property
+    def is_connected(self) -> bool:
+        return self.state == STATE_CONNECTED
+
+    @property
+    def busy(self) -> bool:
+        """是否有重连尝试正在进行"""
+        return self._worker is not None and self._worker.is_alive()
+
+    def mark_healthy(self):
+        """健康检查通过"""
+        with self._lock:
+            if self.busy:
+                return
+            self.failures = 0
+            self.attempts = 0
+            self._set_state(STATE_CONNECTED)
+
+    def mark_degraded(self, reason: str = ""):
+        """健康检查失败"""
+        with self._lock:
+            self.failures += 1
+            self.last_error = reason
+            if self.state == STATE_CONNECTED:
+                self._set_state(STATE_DEGRADED)
+            if self.state == STATE_DEGRADED and self.failures >= self.degrade_threshold:
+                self.attempts = 0
+                self.next_attempt_time = time.time()
+                self._set_state(STATE_REJOINING)
+
+    def request_rejoin(self, reason: str = ""):
+        """立即开始重新加入房间（例如确认机器人已不在房间中）"""
+        with self._lock:
+            self.last_error = reason
+            if self.state in (STATE_CONNECTED, STATE_DEGRADED):
+                self.attempts = 0
+                self.next_attempt_time = time.time()
+                self._set_state(STATE_REJOINING)
+
+    def _backoff(self) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, self.attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _attempt(self, state: str):
+        """在后台线程中执行一次重连尝试"""
+        try:
+            ok = self.rejoin() if state == STATE_REJOINING else self.reload_cookie()
+        except BaseException as e:  # 读取配置的流程可能调用 sys.exit
+            self.last_error = str(e)
+            ok = False
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.attempts = 0
+                self._set_state(STATE_CONNECTED)
+                return
+            self.attempts += 1
+            if state == STATE_REJOINING and self.attempts >= self.rejoin_attempts:
+                # 多次重新加入失败，可能是Cookie失效，等待更新Cookie
+                self.attempts = 0
+                self.next_attempt_time = time.time()
+                self._set_state(STATE_AUTH_LOST)
+            elif state == STATE_AUTH_LOST:
+                # 同一个Cookie短时间内重试没有意义
+                self.next_attempt_time = time.time() + self.max_delay
+            else:
+                self.next_attempt_time = time.time() + self._backoff()
+
+    def step(self) -> bool:
+        """由监控循环每轮调用，到达重试时间时启动后台重连，返回是否启动了尝试"""
+        with self._lock:
+            if self.state not in (STATE_REJOINING, STATE_AUTH_LOST) or self.busy:
+                return False
+            if time.time() < self.next_attempt_time:
+                return False
+            self._worker = threading.Thread(target=self._attempt, args=(self.state,), daemon=True)
+            self._worker.start()
+            return True
@@ -1,17 +1,148 @@
 # 房间管理模块
 import re
-from typing import Dict, List, Any
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+
+from modules.acl_store import ACLStore
+
+# 含有反向引用、命名分组或全局内联标志的模式无法安全地拼入合并正则
+_BACKREF_RE = re.compile(r'\\[1-9]|\(\?P=')
+_GLOBAL_FLAGS_RE = re.compile(r'^\(\?[aiLmsux]+\)')
+
+
+class PatternMatch(NamedTuple):
+    """模式匹配结果"""
+    pattern: str  # 命中的规则
+    field: str  # 命中的字段: name / tripcode
+    value: Any  # 规则关联的值
+
+
+class PatternSet:
+    """预编译的模式集合
+
+    所有模式合并为一条忽略大小写的正则，仅在模式变更时重新编译。
+    未命中时每个字段只需一次扫描；命中时按分块定位并报告最先添加的规则。
+    """
+
+    BLOCK_SIZE = 64  # 命中后逐块定位规则的分块大小
+
+    def __init__(self):
+        self._rules: Dict[str, Tuple[Any, Any]] = {}  # pattern -> (compiled, value)
+        self._dirty = True
+        self._ordered: List[Tuple[str, Any, Any]] = []  # (pattern, compiled, value)
+        self._combined = None  # 所有可合并规则的过滤正则
+        self._segments: List[Tuple[Any, List[int]]] = []  # (分块正则, 规则序号)
+        self._has_slow = False  # 是否存在无法合并的规则
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __contains__(self, pattern: str):
+        return pattern in self._rules
+
+    @property
+    def patterns(self) -> List[str]:
+        """按添加顺序返回所有模式"""
+        return list(self._rules)
+
+    def add(self, pattern: str, value: Any = True):
+        """添加或更新模式，正则无效时抛出 re.error"""
+        compiled = re.compile(pattern, re.IGNORECASE)
+        self._rules[pattern] = (compiled, value)
+        self._dirty = True
+
+    def remove(self, pattern: str) -> bool:
+        """移除模式"""
+        if pattern in self._rules:
+            del self._rules[pattern]
+            self._dirty = True
+            return True
+        return False
+
+    def items(self):
+        """返回 (pattern, value) 列表"""
+        return [(pattern, value) for pattern, (_, value) in self._rules.items()]
+
+    @staticmethod
+    def _can_combine(pattern: str, compiled) -> bool:
+        """判断模式能否拼入合并正则"""
+        return not (compiled.groupindex or _BACKREF_RE.search(pattern)
+                    or _GLOBAL_FLAGS_RE.match(pattern))
+
+    @staticmethod
+    def _join(patterns: List[str]):
+        """用非捕获分组合并模式（捕获分组会让匹配慢上千倍）"""
+        return re.compile('|'.join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+    def _rebuild(self):
+        """重新编译合并正则"""
+        self._ordered = [(pattern, compiled, value)
+                         for pattern, (compiled, value) in self._rules.items()]
+        self._segments = []
+        self._has_slow = False
+        fast = []
+        block: List[int] = []
+
+        def flush():
+            if block:
+                self._segments.append((self._join([self._ordered[i][0] for i in block]), list(block)))
+                block.clear()
+
+        for index, (pattern, compiled, _) in enumerate(self._ordered):
+            if self._can_combine(pattern, compiled):
+                fast.append(pattern)
+                block.append(index)
+                if len(block) >= self.BLOCK_SIZE:
+                    flush()
+            else:
+                # 无法合并的规则单独成段，保持原有顺序
+                flush()
+                self._segments.append((compiled, [index]))
+                self._has_slow = True
+        flush()
+
+        try:
+            self._combined = self._join(fast) if fast else None
+        except re.error:
+            # 个别模式互相冲突时退化为逐条匹配
+            self._combined = None
+            self._segments = [(compiled, [index])
+                              for index, (_, compiled, _) in enumerate(self._ordered)]
+            self._has_slow = bool(self._ordered)
+        self._dirty = False
+
+    def _hits(self, regex, user_name: str, tripcode: str) -> bool:
+        return bool((user_name and regex.search(user_name)) or
+                    (tripcode and regex.search(tripcode)))
+
+    def match(self, user_name: str, tripcode: str = "") -> Optional[PatternMatch]:
+        """匹配用户名和tripcode，返回最先添加的命中规则"""
+        if self._dirty:
+            self._rebuild()
+        if not self._ordered:
+            return None
+        if not self._has_slow and (self._combined is None or
+                                   not self._hits(self._combined, user_name, tripcode)):
+            return None
+
+        for regex, indices in self._segments:
+            if not self._hits(regex, user_name, tripcode):
+                continue
+            for index in indices:
+                pattern, compiled, value = self._ordered[index]
+                if user_name and compiled.search(user_name):
+                    return PatternMatch(pattern, 'name', value)
+                if tripcode and compiled.search(tripcode):
+                    return PatternMatch(pattern, 'tripcode', value)
+        return None
+
 
 class RoomManager:
     """房间管理类"""
     
-    def __init__(self):
-        self.admins: List[str] = []  # 管理员tripcode列表
-        self.banned_users: List[str] = []  # 被封禁用户ID列表
-        self.whitelist: List[str] = []  # 白名单用户tripcode列表
-        self.blacklist: List[str] = []  # 黑名单用户tripcode列表
-        self.welcome_messages: Dict[str, str] = {}  # 欢迎消息
-        self.auto_kick_patterns: List[str] = []  # 自动踢出模式
+    def __init__(self, acl_store: Optional[ACLStore] = None):
+        self.acl = acl_store or ACLStore()  # 管理员/封禁/白名单/黑名单
+        self.welcome_rules = PatternSet()  # 欢迎消息规则（模式 -> 消息）
+        self.auto_kick_rules = PatternSet()  # 自动踢出规则
         self.room_settings: Dict[str, Any] = {
             'allow_dm': True,
             'allow_music': True,
@@ -20,123 +151,146 @@ class RoomManager:
             'room_description': ''
         }
         
+    @property
+    def admins(self) -> List[str]:
+        """管理员tripcode列表"""
+        return self.acl.entries('admins', 'tripcode')
+        
+    @property
+    def banned_users(self) -> List[str]:
+        """被封禁用户ID列表"""
+        return self.acl.entries('banned', 'id')
+        
+    @property
+    def whitelist(self) -> List[str]:
+        """白名单用户tripcode列表"""
+        return self.acl.entries('whitelist', 'tripcode')
+        
+    @property
+    def blacklist(self) -> List[str]:
+        """黑名单用户tripcode列表"""
+        return self.acl.entries('blacklist', 'tripcode')
+        
     def add_admin(self, tripcode: str):
         """添加管理员"""
-        if tripcode not in self.admins:
-            self.admins.append(tripcode)
+        if self.acl.add('admins', tripcode=tripcode):
             return f"已添加管理员: {tripcode}"
         else:
             return f"用户已经是管理员: {tripcode}"
             
     def remove_admin(self, tripcode: str):
         """移除管理员"""
-        if tripcode in self.admins:
-            self.admins.remove(tripcode)
+        if self.acl.remove('admins', tripcode=tripcode):
             return f"已移除管理员: {tripcode}"
         else:
             return f"用户不是管理员: {tripcode}"
             
     def is_admin(self, tripcode: str) -> bool:
         """检查是否为管理员"""
-        return tripcode in self.admins
+        return self.acl.contains('admins', tripcode=tripcode)
         
     def ban_user(self, user_id: str, tripcode: str = ""):
         """封禁用户"""
-        if user_id not in self.banned_users:
-            self.banned_users.append(user_id)
+        if self.acl.add('banned', user_id=user_id, tripcode=tripcode):
             return f"已封禁用户: {user_id}"
         else:
             return f"用户已被封禁: {user_id}"
             
-    def unban_user(self, user_id: str):
+    def unban_user(self, user_id: str, tripcode: str = ""):
         """解封用户"""
-        if user_id in self.banned_users:
-            self.banned_users.remove(user_id)
+        if self.acl.remove('banned', user_id=user_id, tripcode=tripcode):
             return f"已解封用户: {user_id}"
         else:
             return f"用户未被封禁: {user_id}"
             
-    def is_banned(self, user_id: str) -> bool:
+    def is_banned(self, user_id: str, tripcode: str = "") -> bool:
         """检查用户是否被封禁"""
-        return user_id in self.banned_users
+        return self.acl.contains('banned', user_id=user_id, tripcode=tripcode)
         
     def add_to_whitelist(self, tripcode: str):
         """添加到白名单"""
-        if tripcode not in self.whitelist:
-            self.whitelist.append(tripcode)
+        if self.acl.add('whitelist', tripcode=tripcode):
             return f"已添加到白名单: {tripcode}"
         else:
             return f"用户已在白名单中: {tripcode}"
             
     def remove_from_whitelist(self, tripcode: str):
         """从白名单移除"""
-        if tripcode in self.whitelist:
-            self.whitelist.remove(tripcode)
+        if self.acl.remove('whitelist', tripcode=tripcode):
             return f"已从白名单移除: {tripcode}"
         else:
             return f"用户不在白名单中: {tripcode}"
             
     def is_whitelisted(self, tripcode: str) -> bool:
         """检查是否在白名单中"""
-        return not self.whitelist or tripcode in self.whitelist  # 空白名单表示无限制
+        # 空白名单表示无限制
+        return self.acl.is_empty('whitelist') or self.acl.contains('whitelist', tripcode=tripcode)
         
     def add_to_blacklist(self, tripcode: str):
         """添加到黑名单"""
-        if tripcode not in self.blacklist:
-            self.blacklist.append(tripcode)
+        if self.acl.add('blacklist', tripcode=tripcode):
             return f"已添加到黑名单: {tripcode}"
         else:
             return f"用户已在黑名单中: {tripcode}"
             
     def remove_from_blacklist(self, tripcode: str):
         """从黑名单移除"""
-        if tripcode in self.blacklist:
-            self.blacklist.remove(tripcode)
+        if self.acl.remove('blacklist', tripcode=tripcode):
             return f"已从黑名单移除: {tripcode}"
         else:
             return f"用户不在黑名单中: {tripcode}"
             
     def is_blacklisted(self, tripcode: str) -> bool:
         """检查是否在黑名单中"""
-        return tripcode in self.blacklist
+        return self.acl.contains('blacklist', tripcode=tripcode)
+        
+    @property
+    def welcome_messages(self) -> Dict[str, str]:
+        """欢迎消息（模式 -> 消息）"""
+        return dict(self.welcome_rules.items())
+        
+    @property
+    def auto_kick_patterns(self) -> List[str]:
+        """自动踢出模式列表"""
+        return self.auto_kick_rules.patterns
         
     def set_welcome_message(self, pattern: str, message: str):
         """设置欢迎消息"""
-        self.welcome_messages[pattern] = message
+        try:
+            self.welcome_rules.add(pattern, message)
+        except re.error as e:
+            return f"无效的正则表达式: {pattern} ({e})"
         return f"已设置欢迎消息: {pattern}"
         
     def get_welcome_message(self, user_name: str, tripcode: str = ""):
         """获取欢迎消息"""
-        for pattern, message in self.welcome_messages.items():
-            # 检查用户名或tripcode是否匹配模式
-            if re.search(pattern, user_name, re.IGNORECASE) or \
-               (tripcode and re.search(pattern, tripcode, re.IGNORECASE)):
-                return message
-        return None
+        match = self.welcome_rules.match(user_name, tripcode)
+        return match.value if match else None
         
     def add_auto_kick_pattern(self, pattern: str):
         """添加自动踢出模式"""
-        if pattern not in self.auto_kick_patterns:
-            self.auto_kick_patterns.append(pattern)
-            return f"已添加自动踢出模式: {pattern}"
-        else:
+        if pattern in self.auto_kick_rules:
             return f"自动踢出模式已存在: {pattern}"
+        try:
+            self.auto_kick_rules.add(pattern)
+        except re.error as e:
+            return f"无效的正则表达式: {pattern} ({e})"
+        return f"已添加自动踢出模式: {pattern}"
             
     def remove_auto_kick_pattern(self, pattern: str):
         """移除自动踢出模式"""
-        if pattern in self.auto_kick_patterns:
-            self.auto_kick_patterns.remove(pattern)
+        if self.auto_kick_rules.remove(pattern):
             return f"已移除自动踢出模式: {pattern}"
         else:
             return f"自动踢出模式不存在: {pattern}"
             
+    def match_auto_kick(self, user_name: str, tripcode: str = "") -> Optional[PatternMatch]:
+        """返回命中的自动踢出规则"""
+        return self.auto_kick_rules.match(user_name, tripcode)
+        
     def should_auto_kick(self, user_name: str, tripcode: str = ""):
         """检查是否应该自动踢出用户"""
-        for pattern in self.auto_kick_patterns:
-            if re.search(pattern, user_name, re.IGNORECASE) or \
-               (tripcode and re.search(pattern, tripcode, re.IGNORECASE)):
-                return True
-        return False
+        return self.match_auto_kick(user_name, tripcode) is not None
         
     def set_room_setting(self, setting: str, value: Any):
         """设置房间选项"""
@@ -0,0 +1,93 @@
+# 文本转语音模块
+import hashlib
+import time
+from typing import Dict, Optional
+
+import requests
+
+from utils.helpers import link_expiry
+from utils.ttl_cache import TTLCache
+
+TTS_API = "https://api.suyanw.cn/api/tts.php"
+
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive'
+}
+
+
+def tts_key(text: str, voice: str) -> str:
+    """按声音和文本内容计算缓存键（空白差异视为相同文本）"""
+    content = f"{voice}\n{' '.join(text.split())}"
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class TTSClient:
+    """文本转语音客户端
+
+    生成的音频链接按 hash(文本, 声音) 缓存（SQLite持久化，重启后仍可命中），
+    缓存时间取接口返回链接的过期时间和 link_ttl 中较早者，重复的欢迎语和公告不再请求接口。
+    默认使用独立的会话，不要传入带有房间Cookie的会话，以免Cookie被发送给第三方接口。
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, api_url: str = TTS_API,
+                 voice: str = "素颜", max_size: int = 512, link_ttl: float = 6 * 3600,
+                 cache_path: Optional[str] = None, timeout: float = 30):
+        self.session = session or requests.Session()
+        self.api_url = api_url
+        self.voice = voice  # 默认声音
+        self.link_ttl = link_ttl  # 链接没有过期时间时的缓存时间（秒）
+        self.timeout = timeout
+        self.cache = TTLCache(max_size=max_size, ttl=link_ttl, path=cache_path)
+        self.stats = {'requests': 0, 'failed': 0}
+
+    def _request(self, text: str, voice: str) -> Optional[str]:
+        """请求接口生成语音，返回音频链接"""
+        self.stats['requests'] += 1
+        try:
+            response = self.session.get(self.api_url, params={"text": text, "voice": voice},
+                                        headers=_HEADERS, timeout=self.timeout)
+            if response.status_code != 200:
+                print(f"文本转语音接口调用失败，状态码: {response.status_code}")
+                return None
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"文本转语音接口网络请求错误: {e}")
+            return None
+        except ValueError:
+            print(f"文本转语音接口响应不是有效的JSON格式: {response.text[:200]}")
+            return None
+        if not isinstance(data, dict) or data.get('code') != 200:
+            print(f"文本转语音失败: {data.get('msg', '未知错误') if isinstance(data, dict) else '未知错误'}")
+            return None
+        return (data.get('data') or {}).get('file_link')
+
+    def synthesize(self, text: str, voice: Optional[str] = None) -> Optional[str]:
+        """返回文本对应的音频链接，优先使用缓存，失败时返回None"""
+        voice = voice or self.voice
+        key = tts_key(text, voice)
+        entry = self.cache.get(key)
+        if entry and entry['expires'] > time.time():
+            return entry['url']
+        file_link = self._request(text, voice)
+        if not file_link:
+            self.stats['failed'] += 1
+            return None
+        now = time.time()
+        expires = link_expiry(file_link, now + self.link_ttl)
+        if expires > now:
+            self.cache.set(key, {'url': file_link, 'expires': expires}, ttl=expires - now)
+        return file_link
+
+    def invalidate(self, text: str, voice: Optional[str] = None):
+        """删除缓存的链接（如发现链接已失效）"""
+        self.cache.delete(tts_key(text, voice or self.voice))
+
+    def get_stats(self) -> Dict[str, float]:
+        """请求次数和缓存命中率"""
+        stats = dict(self.stats)
+        stats['hit_rate'] = self.cache.hit_rate
+        return stats
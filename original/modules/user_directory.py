@@ -0,0 +1,165 @@
+# 用户目录模块
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.helpers import normalize_name
+
+
+class UserDirectory:
+    """房间用户目录
+
+    根据每次获取的房间快照增量维护 用户名 -> ID、ID -> 资料、tripcode -> ID集合
+    三个索引，用户名查找忽略大小写和全角差异。离开房间的用户保留在最近离开缓存中，
+    方便对刚离开的用户执行封禁/解封。第一次快照中已在房间的用户加入时间未知（joined_at为None）。
+    监控线程更新目录的同时命令线程会查询，所有公开方法都在锁内执行。
+    """
+
+    def __init__(self, left_ttl: float = 30 * 60, max_left: int = 500):
+        self.profiles: Dict[str, Dict[str, Any]] = {}  # ID -> 用户资料
+        self.name_index: Dict[str, str] = {}  # 规范化用户名 -> ID
+        self.tripcode_index: Dict[str, Set[str]] = {}  # tripcode -> ID集合
+        self.recently_left: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # ID -> 用户资料
+        self.left_name_index: Dict[str, str] = {}  # 规范化用户名 -> 最近离开用户ID
+        self.left_ttl = left_ttl  # 最近离开缓存的保留时间（秒）
+        self.max_left = max_left  # 最近离开缓存的最大条数
+        self.primed = False  # 是否已处理过第一次快照
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def _index(self, profile: Dict[str, Any]):
+        user_id = profile['id']
+        self.name_index[normalize_name(profile.get('name', ''))] = user_id
+        tripcode = profile.get('tripcode')
+        if tripcode:
+            self.tripcode_index.setdefault(tripcode, set()).add(user_id)
+
+    def _unindex(self, profile: Dict[str, Any]):
+        user_id = profile['id']
+        key = normalize_name(profile.get('name', ''))
+        if self.name_index.get(key) == user_id:
+            del self.name_index[key]
+        tripcode = profile.get('tripcode')
+        if tripcode and tripcode in self.tripcode_index:
+            self.tripcode_index[tripcode].discard(user_id)
+            if not self.tripcode_index[tripcode]:
+                del self.tripcode_index[tripcode]
+
+    def _forget_left(self, user_id: str):
+        """从最近离开缓存中移除用户"""
+        profile = self.recently_left.pop(user_id, None)
+        if profile is not None:
+            key = normalize_name(profile.get('name', ''))
+            if self.left_name_index.get(key) == user_id:
+                del self.left_name_index[key]
+
+    def _expire_left(self, now: float):
+        """清理过期的最近离开记录"""
+        while self.recently_left:
+            user_id, profile = next(iter(self.recently_left.items()))
+            if len(self.recently_left) > self.max_left or now - profile['left_at'] > self.left_ttl:
+                self._forget_left(user_id)
+            else:
+                break
+
+    def update(self, users: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """根据房间快照更新目录，返回 (新加入用户, 离开用户)"""
+        with self._lock:
+            now = time.time()
+            joined = []
+            seen = set()
+            for user in users:
+                user_id = user.get('id')
+                if not user_id:
+                    continue
+                seen.add(user_id)
+                profile = self.profiles.get(user_id)
+                if profile is None:
+                    profile = dict(user)
+                    # 第一次快照只能说明用户已在房间中，无法得知加入时间
+                    profile['joined_at'] = now if self.primed else None
+                    self.profiles[user_id] = profile
+                    self._forget_left(user_id)
+                    self._index(profile)
+                    joined.append(profile)
+                elif profile.get('name') != user.get('name') or profile.get('tripcode') != user.get('tripcode'):
+                    # 资料变化时重建该用户的索引
+                    self._unindex(profile)
+                    profile.update(user)
+                    self._index(profile)
+
+            left = []
+            for user_id in [user_id for user_id in self.profiles if user_id not in seen]:
+                profile = self.profiles.pop(user_id)
+                self._unindex(profile)
+                profile['left_at'] = now
+                self.recently_left[user_id] = profile
+                self.left_name_index[normalize_name(profile.get('name', ''))] = user_id
+                left.append(profile)
+            self._expire_left(now)
+            self.primed = True
+            return joined, left
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """按ID查找在房间中的用户"""
+        with self._lock:
+            return self.profiles.get(user_id)
+
+    def find_by_name(self, name: str, include_left: bool = True) -> Optional[Dict[str, Any]]:
+        """按用户名查找用户，可包含最近离开的用户"""
+        with self._lock:
+            key = normalize_name(name.lstrip('@'))
+            user_id = self.name_index.get(key)
+            if user_id is not None:
+                return self.profiles[user_id]
+            if include_left:
+                self._expire_left(time.time())
+                user_id = self.left_name_index.get(key)
+                if user_id is not None:
+                    return self.recently_left[user_id]
+            return None
+
+    def find_by_tripcode(self, tripcode: str) -> List[Dict[str, Any]]:
+        """按tripcode查找在房间中的用户"""
+        with self._lock:
+            return [self.profiles[user_id] for user_id in self.tripcode_index.get(tripcode.lstrip('#'), ())]
+
+    def resolve(self, target: str) -> Optional[Dict[str, Any]]:
+        """解析命令中的目标用户（用户名、@用户名、#tripcode 或用户ID）"""
+        with self._lock:
+            target = target.strip()
+            if not target:
+                return None
+            if target in self.profiles:
+                return self.profiles[target]
+            if target.startswith('#'):
+                matches = self.find_by_tripcode(target)
+                return matches[0] if len(matches) == 1 else None
+            profile = self.find_by_name(target)
+            if profile is None and target in self.recently_left:
+                profile = self.recently_left[target]
+            return profile
+
+    def users(self) -> List[Dict[str, Any]]:
+        """当前房间中的所有用户"""
+        with self._lock:
+            return [dict(profile) for profile in self.profiles.values()]
+
+    def select(self, pattern: Optional[str] = None, joined_within: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按条件筛选房间中的用户
+
+        pattern 为匹配用户名的正则（忽略大小写），joined_within 为最近加入的秒数，
+        两个条件同时给出时需全部满足，加入时间未知的用户不算最近加入。正则无效时抛出 re.error。
+        """
+        regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+        since = time.time() - joined_within if joined_within is not None else None
+        # 在锁内复制资料，匹配正则时不阻塞目录更新
+        with self._lock:
+            profiles = [dict(profile) for profile in self.profiles.values()]
+        return [profile for profile in profiles
+                if (regex is None or regex.search(profile.get('name', '')))
+                and (since is None or (profile['joined_at'] is not None and profile['joined_at'] >= since))]
@@ -0,0 +1,42 @@
+# 对话记忆测试：字符预算、摘要和提示词URL编码长度限制
+import unittest
+from urllib.parse import quote_plus
+
+from modules.conversation_memory import ConversationMemory
+
+
+class ConversationMemoryTest(unittest.TestCase):
+
+    def test_no_history_returns_message_unchanged(self):
+        memory = ConversationMemory()
+        self.assertEqual(memory.build_prompt("user", "你好"), "你好")
+
+    def test_old_turns_move_into_summary(self):
+        memory = ConversationMemory(budget=20)
+        memory.record("user", "第一个问题", "第一个回答")
+        memory.record("user", "第二个问题", "第二个回答")
+        memory.record("user", "第三个问题", "第三个回答")
+        prompt = memory.build_prompt("user", "新问题")
+        self.assertIn("之前聊过的话题：第一个问题", prompt)
+        self.assertIn("用户：第三个问题", prompt)
+        self.assertNotIn("第一个回答", prompt)
+        self.assertTrue(prompt.endswith("新问题"))
+
+    def test_prompt_fits_encoded_limit(self):
+        memory = ConversationMemory(budget=2000, max_prompt_bytes=1000)
+        for i in range(5):
+            memory.record("user", f"问题{i}" + "字" * 30, f"回答{i}" + "字" * 30)
+        prompt = memory.build_prompt("user", "新问题")
+        self.assertLessEqual(len(quote_plus(prompt)), 1000)
+        # 保留最近的对话，省略最早的
+        self.assertIn("问题4", prompt)
+        self.assertNotIn("问题0", prompt)
+
+    def test_message_alone_when_history_does_not_fit(self):
+        memory = ConversationMemory(max_prompt_bytes=200)
+        memory.record("user", "字" * 100, "字" * 100)
+        self.assertEqual(memory.build_prompt("user", "新问题"), "新问题")
+
+
+if __name__ == '__main__':
+    unittest.main()
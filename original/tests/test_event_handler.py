@@ -0,0 +1,69 @@
+# 事件处理测试：处理器的超时配置和按注册统计
+import asyncio
+import unittest
+
+from modules.event_handler import EventHandler
+
+
+class CommandTimeoutTest(unittest.TestCase):
+
+    def run_commands(self, handler, *commands):
+        async def run():
+            for command in commands:
+                await handler.handle_command(command, {'id': 'user'})
+        asyncio.run(run())
+
+    def test_command_timeout_is_configurable(self):
+        handler = EventHandler(default_timeout=0.05)
+        finished = []
+
+        async def slow(name, args, user):
+            await asyncio.sleep(0.2)
+            finished.append(name)
+
+        handler.register_command_handler('default', slow)
+        handler.register_command_handler('unlimited', slow, timeout=0)
+        handler.register_command_handler('longer', slow, timeout=1)
+        self.run_commands(handler, '/default', '/unlimited', '/longer')
+
+        self.assertEqual(finished, ['unlimited', 'longer'])
+        stats = handler.get_handler_stats()
+        self.assertEqual(stats['command:default']['timeouts'], 1)
+        self.assertEqual(stats['command:longer']['timeouts'], 0)
+
+    def test_handlers_are_unlimited_by_default(self):
+        handler = EventHandler()
+        finished = []
+
+        async def slow(name, args, user):
+            await asyncio.sleep(0.1)
+            finished.append(name)
+
+        handler.register_command_handler('slow', slow)
+        self.run_commands(handler, '/slow')
+        self.assertEqual(finished, ['slow'])
+
+
+class HandlerStatsTest(unittest.TestCase):
+
+    def test_stats_are_kept_per_registration(self):
+        handler = EventHandler()
+
+        async def fail(data):
+            raise ValueError(data)
+
+        async def ok(data):
+            pass
+
+        handler.register_event_handler('join', lambda data: ok(data))
+        handler.register_event_handler('join', lambda data: fail(data))
+        handler.register_event_handler('leave', ok)
+        asyncio.run(handler.handle_event('join', {}))
+
+        stats = handler.get_handler_stats()
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(sorted(entry['failures'] for entry in stats.values()), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# 加入房间测试：用本地替身服务器模拟DRRR的授权、跳转和延迟就绪
+import asyncio
+import time
+import unittest
+
+from aiohttp import web
+
+from api.drrr_api import DRRRAPI
+
+ROOM_ID = "test-room"
+PROFILE = {"id": "bot-id", "name": "bot"}
+
+
+class StandInServer:
+    """模拟房间接口：授权后经过 ready_delay 秒机器人才出现在房间用户列表中"""
+
+    def __init__(self, ready_delay=0.3, in_room=False, redirect=None):
+        self.ready_delay = ready_delay
+        self.joined_at = time.monotonic() if in_room else None
+        self.redirect = redirect or f"room/?id={ROOM_ID}&join=1"
+        self.requests = []
+        self.app = web.Application()
+        self.app.router.add_get('/room/', self.room)
+        self.app.router.add_post('/room/', self.authorize)
+        self.runner = None
+        self.base_url = None
+
+    def ready(self):
+        return self.joined_at is not None and time.monotonic() - self.joined_at >= self.ready_delay
+
+    async def room(self, request):
+        self.requests.append(('GET', request.query_string))
+        if request.query.get('join'):
+            return web.Response(text="ok")
+        if self.joined_at is None:
+            return web.json_response({"id": ROOM_ID, "authorization": "token"}, status=403)
+        users = [PROFILE] if self.ready() else []
+        return web.json_response({"room": {"roomId": ROOM_ID, "users": users}, "profile": PROFILE})
+
+    async def authorize(self, request):
+        self.requests.append(('POST', ''))
+        self.joined_at = time.monotonic()
+        return web.json_response({"redirect": self.redirect})
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class JoinRoomTest(unittest.TestCase):
+
+    def join(self, server, timeout=5.0):
+        async def run():
+            await server.start()
+            api = DRRRAPI()
+            api.base_url = server.base_url
+            try:
+                start = time.monotonic()
+                result = await api.join_room(ROOM_ID, timeout=timeout)
+                return result, time.monotonic() - start
+            finally:
+                await api.close()
+                await server.stop()
+        return asyncio.run(run())
+
+    def test_returns_soon_after_room_is_ready(self):
+        server = StandInServer(ready_delay=0.3)
+        result, elapsed = self.join(server)
+        self.assertTrue(result["success"])
+        self.assertGreaterEqual(elapsed, 0.3)
+        # 原来固定等待3秒以上
+        self.assertLess(elapsed, 1.0)
+        self.assertIn(('GET', f"id={ROOM_ID}&join=1"), server.requests)
+
+    def test_already_in_room_returns_immediately(self):
+        server = StandInServer(ready_delay=0, in_room=True)
+        result, elapsed = self.join(server)
+        self.assertTrue(result["success"])
+        self.assertEqual(len(server.requests), 1)
+        self.assertLess(elapsed, 0.5)
+
+    def test_lounge_redirect_fails_fast(self):
+        server = StandInServer(redirect="lounge")
+        result, elapsed = self.join(server)
+        self.assertFalse(result["success"])
+        self.assertIn("休息室", result["message"])
+        self.assertLess(elapsed, 0.5)
+
+    def test_times_out_when_never_ready(self):
+        server = StandInServer(ready_delay=60)
+        result, elapsed = self.join(server, timeout=0.5)
+        self.assertFalse(result["success"])
+        self.assertLess(elapsed, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
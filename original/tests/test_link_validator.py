@@ -0,0 +1,91 @@
+# 链接检测测试：内网地址和重定向到内网的链接不会被请求
+import unittest
+
+from modules.link_validator import check_url, probe_link
+
+PUBLIC_URL = 'http://93.184.216.34/song.mp3'
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, headers=None, body=b''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    @property
+    def is_redirect(self):
+        return 'Location' in self.headers and self.status_code in (301, 302, 303, 307, 308)
+
+    def iter_content(self, chunk_size=1):
+        yield self.body
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeSession:
+    """按 (方法, 链接) 返回预设响应，记录请求"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs.get('allow_redirects')))
+        return self.responses[(method, url)]
+
+
+class CheckUrlTest(unittest.TestCase):
+
+    def test_rejects_internal_hosts(self):
+        for url in ('http://127.0.0.1/a.mp3', 'http://localhost:8080/a.mp3', 'http://10.0.0.5/a.mp3',
+                    'http://169.254.169.254/latest', 'http://[::1]/a.mp3', 'http://[::ffff:192.168.1.1]/',
+                    'http://0.0.0.0/', 'http://224.0.0.1/'):
+            self.assertTrue(check_url(url), url)
+
+    def test_rejects_other_schemes(self):
+        self.assertTrue(check_url('file:///etc/passwd'))
+        self.assertTrue(check_url('ftp://93.184.216.34/a.mp3'))
+
+    def test_accepts_public_address(self):
+        self.assertEqual(check_url(PUBLIC_URL), '')
+
+
+class ProbeLinkTest(unittest.TestCase):
+
+    def test_internal_link_is_dead_without_request(self):
+        session = FakeSession({})
+        info = probe_link(session, 'http://127.0.0.1:8000/a.mp3')
+        self.assertIs(info.alive, False)
+        self.assertEqual(session.calls, [])
+
+    def test_redirect_to_internal_host_is_not_followed(self):
+        redirect = FakeResponse(302, {'Location': 'http://127.0.0.1/secret'})
+        session = FakeSession({('HEAD', PUBLIC_URL): redirect, ('GET', PUBLIC_URL): redirect})
+        info = probe_link(session, PUBLIC_URL)
+        self.assertIs(info.alive, False)
+        self.assertEqual({url for _, url, _ in session.calls}, {PUBLIC_URL})
+        self.assertTrue(all(allow is False for _, _, allow in session.calls))
+
+    def test_public_redirect_is_followed(self):
+        target = 'http://93.184.216.35/real.ogg'
+        session = FakeSession({
+            ('HEAD', PUBLIC_URL): FakeResponse(301, {'Location': '/moved'}),
+            ('HEAD', 'http://93.184.216.34/moved'): FakeResponse(302, {'Location': target}),
+            ('HEAD', target): FakeResponse(200, {'Content-Type': 'audio/ogg', 'Content-Length': '1234'}),
+        })
+        info = probe_link(session, PUBLIC_URL)
+        self.assertIs(info.alive, True)
+        self.assertEqual(info.size, 1234)
+        self.assertEqual(len(session.calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
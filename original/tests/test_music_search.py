@@ -0,0 +1,81 @@
+# 音乐搜索测试：结果缓存、空结果缓存和接口错误
+import unittest
+
+from modules.music_search import MusicSearchClient
+
+
+class FakeResponse:
+
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """按顺序返回预设响应，记录请求参数"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls.append(dict(params))
+        return self.responses.pop(0)
+
+
+def songs(*titles):
+    return {'code': 200, 'data': [{'n': i, 'title': title, 'singer': 'singer', 'url': f'http://music/{i}.mp3'}
+                                  for i, title in enumerate(titles, 1)]}
+
+
+class MusicSearchClientTest(unittest.TestCase):
+
+    def test_results_are_cached_by_normalized_query(self):
+        session = FakeSession(FakeResponse(songs('a', 'b', 'c')))
+        client = MusicSearchClient(session)
+        results, error = client.search('Hello  World')
+        self.assertEqual(error, "")
+        self.assertEqual([song.title for song in results], ['a', 'b', 'c'])
+        song, _ = client.get('ｈｅｌｌｏ world', 2)
+        self.assertEqual(song.title, 'b')
+        self.assertEqual(len(session.calls), 1)
+
+    def test_empty_result_is_negative_cached(self):
+        session = FakeSession(FakeResponse({'code': 200, 'data': []}))
+        client = MusicSearchClient(session)
+        self.assertEqual(client.search('nothing'), ([], ""))
+        self.assertEqual(client.search('nothing'), ([], ""))
+        self.assertEqual(len(session.calls), 1)
+        self.assertEqual(client.stats['negative_hits'], 1)
+
+    def test_api_errors_are_reported_and_not_cached(self):
+        session = FakeSession(FakeResponse({'code': 429, 'text': '请求过于频繁'}),
+                              FakeResponse({}, status_code=502),
+                              FakeResponse(songs('a')))
+        client = MusicSearchClient(session)
+        self.assertEqual(client.search('song'), ([], "QQ音乐搜索失败: 请求过于频繁"))
+        results, error = client.search('song')
+        self.assertEqual(results, [])
+        self.assertTrue(error)
+        results, error = client.search('song')
+        self.assertEqual((len(results), error), (1, ""))
+        self.assertEqual(len(session.calls), 3)
+
+    def test_fetch_bypasses_and_keeps_cache(self):
+        fresh = {'code': 200, 'data': {'title': 'b', 'singer': 'singer', 'url': 'http://music/new.mp3'}}
+        session = FakeSession(FakeResponse(songs('a', 'b')), FakeResponse(fresh))
+        client = MusicSearchClient(session)
+        client.search('song')
+        song, error = client.fetch('song', 2)
+        self.assertEqual((song.url, song.index, error), ('http://music/new.mp3', 2, ""))
+        self.assertEqual(session.calls[-1], {'msg': 'song', 'n': 2})
+        self.assertEqual(client.get('song', 2)[0].url, 'http://music/2.mp3')
+        self.assertEqual(len(session.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# 播放列表测试：删除正在播放的最后一首、点歌队列播放到末尾
+import unittest
+
+from modules.playlist import Playlist
+
+
+def playlist_of(*names, consume=False):
+    playlist = Playlist(consume=consume)
+    songs = [playlist.add(f'http://music/{name}.mp3', title=name)[0] for name in names]
+    return playlist, songs
+
+
+class PlaylistEndTest(unittest.TestCase):
+
+    def test_removing_playing_last_song_does_not_restart_from_head(self):
+        playlist, (a, b, c) = playlist_of('a', 'b', 'c')
+        for _ in range(3):
+            playlist.advance()
+        self.assertEqual(playlist.current_id, c.id)
+        playlist.remove(c.id)
+        self.assertIsNone(playlist.peek_next())
+        self.assertEqual(playlist.upcoming(), [])
+
+    def test_song_added_after_end_plays_next(self):
+        playlist, (a, b) = playlist_of('a', 'b')
+        playlist.advance()
+        playlist.advance()
+        playlist.remove(b.id)
+        d, _ = playlist.add('http://music/d.mp3', title='d')
+        self.assertEqual(playlist.peek_next(), d)
+        self.assertEqual(playlist.advance(), d)
+
+    def test_removing_playing_middle_song_resumes_after_it(self):
+        playlist, (a, b, c) = playlist_of('a', 'b', 'c')
+        playlist.advance()
+        playlist.advance()
+        playlist.remove(b.id)
+        self.assertEqual(playlist.peek_next(), c)
+
+    def test_loop_mode_still_wraps_after_removing_last_song(self):
+        playlist, (a, b, c) = playlist_of('a', 'b', 'c')
+        playlist.set_mode('loop')
+        for _ in range(3):
+            playlist.advance()
+        playlist.remove(c.id)
+        self.assertEqual(playlist.peek_next(), a)
+
+    def test_consume_finish_removes_last_song_once(self):
+        playlist, (a,) = playlist_of('a', consume=True)
+        playlist.advance()
+        self.assertIsNone(playlist.peek_next())
+        self.assertEqual(playlist.finish(), a)
+        self.assertEqual(len(playlist), 0)
+        self.assertIsNone(playlist.finish())
+
+    def test_finish_keeps_songs_without_consume(self):
+        playlist, (a,) = playlist_of('a')
+        playlist.advance()
+        self.assertIsNone(playlist.finish())
+        self.assertEqual(playlist.current_id, a.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# 房间操作测试：响应分类，离开房间和发送消息遇到休息室跳转
+import asyncio
+import unittest
+
+from aiohttp import web
+
+from api.drrr_api import ACTION_AUTH_LOST, ACTION_ERROR, ACTION_OK, ACTION_REDIRECT, DRRRAPI
+
+LOUNGE = '{"redirect":"lounge"}'
+
+
+async def lounge(request):
+    return web.Response(text=LOUNGE)
+
+
+class ClassifyActionResponseTest(unittest.TestCase):
+
+    def test_lounge_redirect_depends_on_action(self):
+        self.assertEqual(DRRRAPI.classify_action_response(200, LOUNGE, "leave"), ACTION_OK)
+        self.assertEqual(DRRRAPI.classify_action_response(200, LOUNGE, "kick"), ACTION_REDIRECT)
+        self.assertEqual(DRRRAPI.classify_action_response(200, '{"redirect":"/"}', "kick"), ACTION_AUTH_LOST)
+        self.assertEqual(DRRRAPI.classify_action_response(200, '{"error":"no"}', "ban"), ACTION_ERROR)
+
+    def test_non_json_body_is_not_guessed(self):
+        self.assertEqual(DRRRAPI.classify_action_response(200, "<html>返回休息室 lounge</html>", "kick"), ACTION_OK)
+
+
+class LoungeRedirectTest(unittest.TestCase):
+
+    def post(self, call):
+        async def run():
+            app = web.Application()
+            app.router.add_post('/room/', lounge)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            api = DRRRAPI()
+            api.base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            api.room_id, api.room_info = "room", {"room": {}}
+            try:
+                return api, await call(api)
+            finally:
+                await api.close()
+                await runner.cleanup()
+        return asyncio.run(run())
+
+    def test_leave_succeeds_and_clears_room(self):
+        api, result = self.post(lambda api: api.leave_room())
+        self.assertTrue(result["success"])
+        self.assertIsNone(api.room_id)
+        self.assertIsNone(api.room_info)
+
+    def test_send_message_succeeds_with_warning(self):
+        _, result = self.post(lambda api: api.send_message("hi"))
+        self.assertTrue(result["success"])
+        self.assertIn("重定向", result["message"])
+
+    def test_kick_fails(self):
+        _, result = self.post(lambda api: api.kick_user("someone"))
+        self.assertFalse(result["success"])
+        self.assertEqual(result["status"], ACTION_REDIRECT)
+
+
+if __name__ == '__main__':
+    unittest.main()
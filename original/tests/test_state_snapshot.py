@@ -0,0 +1,95 @@
+# 状态快照测试：只追加字段的增量、恢复和截取
+import json
+import os
+import tempfile
+import unittest
+
+from utils.state_snapshot import StateSnapshot
+
+
+class StateSnapshotAppendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def snapshot(self, limit=5):
+        return StateSnapshot(self.path, append_fields={'talks': limit})
+
+    def deltas(self):
+        with open(self.path + '.delta', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_deltas_contain_only_new_items(self):
+        snapshot = self.snapshot()
+        snapshot.load()
+        snapshot.save({'talks': ['a', 'b'], 'mode': 1}, full=True)
+        snapshot.save({'talks': ['a', 'b', 'c'], 'mode': 1})
+        snapshot.save({'talks': ['b', 'c', 'd', 'e'], 'mode': 2})
+        self.assertFalse(snapshot.save({'talks': ['b', 'c', 'd', 'e'], 'mode': 2}))
+        deltas = self.deltas()
+        self.assertEqual([delta.get('append') for delta in deltas], [{'talks': ['c']}, {'talks': ['d', 'e']}])
+        self.assertEqual(deltas[1]['state'], {'mode': 2})
+
+    def test_load_appends_and_trims(self):
+        snapshot = self.snapshot(limit=3)
+        snapshot.load()
+        snapshot.save({'talks': ['a', 'b']}, full=True)
+        snapshot.save({'talks': ['a', 'b', 'c']})
+        snapshot.save({'talks': ['b', 'c', 'd']})
+        self.assertEqual(self.snapshot(limit=3).load(), {'talks': ['b', 'c', 'd']})
+
+    def test_rolled_over_list_is_written_whole(self):
+        snapshot = self.snapshot()
+        snapshot.load()
+        snapshot.save({'talks': ['a']}, full=True)
+        snapshot.save({'talks': ['x', 'y']})
+        self.assertEqual(self.deltas()[0]['state'], {'talks': ['x', 'y']})
+        reloaded = self.snapshot()
+        self.assertEqual(reloaded.load(), {'talks': ['x', 'y']})
+        reloaded.save({'talks': ['x', 'y', 'z']})
+        self.assertEqual(self.deltas()[-1]['append'], {'talks': ['z']})
+
+    def test_full_snapshot_contains_whole_list(self):
+        snapshot = self.snapshot()
+        snapshot.load()
+        snapshot.save({'talks': ['a']}, full=True)
+        snapshot.save({'talks': ['a', 'b']})
+        snapshot.save({'talks': ['a', 'b', 'c']}, full=True)
+        self.assertFalse(os.path.exists(self.path + '.delta'))
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['state'], {'talks': ['a', 'b', 'c']})
+
+    def test_torn_delta_line_is_not_appended_to(self):
+        snapshot = self.snapshot(limit=100)
+        snapshot.load()
+        snapshot.save({'a': 1, 'talks': [1]}, full=True)
+        snapshot.save({'a': 2, 'talks': [1, 2]})
+        with open(self.path + '.delta', 'rb') as f:
+            line = f.read()
+        with open(self.path + '.delta', 'ab') as f:
+            f.write(line[:15])
+
+        restarted = self.snapshot(limit=100)
+        self.assertEqual(restarted.load(), {'a': 2, 'talks': [1, 2]})
+        restarted.save({'a': 3, 'talks': [1, 2, 3]})
+        restarted.save({'a': 3, 'talks': [1, 2, 3, 4]})
+        self.assertEqual(self.snapshot(limit=100).load(), {'a': 3, 'talks': [1, 2, 3, 4]})
+
+    def test_torn_multibyte_character_is_treated_as_damage(self):
+        snapshot = self.snapshot()
+        snapshot.load()
+        snapshot.save({'name': 'a'}, full=True)
+        with open(self.path + '.delta', 'wb') as f:
+            f.write('{"seq":2,"time":0,"state":{"name":"中'.encode('utf-8')[:-1])
+        restarted = self.snapshot()
+        self.assertEqual(restarted.load(), {'name': 'a'})
+        restarted.save({'name': 'b'})
+        self.assertEqual(self.snapshot().load(), {'name': 'b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# 流式输出测试：SSE/分块解析和按长度分段编号
+import unittest
+
+from utils.streaming import (StreamSegmenter, extract_stream_text, iter_fake_stream,
+                             iter_response_text, iter_sse_text)
+
+
+class FakeResponse:
+    """模拟 requests 的流式响应"""
+
+    def __init__(self, content_type, lines=(), chunks=()):
+        self.headers = {'Content-Type': content_type}
+        self.encoding = None
+        self._lines = list(lines)
+        self._chunks = list(chunks)
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self._lines)
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        return iter(self._chunks)
+
+
+class StreamSegmenterTest(unittest.TestCase):
+
+    def segments(self, pieces, size=10):
+        segmenter = StreamSegmenter(size)
+        result = []
+        for piece in pieces:
+            result.extend(segmenter.feed(piece))
+        last = segmenter.finish()
+        if last:
+            result.append(last)
+        return result
+
+    def test_short_reply_is_not_numbered(self):
+        self.assertEqual(self.segments(["hello"]), ["hello"])
+
+    def test_segments_are_numbered_and_last_has_total(self):
+        self.assertEqual(self.segments(["abcdefgh", "ijklmnop", "qrstuvwxy"]),
+                         ["[1/…] abcdefghij", "[2/…] klmnopqrst", "[3/3] uvwxy"])
+
+    def test_reply_ending_on_boundary_still_gets_total(self):
+        # 正好20个字符：第二段要等流结束才输出，才能标上总数
+        self.assertEqual(self.segments(["a" * 10, "b" * 10]), ["[1/…] " + "a" * 10, "[2/2] " + "b" * 10])
+
+    def test_segment_is_emitted_as_soon_as_it_is_full(self):
+        segmenter = StreamSegmenter(5)
+        self.assertEqual(segmenter.feed("abcde"), [])
+        self.assertEqual(segmenter.feed("f"), ["[1/…] abcde"])
+        self.assertEqual(segmenter.count, 1)
+
+    def test_whitespace_tail_is_dropped(self):
+        self.assertEqual(self.segments(["abcdefghij", "  "]), ["[1/…] abcdefghij"])
+        self.assertEqual(self.segments(["   "]), [])
+
+
+class StreamParserTest(unittest.TestCase):
+
+    def test_extract_stream_text_formats(self):
+        self.assertEqual(extract_stream_text('{"content": "你好"}'), "你好")
+        self.assertEqual(extract_stream_text('{"choices": [{"delta": {"content": "hi"}}]}'), "hi")
+        self.assertEqual(extract_stream_text('{"choices": [{"delta": {}}]}'), "")
+        self.assertEqual(extract_stream_text('"quoted"'), "quoted")
+        self.assertEqual(extract_stream_text('plain text'), "plain text")
+        self.assertEqual(extract_stream_text('[1, 2]'), "")
+
+    def test_sse_stops_at_done_and_skips_other_lines(self):
+        lines = [": keep-alive", "event: message", 'data: {"content": "a"}', "", "data: b",
+                 'data: {"choices": [{"delta": {}}]}', "data: [DONE]", "data: after"]
+        self.assertEqual(list(iter_sse_text(lines)), ["a", "b"])
+
+    def test_response_text_uses_sse_for_event_stream(self):
+        response = FakeResponse('text/event-stream; charset=utf-8', lines=['data: {"content": "x"}', 'data: [DONE]'])
+        self.assertEqual(list(iter_response_text(response)), ["x"])
+        self.assertEqual(response.encoding, 'utf-8')
+
+    def test_response_text_passes_plain_chunks_through(self):
+        response = FakeResponse('text/plain', chunks=["第一", "", "第二"])
+        self.assertEqual(list(iter_response_text(response)), ["第一", "第二"])
+
+    def test_fake_stream_reassembles_text(self):
+        self.assertEqual(''.join(iter_fake_stream("0123456789abc", chunk_size=4, delay=0)), "0123456789abc")
+
+
+if __name__ == '__main__':
+    unittest.main()
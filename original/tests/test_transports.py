@@ -0,0 +1,149 @@
+# 消息传输测试：用本地WebSocket和HTTP替身服务器验证推送、心跳和长轮询退避
+import asyncio
+import json
+import time
+import unittest
+
+import aiohttp
+import websockets
+from aiohttp import web
+
+from api.websocket_client import (DRRRWebSocketClient, LongPollTransport, TalkTransport,
+                                  WebSocketTransport, TRANSPORT_WEBSOCKET)
+
+
+def talk(talk_id, message="hi"):
+    return {"id": talk_id, "type": "message", "message": message, "from": {"id": "u1", "name": "user"}}
+
+
+class WebSocketTransportTest(unittest.TestCase):
+
+    def test_receives_pushed_talks_through_client(self):
+        cookies = []
+
+        async def handler(connection):
+            cookies.append(connection.request.headers.get("Cookie"))
+            await connection.send(json.dumps({"talks": [talk("1"), talk("2")]}))
+            # 重复消息和心跳回应不应再次分发
+            await connection.send(json.dumps(talk("1")))
+            await connection.send(json.dumps({"type": "pong"}))
+            await connection.send("not json")
+            await connection.send(json.dumps({"room": {"talks": [talk("3", "last")]}}))
+            await connection.wait_closed()
+
+        async def run():
+            async with websockets.serve(handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                client = DRRRWebSocketClient("http://127.0.0.1:1", mode=TRANSPORT_WEBSOCKET,
+                                             ws_url=f"ws://127.0.0.1:{port}", fallback_polling=False)
+                received = []
+
+                async def on_talk(item):
+                    received.append(item)
+                    if len(received) == 3:
+                        await client.close()
+
+                client.register_talk_handler(on_talk)
+                await asyncio.wait_for(client.connect("session=abc", "room"), timeout=5)
+                return received
+
+        received = asyncio.run(run())
+        self.assertEqual([item["id"] for item in received], ["1", "2", "3"])
+        self.assertEqual(cookies, ["session=abc"])
+
+    def test_sends_heartbeat_when_idle(self):
+        pings = []
+
+        async def handler(connection):
+            async for message in connection:
+                pings.append(json.loads(message))
+                await connection.send(json.dumps(talk("done")))
+
+        async def run():
+            async with websockets.serve(handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                transport = WebSocketTransport(f"ws://127.0.0.1:{port}", heartbeat_interval=0.1)
+                async with aiohttp.ClientSession() as session:
+                    await transport.open(session)
+                    try:
+                        async for item in transport.talks():
+                            return item
+                    finally:
+                        await transport.close()
+
+        item = asyncio.run(asyncio.wait_for(run(), timeout=5))
+        self.assertEqual(item["id"], "done")
+        self.assertEqual(pings, [{"type": "ping"}])
+
+
+class LongPollTransportTest(unittest.TestCase):
+
+    def poll(self, responses, duration, **kwargs):
+        """让长轮询运行 duration 秒，返回 (请求列表, 收到的消息)，请求为 (时间, update参数)"""
+        requests = []
+
+        async def handle(request):
+            requests.append((time.monotonic(), request.query.get('update')))
+            body = responses[len(requests) - 1] if len(requests) <= len(responses) else {}
+            return web.json_response(body)
+
+        async def run():
+            app = web.Application()
+            app.router.add_get('/json.php', handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            transport = LongPollTransport(f"http://127.0.0.1:{port}", **kwargs)
+            received = []
+
+            async def consume():
+                async for item in transport.talks():
+                    received.append(item)
+
+            async with aiohttp.ClientSession() as session:
+                await transport.open(session)
+                task = asyncio.create_task(consume())
+                await asyncio.sleep(duration)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            await runner.cleanup()
+            return received
+
+        received = asyncio.run(run())
+        return requests, received
+
+    def test_immediate_empty_responses_back_off(self):
+        requests, _ = self.poll([], 1.0, min_interval=0.1, max_interval=0.4)
+        # 间隔 0.1, 0.2, 0.4, 0.4 ... 1秒内最多5次请求，不会形成忙循环
+        self.assertLessEqual(len(requests), 5)
+        gaps = [b[0] - a[0] for a, b in zip(requests, requests[1:])]
+        self.assertTrue(all(gap >= 0.09 for gap in gaps), gaps)
+
+    def test_talks_reset_backoff_and_update_cursor(self):
+        responses = [{}, {}, {"update": 5, "talks": [talk("1")]}, {"talks": [talk("1"), talk("2")]}]
+        requests, received = self.poll(responses, 0.8, min_interval=0.05, max_interval=1.0)
+        self.assertEqual([item["id"] for item in received], ["1", "2"])
+        self.assertGreaterEqual(len(requests), 4)
+        self.assertEqual(requests[3][1], "5")
+
+
+class TalkTransportTest(unittest.TestCase):
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            TalkTransport()
+
+        class Incomplete(TalkTransport):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == '__main__':
+    unittest.main()
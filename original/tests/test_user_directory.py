@@ -0,0 +1,46 @@
+# 用户目录测试：首次快照的加入时间和并发查询
+import threading
+import unittest
+
+from modules.user_directory import UserDirectory
+
+
+def snapshot(*ids):
+    return [{'id': user_id, 'name': f'user{user_id}'} for user_id in ids]
+
+
+class UserDirectoryTest(unittest.TestCase):
+
+    def test_first_snapshot_users_are_not_recent(self):
+        directory = UserDirectory()
+        directory.update(snapshot('a', 'b'))
+        directory.update(snapshot('a', 'b', 'c'))
+        self.assertEqual([user['id'] for user in directory.select(joined_within=60)], ['c'])
+
+    def test_select_while_updating(self):
+        directory = UserDirectory()
+        stop = threading.Event()
+        errors = []
+
+        def churn():
+            i = 0
+            while not stop.is_set():
+                directory.update(snapshot(*(str(n) for n in range(i % 50, i % 50 + 50))))
+                i += 7
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            for _ in range(2000):
+                try:
+                    directory.select(pattern='user')
+                except RuntimeError as e:
+                    errors.append(e)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
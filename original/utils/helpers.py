@@ -1,5 +1,8 @@
 # 工具函数模块
 import re
+import time
+import unicodedata
+from urllib.parse import parse_qs, urlparse
 
 def validate_room_id(room_id):
     """验证房间ID格式"""
@@ -24,4 +27,26 @@ def is_valid_guess(guess):
     """验证猜数字输入"""
     return (len(guess) == 4 and 
             guess.isdigit() and 
-            len(set(guess)) == 4)
\ No newline at end of file
+            len(set(guess)) == 4)
+
+def normalize_name(name):
+    """规范化用户名（忽略大小写和全角/半角差异）"""
+    return unicodedata.normalize('NFKC', name or '').casefold().strip()
+
+def normalize_prompt(text):
+    """规范化提问内容（忽略大小写、全角/半角、多余空白和结尾标点），用作缓存键"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return re.sub(r'\s+', ' ', text).strip().rstrip('?!.。？！~～ ')
+
+# 链接中可能携带过期时间戳的查询参数
+_EXPIRY_PARAMS = ('expires', 'Expires', 'expire', 'x-expires', 'e', 't')
+
+def link_expiry(url, default, margin=60):
+    """从链接的查询参数中读取过期时间（提前 margin 秒），读不到或不合理时返回 default"""
+    now = time.time()
+    query = parse_qs(urlparse(url).query)
+    for name in _EXPIRY_PARAMS:
+        for value in query.get(name, []):
+            if value.isdigit() and len(value) == 10 and int(value) > now:
+                return min(default, int(value) - margin)
+    return default
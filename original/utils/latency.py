@@ -0,0 +1,34 @@
+# 延迟统计模块
+import threading
+from collections import deque
+from typing import Optional
+
+
+class LatencyTracker:
+    """接口延迟统计
+
+    维护延迟的指数加权移动平均（EWMA）和最近若干次的样本，用于估计分位数（如p90）。
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 50):
+        self.alpha = alpha  # EWMA平滑系数，越大越偏向最近的样本
+        self.samples = deque(maxlen=window)  # 最近的延迟样本（秒）
+        self.ewma: Optional[float] = None
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """记录一次延迟"""
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def percentile(self, q: float, min_samples: int = 5) -> Optional[float]:
+        """最近样本的分位数，样本不足时返回None"""
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
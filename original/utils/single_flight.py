@@ -0,0 +1,75 @@
+# 请求合并模块
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class _Call:
+    """一次进行中的调用"""
+    __slots__ = ('event', 'result', 'error', 'callbacks')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.callbacks: List[Callable[[Any], None]] = []
+
+
+class SingleFlight:
+    """相同请求合并（single-flight）
+
+    同一个键同时只执行一次上游调用，期间到达的相同请求等待并共享这次调用的结果，
+    调用结束后键即被释放，之后的请求会重新调用。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0  # 实际执行的调用次数
+        self.shared = 0  # 被合并（未实际调用）的请求次数
+
+    def in_flight(self, key: Hashable) -> bool:
+        """该键是否有调用正在进行"""
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """执行调用，或等待正在进行的相同调用并返回其结果（异常同样会共享）"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                callbacks = call.callbacks
+            call.event.set()
+            for callback in callbacks:
+                try:
+                    callback(call.result if call.error is None else None)
+                except Exception as e:
+                    print(f"合并请求回调出错: {e}")
+
+    def subscribe(self, key: Hashable, callback: Callable[[Any], None]) -> bool:
+        """不阻塞地等待正在进行的相同调用：有则注册回调（失败时参数为None）并返回True，否则返回False"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                return False
+            call.callbacks.append(callback)
+            self.shared += 1
+            return True
@@ -0,0 +1,177 @@
+# 状态快照模块
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class StateSnapshot:
+    """崩溃安全的状态快照
+
+    完整快照写入临时文件、fsync 后用 os.replace 原子替换，任何时刻磁盘上都是一份完整的快照。
+    两次完整快照之间只把发生变化的顶层字段追加到增量日志（每行一条，带递增序号）；
+    增量条数达到 max_deltas 或距上次完整快照超过 full_interval 秒时重写完整快照并清空日志。
+    加载时先读完整快照，再按序号应用其后的增量，写了一半的末行会被忽略；
+    增量日志中有损坏的行时立即重写完整快照，之后追加的增量不会接在损坏的行后面。
+    append_fields 中的字段是只在末尾追加、从开头淘汰的列表（字段名 -> 最多保留的条数），
+    增量中只写入上次保存之后新追加的元素，加载时追加到末尾并截取最后的条数。
+    """
+
+    def __init__(self, path: str, full_interval: float = 10 * 60, max_deltas: int = 100,
+                 append_fields: Optional[Dict[str, int]] = None):
+        self.path = path  # 完整快照文件
+        self.delta_path = f"{path}.delta"  # 增量日志文件
+        self.full_interval = full_interval  # 两次完整快照的最长间隔（秒）
+        self.max_deltas = max_deltas  # 增量日志最多的条数
+        self.append_fields = dict(append_fields or {})  # 只追加的列表字段 -> 最多保留的条数
+        self._lock = threading.Lock()
+        self._seq = 0  # 最后写入的序号
+        self._deltas = 0  # 上次完整快照之后的增量条数
+        self._last_full = 0.0
+        self._saved: Dict[str, str] = {}  # 各字段最后保存的序列化结果，用于比较是否变化
+        self._tails: Dict[str, Tuple] = {}  # 只追加字段最后保存的末尾元素（空列表为空元组）
+        self.saved_at: Optional[float] = None  # 已保存状态的时间
+
+    def load(self) -> Dict[str, Any]:
+        """读取快照并应用增量，没有快照时返回空字典"""
+        with self._lock:
+            state: Dict[str, Any] = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                state = snapshot.get('state', {})
+                self._seq = snapshot.get('seq', 0)
+                self.saved_at = snapshot.get('time')
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"读取状态快照失败: {e}")
+
+            damaged = False
+            try:
+                # 写了一半的多字节字符按损坏的行处理
+                with open(self.delta_path, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        # 没有换行结尾的行之后追加时会和新行连在一起
+                        damaged = damaged or not line.endswith('\n')
+                        try:
+                            delta = json.loads(line)
+                        except ValueError:
+                            # 崩溃时写了一半的行
+                            damaged = True
+                            continue
+                        # 序号不大于快照的增量已包含在快照中
+                        if delta.get('seq', 0) <= self._seq:
+                            continue
+                        state.update(delta.get('state', {}))
+                        for key, items in delta.get('append', {}).items():
+                            state[key] = self._trim(key, (state.get(key) or []) + items)
+                        self._seq = delta['seq']
+                        self.saved_at = delta.get('time', self.saved_at)
+                        self._deltas += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"读取状态增量失败: {e}")
+
+            self._saved = {key: _dumps(value) for key, value in state.items() if key not in self.append_fields}
+            self._remember_tails(state)
+            self._last_full = time.time()
+            if damaged:
+                try:
+                    self._write_full({key: _dumps(value) for key, value in state.items()}, self._last_full)
+                except (OSError, TypeError, ValueError) as e:
+                    # 重写失败时下次保存写完整快照
+                    self._last_full = 0.0
+                    print(f"重写状态快照失败: {e}")
+            return state
+
+    def _trim(self, key: str, items: List[Any]) -> List[Any]:
+        limit = self.append_fields.get(key)
+        return items[-limit:] if limit else items
+
+    def _remember_tails(self, state: Dict[str, Any]):
+        for key in self.append_fields:
+            if key in state:
+                self._tails[key] = tuple(state[key][-1:])
+
+    def _new_items(self, key: str, items: List[Any]) -> Optional[List[Any]]:
+        """上次保存之后追加的元素，无法确定时（从未保存或旧元素已全部淘汰）返回None"""
+        if key not in self._tails:
+            return None
+        if not self._tails[key]:
+            return list(items)
+        tail = self._tails[key][0]
+        for i in range(len(items) - 1, -1, -1):
+            if items[i] == tail:
+                return list(items[i + 1:])
+        return None
+
+    def save(self, state: Dict[str, Any], full: bool = False) -> bool:
+        """保存状态，只写入变化的字段；full为True时强制写完整快照。返回是否写入了数据"""
+        with self._lock:
+            encoded = {key: _dumps(value) for key, value in state.items() if key not in self.append_fields}
+            changed = {key: value for key, value in encoded.items() if self._saved.get(key) != value}
+            appended = {}
+            for key in self.append_fields:
+                if key not in state:
+                    continue
+                new_items = self._new_items(key, state[key])
+                if new_items is None:
+                    changed[key] = _dumps(state[key])
+                elif new_items:
+                    appended[key] = _dumps(new_items)
+            now = time.time()
+            if not changed and not appended and not full:
+                return False
+            try:
+                if full or self._deltas >= self.max_deltas or now - self._last_full >= self.full_interval:
+                    for key in self.append_fields:
+                        if key in state:
+                            encoded[key] = changed.get(key) or _dumps(state[key])
+                    self._write_full(encoded, now)
+                else:
+                    self._write_delta(changed, appended, now)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"保存状态快照失败: {e}")
+                return False
+            self._saved = {key: value for key, value in encoded.items() if key not in self.append_fields}
+            self._remember_tails(state)
+            self.saved_at = now
+            return True
+
+    def _write_delta(self, changed: Dict[str, str], appended: Dict[str, str], now: float):
+        self._seq += 1
+        body = ','.join(f"{json.dumps(key, ensure_ascii=False)}:{value}" for key, value in changed.items())
+        line = f'{{"seq":{self._seq},"time":{now},"state":{{{body}}}'
+        if appended:
+            items = ','.join(f"{json.dumps(key, ensure_ascii=False)}:{value}" for key, value in appended.items())
+            line += f',"append":{{{items}}}'
+        line += '}\n'
+        with open(self.delta_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._deltas += 1
+
+    def _write_full(self, encoded: Dict[str, str], now: float):
+        self._seq += 1
+        body = ','.join(f"{json.dumps(key, ensure_ascii=False)}:{value}" for key, value in encoded.items())
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f'{{"seq":{self._seq},"time":{now},"state":{{{body}}}}}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # 快照已包含所有增量；即使清空前崩溃，旧增量的序号也不大于快照序号，加载时会被跳过
+        try:
+            os.remove(self.delta_path)
+        except FileNotFoundError:
+            pass
+        self._deltas = 0
+        self._last_full = now
@@ -0,0 +1,91 @@
+# 流式输出模块
+import json
+import time
+from typing import Iterable, Iterator, List, Optional
+
+
+class StreamSegmenter:
+    """将流式到达的文本切分为固定长度的消息段
+
+    每凑满 size 个字符立即产出一段，编号为 [k/…]；流结束时剩余文本作为最后一段，
+    编号为 [n/n]。因此不需要预先知道总段数。只有一段时不加编号。
+    """
+
+    def __init__(self, size: int = 100):
+        self.size = size
+        self.buffer = ""
+        self.count = 0  # 已产出的段数
+
+    def _number(self, text: str, final: bool) -> str:
+        self.count += 1
+        if final:
+            return f"[{self.count}/{self.count}] {text}" if self.count > 1 else text
+        return f"[{self.count}/…] {text}"
+
+    def feed(self, text: str) -> List[str]:
+        """追加文本，返回已凑满的消息段"""
+        self.buffer += text
+        segments = []
+        while len(self.buffer) > self.size:
+            # 多保留一个字符，确保最后一段在流结束时才输出并带上总数
+            segment, self.buffer = self.buffer[:self.size], self.buffer[self.size:]
+            segments.append(self._number(segment, False))
+        return segments
+
+    def finish(self) -> Optional[str]:
+        """流结束，返回最后一段"""
+        if not self.buffer.strip():
+            return None
+        segment, self.buffer = self.buffer, ""
+        return self._number(segment, True)
+
+
+def extract_stream_text(payload: str) -> str:
+    """从一条流式数据中提取文本，支持 {"content": ...}、OpenAI风格的 delta 和纯文本"""
+    try:
+        data = json.loads(payload)
+    except (json.JSONDecodeError, ValueError):
+        return payload
+    if isinstance(data, str):
+        return data
+    if not isinstance(data, dict):
+        return ""
+    if isinstance(data.get('content'), str):
+        return data['content']
+    choices = data.get('choices') or []
+    if choices and isinstance(choices[0], dict):
+        delta = choices[0].get('delta') or choices[0].get('message') or {}
+        return delta.get('content') or ""
+    return ""
+
+
+def iter_sse_text(lines: Iterable[str]) -> Iterator[str]:
+    """解析SSE（text/event-stream）数据行，逐个产出文本片段"""
+    for line in lines:
+        if not line or not line.startswith('data:'):
+            continue
+        payload = line[5:].strip()
+        if payload == '[DONE]':
+            return
+        text = extract_stream_text(payload)
+        if text:
+            yield text
+
+
+def iter_response_text(response) -> Iterator[str]:
+    """从 requests 的流式响应中逐个产出文本片段（SSE 或分块传输的纯文本）"""
+    response.encoding = response.encoding or 'utf-8'
+    if 'text/event-stream' in response.headers.get('Content-Type', ''):
+        yield from iter_sse_text(response.iter_lines(decode_unicode=True))
+    else:
+        for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+            if chunk:
+                yield chunk
+
+
+def iter_fake_stream(text: str, chunk_size: int = 8, delay: float = 0.05) -> Iterator[str]:
+    """本地模拟的流式输出，用于没有流式接口时测试分段发送"""
+    for i in range(0, len(text), chunk_size):
+        if delay:
+            time.sleep(delay)
+        yield text[i:i + chunk_size]
@@ -0,0 +1,152 @@
+# 缓存模块
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class TTLCache:
+    """带过期时间的LRU缓存
+
+    内存中按最近使用顺序保存最多 max_size 条记录，记录超过 ttl 秒后失效。
+    指定 path 时使用SQLite作为持久层，重启后仍可命中；内存未命中时从磁盘读取并提升到内存。
+    值需可被JSON序列化。
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600, path: Optional[str] = None,
+                 max_disk_entries: int = 5000):
+        self.max_size = max_size  # 内存中最多保存的条数
+        self.ttl = ttl  # 过期时间（秒）
+        self.path = path  # SQLite文件路径，为None时仅使用内存
+        self.max_disk_entries = max_disk_entries  # 磁盘中最多保存的条数
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # 键 -> (值, 过期时间)
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open_db()
+
+    def _open_db(self):
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"打开缓存数据库失败，仅使用内存缓存: {e}")
+            self._db = None
+
+    def __len__(self):
+        return len(self._data)
+
+    def _put_memory(self, key: str, value: Any, expires: float):
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _get_disk(self, key: str, now: float):
+        if not self._db:
+            return None
+        try:
+            row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"读取缓存数据库失败: {e}")
+            return None
+        if not row or row[1] <= now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _prune_disk(self, now: float):
+        """删除磁盘中过期和超出数量上限的记录"""
+        self._db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        self._db.execute("DELETE FROM cache WHERE key NOT IN "
+                         "(SELECT key FROM cache ORDER BY expires DESC LIMIT ?)", (self.max_disk_entries,))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """读取缓存，未命中或已过期时返回 default"""
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                del self._data[key]
+            item = self._get_disk(key, now)
+            if item is not None:
+                self._put_memory(key, item[0], item[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return item[0]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存"""
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put_memory(key, value, expires)
+            if not self._db:
+                return
+            try:
+                self._db.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(value, ensure_ascii=False), expires))
+                self._disk_writes += 1
+                if self._disk_writes % 100 == 0:
+                    self._prune_disk(now)
+                self._db.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"写入缓存数据库失败: {e}")
+
+    def delete(self, key: str):
+        """删除缓存"""
+        with self._lock:
+            self._data.pop(key, None)
+            if self._db:
+                try:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"删除缓存记录失败: {e}")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            if self._db:
+                try:
+                    self._db.execute("DELETE FROM cache")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"清空缓存数据库失败: {e}")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息"""
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+        }
+
+    def close(self):
+        """关闭持久层"""
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,99 @@
+# 工作线程池模块
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+
+class WorkerPool:
+    """有界工作线程池
+
+    用于执行会阻塞的第三方接口调用，调用方（如监控线程）提交后立即返回。
+    排队的任务数和每个用户同时进行的任务数都有上限，超出时直接拒绝并返回原因；
+    关闭时取消所有尚未开始的任务。
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16, per_user_limit: int = 1,
+                 name: str = "worker"):
+        self.max_workers = max_workers  # 同时执行的任务数
+        self.max_queue = max_queue  # 最多排队等待的任务数
+        self.per_user_limit = per_user_limit  # 每个用户同时进行（含排队）的任务数
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0  # 已提交未完成的任务数（含正在执行）
+        self._per_user: Dict[str, int] = {}
+        self._closed = False
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def pending(self) -> int:
+        """已提交未完成的任务数（含正在执行）"""
+        with self._lock:
+            return self._pending
+
+    def waiting(self) -> int:
+        """正在排队等待执行的任务数"""
+        with self._lock:
+            return max(0, self._pending - self.max_workers)
+
+    def in_flight(self, user_key: str) -> int:
+        """某个用户已提交未完成的任务数"""
+        with self._lock:
+            return self._per_user.get(user_key, 0)
+
+    def submit(self, user_key: str, fn: Callable, *args, **kwargs) -> Tuple[Optional[Future], str]:
+        """提交任务，返回 (Future, '')；被拒绝时返回 (None, 拒绝原因)"""
+        with self._lock:
+            if self._closed:
+                reason = "机器人正在关闭，请稍后再试"
+            elif user_key and self._per_user.get(user_key, 0) >= self.per_user_limit:
+                reason = "您的上一个请求还在处理中，请稍后再试"
+            elif self._pending >= self.max_workers + self.max_queue:
+                reason = "当前请求过多，队列已满，请稍后再试"
+            else:
+                reason = ""
+            if reason:
+                self.stats['rejected'] += 1
+                return None, reason
+            self._pending += 1
+            if user_key:
+                self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+            self.stats['submitted'] += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except RuntimeError:
+            # 线程池已关闭
+            self._release(user_key)
+            return None, "机器人正在关闭，请稍后再试"
+        future.add_done_callback(lambda f: self._done(user_key, f))
+        return future, ""
+
+    def _release(self, user_key: str):
+        with self._lock:
+            self._pending -= 1
+            if user_key:
+                count = self._per_user.get(user_key, 0) - 1
+                if count > 0:
+                    self._per_user[user_key] = count
+                else:
+                    self._per_user.pop(user_key, None)
+
+    def _done(self, user_key: str, future: Future):
+        self._release(user_key)
+        with self._lock:
+            if future.cancelled():
+                self.stats['cancelled'] += 1
+                return
+            if future.exception() is None:
+                self.stats['completed'] += 1
+                return
+            self.stats['failed'] += 1
+        print(f"后台任务出错: {future.exception()}")
+
+    def shutdown(self, wait: bool = False):
+        """关闭线程池，取消所有排队中的任务"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)